@@ -0,0 +1,110 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+
+from . import schemas, async_crud, cache, textstore
+from .database import get_async_db
+from .etags import make_etag, etag_matches, not_modified, cached_not_modified, remember_version, set_etag
+
+# Read endpoints on the async engine (DB_ASYNC=true). They run on the event
+# loop instead of the threadpool, so concurrency is bounded by the DB pool
+# rather than by the number of threads. Same paths and responses as main.py.
+
+router = APIRouter()
+
+@router.get("/api/profile/{user_id}", response_model=schemas.UserProfile)
+async def get_profile(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    db_user = await async_crud.get_user(db, user_id)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return db_user
+
+@router.get("/api/users/{user_id}/documents", response_model=schemas.DocumentPage)
+async def list_documents(
+    user_id: int,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    try:
+        return await async_crud.get_documents_page(db, user_id, limit, cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@router.get("/api/documents/{doc_id}/stages", response_model=List[schemas.ReadingStage])
+async def get_stages(doc_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_async_db)):
+    cached = cached_not_modified(request, "stages", doc_id)
+    if cached is not None:
+        return cached
+
+    # Read the version before the stages: a concurrent write can only make the ETag older, never newer
+    row = await async_crud.get_document_version(db, doc_id)
+    if row is None:
+        return []
+    remember_version(doc_id, row.version, row.status)
+    etag = make_etag("stages", doc_id, row.version)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    set_etag(response, etag)
+    stages = await async_crud.get_stages(db, doc_id)
+    # Serializing reads each stage's text from the text store, which is file I/O
+    return await run_in_threadpool(lambda: [schemas.ReadingStage.model_validate(stage) for stage in stages])
+
+@router.get("/api/documents/{doc_id}/status", response_model=schemas.DocumentStatus)
+async def get_document_status(doc_id: int, db: AsyncSession = Depends(get_async_db)):
+    doc = await async_crud.get_document(db, doc_id)
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return schemas.DocumentStatus(document_id=doc.id, status=doc.status, error=doc.error)
+
+@router.get("/api/documents/{doc_id}/text", response_class=PlainTextResponse)
+async def get_document_text(
+    doc_id: int,
+    response: Response,
+    offset: int = Query(0, ge=0),
+    length: Optional[int] = Query(None, ge=1),
+    db: AsyncSession = Depends(get_async_db)
+):
+    row = await async_crud.get_document_text(db, doc_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if row.text_ref is None:
+        raise HTTPException(status_code=404, detail="Text not extracted yet")
+    text, total = await run_in_threadpool(textstore.store.read_range, row.text_ref, offset, length)
+    response.headers["X-Text-Length"] = str(total)
+    return text
+
+@router.get("/api/documents/{doc_id}", response_model=schemas.Document)
+async def get_document(doc_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_async_db)):
+    cached = cached_not_modified(request, "document", doc_id)
+    if cached is not None:
+        return cached
+
+    doc = await async_crud.get_document(db, doc_id)
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    remember_version(doc.id, doc.version, doc.status)
+    etag = make_etag("document", doc.id, doc.version)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    set_etag(response, etag)
+    return doc
+
+@router.get("/api/documents/{doc_id}/summary", response_model=schemas.DocumentSummary)
+async def get_summary(doc_id: int, db: AsyncSession = Depends(get_async_db)):
+    summary = cache.summaries.get(doc_id)
+    if summary is not None:
+        return summary
+
+    summary, status = await async_crud.get_summary(db, doc_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    # Stages are final once the worker is done; note writes invalidate the entry
+    if status in ("ready", "failed"):
+        cache.summaries.set(doc_id, summary)
+    return summary
@@ -0,0 +1,31 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models, crud
+
+# AsyncSession counterparts of the read functions in crud.py. They run the
+# same statements (built by crud's *_query helpers) so the two paths can't
+# drift; anything that would lazy-load must be eager-loaded in the statement.
+
+async def get_user(db: AsyncSession, user_id: int):
+    return await db.get(models.UserProfile, user_id)
+
+async def get_documents_page(db: AsyncSession, user_id: int, limit: int, cursor: str = None):
+    rows = (await db.execute(crud.documents_page_query(user_id, limit, cursor))).all()
+    return crud.build_documents_page(rows, limit)
+
+async def get_document_text(db: AsyncSession, doc_id: int):
+    return (await db.execute(crud.document_text_query(doc_id))).first()
+
+async def get_document(db: AsyncSession, doc_id: int):
+    return await db.get(models.Document, doc_id)
+
+async def get_document_version(db: AsyncSession, doc_id: int):
+    stmt = select(models.Document.version, models.Document.status).where(models.Document.id == doc_id)
+    return (await db.execute(stmt)).first()
+
+async def get_stages(db: AsyncSession, doc_id: int):
+    return (await db.scalars(crud.stages_query(doc_id))).all()
+
+async def get_summary(db: AsyncSession, doc_id: int):
+    return crud.build_summary((await db.execute(crud.summary_query(doc_id))).all(), doc_id)
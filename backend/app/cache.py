@@ -0,0 +1,56 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", "2048"))
+SUMMARY_CACHE_TTL = float(os.getenv("SUMMARY_CACHE_TTL", "300"))  # seconds; bounds staleness across replicas
+VERSION_CACHE_SIZE = int(os.getenv("VERSION_CACHE_SIZE", "10000"))
+VERSION_CACHE_TTL = float(os.getenv("VERSION_CACHE_TTL", "10"))  # seconds a 304 may be answered without the DB
+
+
+class TTLCache:
+    # Small thread-safe LRU with a per-entry time to live. Process local:
+    # every replica invalidates on document events (events.py), the TTL
+    # bounds staleness if the listener is disconnected.
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+summaries = TTLCache(SUMMARY_CACHE_SIZE, SUMMARY_CACHE_TTL)
+versions = TTLCache(VERSION_CACHE_SIZE, VERSION_CACHE_TTL)  # document id -> Document.version
+
+def invalidate_document(doc_id: int):
+    summaries.invalidate(doc_id)
+    versions.invalidate(doc_id)
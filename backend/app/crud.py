@@ -1,5 +1,10 @@
-from sqlalchemy.orm import Session
-from . import models, schemas
+from sqlalchemy import func, select, update, tuple_, case, values, column, true, literal, literal_column, null, cast, union_all, text, Integer, String, Text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session, load_only, joinedload
+from datetime import datetime
+from . import models, schemas, cache, events, search, textstore, messaging
+import base64
+import html
 import json
 
 def create_user(db: Session, user: schemas.UserProfileCreate):
@@ -12,55 +17,430 @@ def create_user(db: Session, user: schemas.UserProfileCreate):
 def get_user(db: Session, user_id: int):
     return db.query(models.UserProfile).filter(models.UserProfile.id == user_id).first()
 
-def create_document(db: Session, document: schemas.DocumentCreate, user_id: int):
-    db_doc = models.Document(**document.dict(), user_id=user_id)
+def enqueue_job(db: Session, queue: str, payload: dict, priority: int = None):
+    # Not committed here: the job becomes visible to the relay with the caller's transaction
+    db.add(models.OutboxMessage(queue=queue, payload=payload, priority=priority))
+
+def get_pipeline_backlog(db: Session, user_id: int) -> int:
+    return db.query(func.count(models.Document.id)).filter(
+        models.Document.user_id == user_id,
+        models.Document.status.in_(("uploaded", "extracting", "planning")),
+    ).scalar()
+
+def create_document(db: Session, document: schemas.DocumentCreate, user_id: int, blob: schemas.BlobCreate):
+    # Concurrent uploads of the same bytes race on the primary key; the loser just reuses the row
+    db.execute(insert(models.Blob).values(**blob.dict()).on_conflict_do_nothing(index_elements=["sha256"]))
+    db_blob = db.query(models.Blob).filter(models.Blob.sha256 == blob.sha256).first()
+
+    # Text already extracted for these bytes: skip straight to planning
+    extracted = db_blob.status == "extracted"
+    db_doc = models.Document(**document.dict(), user_id=user_id, status="planning" if extracted else "uploaded")
     db.add(db_doc)
+    db.flush()
+    if extracted:
+        priority = messaging.plan_priority(get_pipeline_backlog(db, user_id))
+        enqueue_job(db, messaging.READING_PLAN_QUEUE, {"user_id": user_id, "document_id": db_doc.id}, priority)
+    else:
+        enqueue_job(db, messaging.EXTRACTION_QUEUE, {"user_id": user_id, "document_id": db_doc.id})
     db.commit()
     db.refresh(db_doc)
     return db_doc
 
-def get_documents_by_user(db: Session, user_id: int):
-    return db.query(models.Document).filter(models.Document.user_id == user_id).order_by(models.Document.created_at.desc()).all()
+def get_dedup_stats(db: Session):
+    documents, logical_bytes, logical_chars, logical_ms = (
+        db.query(
+            func.count(models.Document.id),
+            func.coalesce(func.sum(models.Blob.size_bytes), 0),
+            func.coalesce(func.sum(models.Blob.text_length), 0),
+            func.coalesce(func.sum(models.Blob.extraction_ms), 0),
+        )
+        .join(models.Blob, models.Document.blob_sha256 == models.Blob.sha256)
+        .one()
+    )
+    blobs, stored_bytes, stored_chars, spent_ms = db.query(
+        func.count(models.Blob.sha256),
+        func.coalesce(func.sum(models.Blob.size_bytes), 0),
+        func.coalesce(func.sum(models.Blob.text_length), 0),
+        func.coalesce(func.sum(models.Blob.extraction_ms), 0),
+    ).one()
+    return schemas.DedupStats(
+        documents=documents,
+        blobs=blobs,
+        logical_bytes=logical_bytes,
+        stored_bytes=stored_bytes,
+        saved_bytes=logical_bytes - stored_bytes,
+        logical_text_chars=logical_chars,
+        stored_text_chars=stored_chars,
+        saved_text_chars=logical_chars - stored_chars,
+        extraction_ms_spent=spent_ms,
+        extraction_ms_saved=logical_ms - spent_ms,
+    )
+
+def get_plan_job_stats(db: Session):
+    # Backlog by ledger status; the oldest update of 'running' shows a stuck worker
+    rows = (
+        db.query(
+            models.PlanJob.status,
+            func.count(models.PlanJob.id),
+            func.coalesce(func.sum(models.PlanJob.attempts), 0),
+            func.avg(models.PlanJob.duration_ms),
+            func.min(models.PlanJob.updated_at),
+        )
+        .group_by(models.PlanJob.status)
+        .all()
+    )
+    return [
+        schemas.PlanJobStats(
+            status=status,
+            jobs=jobs,
+            attempts=attempts,
+            avg_duration_ms=int(avg) if avg is not None else None,
+            oldest_update=oldest,
+        )
+        for status, jobs, attempts, avg, oldest in rows
+    ]
+
+def encode_cursor(created_at: datetime, doc_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{doc_id}".encode()).decode()
+
+def decode_cursor(cursor: str):
+    # Raises ValueError on a malformed cursor
+    created_at, doc_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    return datetime.fromisoformat(created_at), int(doc_id)
+
+def documents_page_query(user_id: int, limit: int, cursor: str = None):
+    # Keyset pagination on (created_at, id): each page is an index range scan,
+    # no matter how deep the client has scrolled
+    stage_count = (
+        select(func.count(models.ReadingStage.id))
+        .where(models.ReadingStage.document_id == models.Document.id)
+        .correlate(models.Document)
+        .scalar_subquery()
+    )
+    query = (
+        select(models.Document, stage_count.label("stage_count"))
+        .options(load_only(
+            models.Document.id,
+            models.Document.original_filename,
+            models.Document.content_type,
+            models.Document.status,
+            models.Document.created_at,
+        ))
+        .where(models.Document.user_id == user_id)
+    )
+    if cursor:
+        query = query.where(tuple_(models.Document.created_at, models.Document.id) < decode_cursor(cursor))
+    # One extra row tells us whether there is a next page
+    return query.order_by(models.Document.created_at.desc(), models.Document.id.desc()).limit(limit + 1)
+
+def build_documents_page(rows, limit: int) -> schemas.DocumentPage:
+    items = [
+        schemas.DocumentListItem(
+            id=doc.id,
+            original_filename=doc.original_filename,
+            content_type=doc.content_type,
+            status=doc.status,
+            created_at=doc.created_at,
+            stage_count=count,
+        )
+        for doc, count in rows[:limit]
+    ]
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1][0]
+        next_cursor = encode_cursor(last.created_at, last.id)
+    return schemas.DocumentPage(items=items, next_cursor=next_cursor)
+
+def get_documents_page(db: Session, user_id: int, limit: int, cursor: str = None):
+    rows = db.execute(documents_page_query(user_id, limit, cursor)).all()
+    return build_documents_page(rows, limit)
+
+def document_text_query(doc_id: int):
+    return (
+        select(models.Document.id, models.Blob.text_ref)
+        .outerjoin(models.Blob, models.Document.blob_sha256 == models.Blob.sha256)
+        .where(models.Document.id == doc_id)
+    )
+
+def get_document_text(db: Session, doc_id: int):
+    # None when the document doesn't exist; text_ref is None until extraction finishes
+    return db.execute(document_text_query(doc_id)).first()
 
 def get_document(db: Session, doc_id: int):
     return db.query(models.Document).filter(models.Document.id == doc_id).first()
 
+def get_document_version(db: Session, doc_id: int):
+    return db.query(models.Document.version, models.Document.status).filter(models.Document.id == doc_id).first()
+
+def bump_document_version(db: Session, doc_id: int):
+    # Not committed here: lands with the caller's write, and so does the event
+    # that tells every replica (and open event streams) the document changed
+    row = db.execute(
+        update(models.Document)
+        .where(models.Document.id == doc_id)
+        .values(version=models.Document.version + 1)
+        .returning(models.Document.version, models.Document.status)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is not None:
+        events.notify_document(db, {"document_id": doc_id, "event": "notes", "status": row.status, "version": row.version})
+
+def stages_query(doc_id: int):
+    # Notes are joined in up front instead of lazy-loaded once per stage during serialization
+    return (
+        select(models.ReadingStage)
+        .options(joinedload(models.ReadingStage.cornell_note))
+        .where(models.ReadingStage.document_id == doc_id)
+        .order_by(models.ReadingStage.stage_index)
+    )
+
 def get_stages(db: Session, doc_id: int):
-    return db.query(models.ReadingStage).filter(models.ReadingStage.document_id == doc_id).order_by(models.ReadingStage.stage_index).all()
+    return db.scalars(stages_query(doc_id)).all()
 
 def get_stage(db: Session, stage_id: int):
     return db.query(models.ReadingStage).filter(models.ReadingStage.id == stage_id).first()
 
+NOTE_JSON_FIELDS = ("cues_stickers", "notes_stickers", "highlights")
+
+def get_cornell_note(db: Session, stage_id: int):
+    return db.query(models.CornellNote).filter(models.CornellNote.stage_id == stage_id).first()
+
 def create_cornell_note(db: Session, note: schemas.CornellNoteCreate, stage_id: int):
+    # Sticker fields arrive as JSON strings; raises ValueError on invalid JSON
+    values = note.dict()
+    for field in NOTE_JSON_FIELDS:
+        values[field] = json.loads(values[field])
+
     # Check if exists
-    existing = db.query(models.CornellNote).filter(models.CornellNote.stage_id == stage_id).first()
+    existing = get_cornell_note(db, stage_id)
     if existing:
         # Update ALL fields including sticky notes
-        existing.cues_left = note.cues_left
-        existing.notes_right = note.notes_right
-        existing.summary_bottom = note.summary_bottom
-        existing.cues_stickers = note.cues_stickers
-        existing.notes_stickers = note.notes_stickers
-        existing.highlights = note.highlights
+        for field, value in values.items():
+            setattr(existing, field, value)
+        existing.version = models.CornellNote.version + 1
+        bump_document_version(db, existing.stage.document_id)
         db.commit()
         db.refresh(existing)
+        cache.invalidate_document(existing.stage.document_id)
         return existing
     
-    db_note = models.CornellNote(**note.dict(), stage_id=stage_id)
+    db_note = models.CornellNote(**values, stage_id=stage_id)
     db.add(db_note)
+    db.flush()
+    bump_document_version(db, db_note.stage.document_id)
     db.commit()
     db.refresh(db_note)
+    cache.invalidate_document(db_note.stage.document_id)
     return db_note
 
-def create_unknown_word(db: Session, word: schemas.UnknownWordCreate, user_id: int, document_id: int = None, stage_id: int = None):
-    db_word = models.UnknownWord(
-        user_id=user_id,
-        document_id=document_id,
-        stage_id=stage_id,
-        word=word.word,
-        context_sentence=word.context_sentence
+def summary_query(doc_id: int):
+    # One round trip: the stage/vocab totals are window aggregates over the
+    # same document -> stages -> notes join that returns the notes.
+    vocab_count = case(
+        (func.json_typeof(models.ReadingStage.suggested_vocab) == "array",
+         func.json_array_length(models.ReadingStage.suggested_vocab)),
+        else_=0,
     )
-    db.add(db_word)
+    return (
+        select(
+            models.Document.status,
+            func.count(models.ReadingStage.id).over().label("total_stages"),
+            func.coalesce(func.sum(vocab_count).over(), 0).label("total_vocab"),
+            models.CornellNote,
+        )
+        .select_from(models.Document)
+        .outerjoin(models.ReadingStage, models.ReadingStage.document_id == models.Document.id)
+        .outerjoin(models.CornellNote, models.CornellNote.stage_id == models.ReadingStage.id)
+        .where(models.Document.id == doc_id)
+        .order_by(models.ReadingStage.stage_index)
+    )
+
+def build_summary(rows, doc_id: int):
+    if not rows:
+        return None, None
+
+    summary = schemas.DocumentSummary(
+        document_id=doc_id,
+        total_stages=rows[0].total_stages,
+        total_vocab_suggested=rows[0].total_vocab,
+        # Notes come out in stage order
+        cornell_notes=[row.CornellNote for row in rows if row.CornellNote is not None]
+    )
+    return summary, rows[0].status
+
+def get_summary(db: Session, doc_id: int):
+    return build_summary(db.execute(summary_query(doc_id)).all(), doc_id)
+
+def normalize_word(word: str) -> str:
+    return word.strip().lower()
+
+def upsert_unknown_words(db: Session, stage_id: int, words: list):
+    # A single INSERT ... SELECT ... ON CONFLICT resolves stage -> document -> user
+    # and writes the whole batch. Returns None when the stage doesn't exist.
+    batch = {}
+    for item in words:
+        word = normalize_word(item.word)
+        if word:
+            # ON CONFLICT can't touch the same row twice in one statement, so dedupe first
+            batch[word] = item.context_sentence or batch.get(word)
+    if not batch:
+        return []
+
+    rows = values(column("word", String), column("context_sentence", Text), name="batch").data(list(batch.items()))
+    source = (
+        select(
+            models.Document.user_id,
+            models.Document.id,
+            models.ReadingStage.id,
+            rows.c.word,
+            rows.c.context_sentence,
+        )
+        .select_from(models.ReadingStage)
+        .join(models.Document, models.Document.id == models.ReadingStage.document_id)
+        .join(rows, true())
+        .where(models.ReadingStage.id == stage_id)
+    )
+    stmt = insert(models.UnknownWord).from_select(
+        ["user_id", "document_id", "stage_id", "word", "context_sentence"], source
+    )
+    stmt = stmt.on_conflict_do_update(
+        constraint="uq_unknown_words_user_word_document",
+        set_={
+            "stage_id": stmt.excluded.stage_id,
+            "context_sentence": func.coalesce(stmt.excluded.context_sentence, models.UnknownWord.context_sentence),
+        },
+    ).returning(models.UnknownWord)
+
+    saved = db.scalars(stmt).all()
     db.commit()
-    db.refresh(db_word)
-    return db_word
+    if not saved:
+        return None
+    return saved
+
+# Matches are marked with private-use characters rather than <mark>, so the
+# headline can be HTML-escaped as a whole and the tags put in afterwards
+HEADLINE_START, HEADLINE_STOP = "\ue000", "\ue001"
+SEARCH_HEADLINE_OPTIONS = f"StartSel={HEADLINE_START}, StopSel={HEADLINE_STOP}, MaxWords=35, MinWords=15, MaxFragments=2"
+
+def highlight(headline: str) -> str:
+    # User text comes out escaped; the only markup is ours
+    return html.escape(headline).replace(HEADLINE_START, "<mark>").replace(HEADLINE_STOP, "</mark>")
+
+def search_query(user_id: int, q: str, limit: int, offset: int):
+    # One ranked list over text passages, stages and notes; each branch is a
+    # GIN lookup on its search_vector, narrowed to the user's documents
+    tsquery = func.websearch_to_tsquery(search.regconfig(), q)
+    no_int = cast(null(), Integer)
+    no_text = cast(null(), String)
+
+    passages = (
+        select(
+            literal("document").label("kind"),
+            models.Document.id.label("document_id"),
+            models.Document.original_filename.label("document_title"),
+            no_int.label("stage_id"),
+            no_text.label("stage_title"),
+            models.BlobSearchChunk.char_offset.label("char_offset"),
+            models.BlobSearchChunk.char_length.label("char_length"),
+            models.Blob.text_ref.label("text_ref"),
+            no_text.label("body"),
+            func.ts_rank_cd(models.BlobSearchChunk.search_vector, tsquery).label("rank"),
+        )
+        .select_from(models.BlobSearchChunk)
+        .join(models.Document, models.Document.blob_sha256 == models.BlobSearchChunk.blob_sha256)
+        .join(models.Blob, models.Blob.sha256 == models.BlobSearchChunk.blob_sha256)
+        .where(models.Document.user_id == user_id, models.BlobSearchChunk.search_vector.op("@@")(tsquery))
+    )
+    stages = (
+        select(
+            literal("stage"),
+            models.Document.id,
+            models.Document.original_filename,
+            models.ReadingStage.id,
+            models.ReadingStage.title,
+            no_int,
+            no_int,
+            models.ReadingStage.text_ref,
+            no_text,
+            func.ts_rank_cd(models.ReadingStage.search_vector, tsquery),
+        )
+        .select_from(models.ReadingStage)
+        .join(models.Document, models.Document.id == models.ReadingStage.document_id)
+        .where(models.Document.user_id == user_id, models.ReadingStage.search_vector.op("@@")(tsquery))
+    )
+    sticker_text = literal_column(
+        f"(SELECT string_agg(t, ' ') FROM jsonb_array_elements_text({search.NOTE_STICKER_TEXT_SQL}) AS t)"
+    )
+    notes = (
+        select(
+            literal("note"),
+            models.Document.id,
+            models.Document.original_filename,
+            models.ReadingStage.id,
+            models.ReadingStage.title,
+            no_int,
+            no_int,
+            no_text,
+            func.concat_ws(
+                " ",
+                models.CornellNote.cues_left,
+                models.CornellNote.notes_right,
+                models.CornellNote.summary_bottom,
+                sticker_text,
+            ),
+            func.ts_rank_cd(models.CornellNote.search_vector, tsquery),
+        )
+        .select_from(models.CornellNote)
+        .join(models.ReadingStage, models.ReadingStage.id == models.CornellNote.stage_id)
+        .join(models.Document, models.Document.id == models.ReadingStage.document_id)
+        .where(models.Document.user_id == user_id, models.CornellNote.search_vector.op("@@")(tsquery))
+    )
+    hits = union_all(passages, stages, notes).subquery("hits")
+    return (
+        select(hits)
+        .order_by(hits.c.rank.desc(), hits.c.document_id, hits.c.stage_id, hits.c.char_offset)
+        .limit(limit + 1)
+        .offset(offset)
+    )
+
+def search_documents(db: Session, user_id: int, q: str, limit: int, offset: int = 0):
+    rows = db.execute(search_query(user_id, q, limit, offset)).all()
+    page = rows[:limit]
+
+    # Snippets are cut from the hit's passage only, never from a whole document
+    bodies = []
+    for row in page:
+        if row.kind == "document":
+            bodies.append(textstore.store.read_range(row.text_ref, row.char_offset, row.char_length)[0])
+        elif row.kind == "stage":
+            bodies.append(textstore.store.read(row.text_ref) if row.text_ref else "")
+        else:
+            bodies.append(row.body or "")
+    # A marker character already in the text would turn into a stray tag
+    bodies = [body.replace(HEADLINE_START, "").replace(HEADLINE_STOP, "") for body in bodies]
+    snippets = []
+    if bodies:
+        snippets = db.execute(
+            text(
+                "SELECT ts_headline(CAST(:config AS regconfig), body, "
+                "websearch_to_tsquery(CAST(:config AS regconfig), :q), :options) "
+                "FROM unnest(CAST(:bodies AS text[])) WITH ORDINALITY AS t(body, n) ORDER BY n"
+            ),
+            {"config": search.SEARCH_CONFIG, "q": q, "options": SEARCH_HEADLINE_OPTIONS, "bodies": bodies},
+        ).scalars().all()
+
+    items = [
+        schemas.SearchHit(
+            kind=row.kind,
+            document_id=row.document_id,
+            document_title=row.document_title,
+            stage_id=row.stage_id,
+            stage_title=row.stage_title,
+            char_offset=row.char_offset,
+            char_length=row.char_length,
+            rank=row.rank,
+            snippet=highlight(snippet),
+        )
+        for row, snippet in zip(page, snippets)
+    ]
+    return schemas.SearchPage(items=items, next_offset=offset + limit if len(rows) > limit else None)
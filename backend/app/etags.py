@@ -0,0 +1,36 @@
+from fastapi import Request, Response
+
+from . import cache
+
+# Strong ETags derived from Document.version, which the worker and note writes bump.
+# A matching If-None-Match is answered from the version cache without a DB round trip.
+
+def make_etag(kind: str, doc_id: int, version: int) -> str:
+    return f'"{kind}-{doc_id}-v{version}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+def cached_not_modified(request: Request, kind: str, doc_id: int):
+    if "if-none-match" not in request.headers:
+        return None
+    version = cache.versions.get(doc_id)
+    if version is None:
+        return None
+    etag = make_etag(kind, doc_id, version)
+    return not_modified(etag) if etag_matches(request, etag) else None
+
+def remember_version(doc_id: int, version: int, status: str):
+    # In-flight documents change under the worker, so only final ones are cached
+    if status in ("ready", "failed"):
+        cache.versions.set(doc_id, version)
+
+def set_etag(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
@@ -0,0 +1,124 @@
+import asyncio
+import json
+import os
+import select
+import threading
+
+import psycopg2
+from sqlalchemy import func
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+
+from . import database, cache
+
+# Document events travel over Postgres LISTEN/NOTIFY: the worker (status
+# changes, stages ready) and note writes NOTIFY inside their transaction, so
+# an event is only seen once its rows are committed. Each backend process
+# holds one listening connection and fans events out to its SSE streams.
+
+DOCUMENT_EVENTS_CHANNEL = "document_events"  # same name in worker/app/main.py
+EVENTS_RECONNECT_DELAY = float(os.getenv("EVENTS_RECONNECT_DELAY", "2"))
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "64"))  # per stream; a slow client drops events past this
+
+
+def notify_document(db: Session, payload: dict):
+    # Not committed here: Postgres delivers it when the caller's transaction commits
+    db.execute(func.pg_notify(DOCUMENT_EVENTS_CHANNEL, json.dumps(payload, default=str)).select())
+
+
+class DocumentEventHub:
+    def __init__(self, dsn: str, channel: str):
+        self.dsn = dsn
+        self.channel = channel
+        self._subscribers = {}  # document id -> {(loop, queue)}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.received = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="document-events", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def subscribe(self, doc_id: int) -> asyncio.Queue:
+        # Must be called from the event loop that will read the queue
+        queue = asyncio.Queue(maxsize=EVENTS_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(doc_id, set()).add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, doc_id: int, queue: asyncio.Queue):
+        with self._lock:
+            subscribers = self._subscribers.get(doc_id, set())
+            subscribers.difference_update({entry for entry in subscribers if entry[1] is queue})
+            if not subscribers:
+                self._subscribers.pop(doc_id, None)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            streams = sum(len(subscribers) for subscribers in self._subscribers.values())
+            documents = len(self._subscribers)
+        return {"streams": streams, "documents": documents, "received": self.received}
+
+    # --- Listener thread ---
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self._listen()
+            except Exception as e:
+                print(f"Document event listener error: {e}, reconnecting in {EVENTS_RECONNECT_DELAY}s")
+                self._stopping.wait(EVENTS_RECONNECT_DELAY)
+
+    def _listen(self):
+        conn = psycopg2.connect(self.dsn)
+        try:
+            conn.set_session(autocommit=True)
+            conn.cursor().execute(f"LISTEN {self.channel}")
+            # Events may have been missed while disconnected; drop what could be stale
+            cache.summaries.clear()
+            cache.versions.clear()
+            while not self._stopping.is_set():
+                if select.select([conn], [], [], 1.0) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    self._dispatch(conn.notifies.pop(0).payload)
+        finally:
+            conn.close()
+
+    def _dispatch(self, raw: str):
+        try:
+            event = json.loads(raw)
+            doc_id = int(event["document_id"])
+        except (ValueError, KeyError, TypeError):
+            print(f"Ignoring malformed document event: {raw!r}")
+            return
+        self.received += 1
+
+        # Every replica hears every write, so caches stay fresh without waiting for the TTL
+        cache.invalidate_document(doc_id)
+
+        with self._lock:
+            subscribers = list(self._subscribers.get(doc_id, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(self._offer, queue, event)
+
+    @staticmethod
+    def _offer(queue: asyncio.Queue, event: dict):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+
+hub = DocumentEventHub(
+    make_url(database.DATABASE_URL).set(drivername="postgresql").render_as_string(hide_password=False),
+    DOCUMENT_EVENTS_CHANNEL,
+)
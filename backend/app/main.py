@@ -1,24 +1,30 @@
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form
-from sqlalchemy.orm import Session
-from typing import List
-import os
-import pika
+import asyncio
 import json
-import io
-import shutil
+import os
 
-# Text extraction libs
-import pdfplumber
-import pytesseract
-from PIL import Image
+import anyio
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Query, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from typing import List, Optional
 
-from . import models, schemas, crud, database
+from . import schemas, crud, database, storage, messaging, outbox, cache, notes, textstore, events, async_api
+from .etags import make_etag, etag_matches, not_modified, cached_not_modified, remember_version, set_etag
 
-# Initialize DB
-models.Base.metadata.create_all(bind=database.engine)
+# Schema is managed by Alembic (`alembic upgrade head`, the `migrate` service in docker-compose)
 
 app = FastAPI(title="Socrates Backend API")
 
+# Threads available to the sync endpoints below (Starlette's default is 40)
+API_THREADPOOL_SIZE = int(os.getenv("API_THREADPOOL_SIZE", "40"))
+SSE_HEARTBEAT = float(os.getenv("SSE_HEARTBEAT", "15"))  # seconds between keep-alive comments on idle streams
+SSE_RETRY_MS = int(os.getenv("SSE_RETRY_MS", "3000"))  # client reconnect delay
+
+# Registered first so its routes shadow the sync versions of the same paths
+if database.DB_ASYNC:
+    app.include_router(async_api.router)
+
 # Dependency
 def get_db():
     db = database.SessionLocal()
@@ -27,17 +33,28 @@ def get_db():
     finally:
         db.close()
 
-# RabbitMQ Connection Helper
-def get_rabbitmq_channel():
-    host = os.getenv("RABBITMQ_HOST", "rabbitmq")
-    user = os.getenv("RABBITMQ_USER", "user")
-    password = os.getenv("RABBITMQ_PASS", "password")
-    credentials = pika.PlainCredentials(user, password)
-    parameters = pika.ConnectionParameters(host, credentials=credentials)
-    connection = pika.BlockingConnection(parameters)
-    channel = connection.channel()
-    channel.queue_declare(queue='reading_plan_queue', durable=True)
-    return connection, channel
+# --- Lifecycle ---
+
+@app.on_event("startup")
+async def size_threadpool():
+    # Needs the event loop, so it can't live in the sync startup hook
+    anyio.to_thread.current_default_thread_limiter().total_tokens = API_THREADPOOL_SIZE
+
+@app.on_event("startup")
+def start_background_tasks():
+    messaging.publisher.start()
+    outbox.relay.start()
+    events.hub.start()
+
+@app.on_event("shutdown")
+def stop_background_tasks():
+    events.hub.stop()
+    outbox.relay.stop()
+    messaging.publisher.stop()
+
+@app.on_event("shutdown")
+async def close_async_engine():
+    await database.async_engine.dispose()
 
 # --- Endpoints ---
 
@@ -52,95 +69,187 @@ def get_profile(user_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="User not found")
     return db_user
 
-@app.post("/api/users/{user_id}/documents", response_model=schemas.Document)
+@app.post("/api/users/{user_id}/documents", response_model=schemas.Document, status_code=202)
 async def upload_document(
     user_id: int, 
     file: UploadFile = File(...), 
     db: Session = Depends(get_db)
 ):
     # Verify user exists
-    user = crud.get_user(db, user_id)
+    user = await run_in_threadpool(crud.get_user, db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    content_type = file.content_type
-    original_filename = file.filename
-    raw_text = ""
+    # Spool the raw bytes under their SHA-256; text extraction happens in the worker
+    sha256, size_bytes, storage_path = await run_in_threadpool(storage.save_upload, file.file)
 
-    # Extract text
-    try:
-        if content_type == "application/pdf":
-            # Read bytes
-            pdf_bytes = await file.read()
-            with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
-                for page in pdf.pages:
-                    text = page.extract_text()
-                    if text:
-                        raw_text += text + "\n"
-        
-        elif content_type.startswith("image/"):
-            image_bytes = await file.read()
-            image = Image.open(io.BytesIO(image_bytes))
-            raw_text = pytesseract.image_to_string(image)
-        
-        elif content_type == "text/plain":
-            content_bytes = await file.read()
-            raw_text = content_bytes.decode("utf-8")
-        
-        else:
-            # Fallback for others, just try decoding
-            content_bytes = await file.read()
-            try:
-                raw_text = content_bytes.decode("utf-8")
-            except:
-                raw_text = "[Could not extract text]"
-
-    except Exception as e:
-        print(f"Error extracting text: {e}")
-        raw_text = "[Error extracting text]"
-
-    if not raw_text.strip():
-        raw_text = "[No text content detected]"
-
-    # Save Document
     doc_create = schemas.DocumentCreate(
-        original_filename=original_filename,
-        content_type=content_type,
-        raw_text=raw_text
+        original_filename=file.filename,
+        content_type=file.content_type,
+        blob_sha256=sha256
+    )
+    blob_create = schemas.BlobCreate(
+        sha256=sha256,
+        size_bytes=size_bytes,
+        content_type=file.content_type,
+        storage_path=storage_path
     )
-    db_doc = crud.create_document(db, doc_create, user_id)
+    # The pipeline job is written to the outbox in the same transaction.
+    # Bytes seen before reuse the stored text and go straight to planning.
+    db_doc = await run_in_threadpool(crud.create_document, db, doc_create, user_id, blob_create)
+    outbox.relay.notify()
 
-    # Publish to RabbitMQ
-    try:
-        connection, channel = get_rabbitmq_channel()
-        message = json.dumps({"user_id": user_id, "document_id": db_doc.id})
-        channel.basic_publish(
-            exchange='',
-            routing_key='reading_plan_queue',
-            body=message,
-            properties=pika.BasicProperties(
-                delivery_mode=2,  # make message persistent
-            ))
-        connection.close()
-    except Exception as e:
-        print(f"Failed to publish to RabbitMQ: {e}")
-        # Note: In production we should handle this better (retry or fail request)
-    
     return db_doc
 
-@app.get("/api/users/{user_id}/documents", response_model=List[schemas.Document])
-def list_documents(user_id: int, db: Session = Depends(get_db)):
-    return crud.get_documents_by_user(db, user_id)
+@app.get("/api/users/{user_id}/documents", response_model=schemas.DocumentPage)
+def list_documents(
+    user_id: int,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    try:
+        return crud.get_documents_page(db, user_id, limit, cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@app.get("/api/users/{user_id}/search", response_model=schemas.SearchPage)
+def search_documents(
+    user_id: int,
+    q: str = Query(..., min_length=1, max_length=200),  # web search syntax: "quoted phrase", -exclude, or
+    limit: int = Query(20, ge=1, le=50),
+    offset: int = Query(0, ge=0, le=1000),
+    db: Session = Depends(get_db)
+):
+    return crud.search_documents(db, user_id, q, limit, offset)
 
 @app.get("/api/documents/{doc_id}/stages", response_model=List[schemas.ReadingStage])
-def get_stages(doc_id: int, db: Session = Depends(get_db)):
+def get_stages(doc_id: int, request: Request, response: Response, db: Session = Depends(get_db)):
+    cached = cached_not_modified(request, "stages", doc_id)
+    if cached is not None:
+        return cached
+
+    # Read the version before the stages: a concurrent write can only make the ETag older, never newer
+    row = crud.get_document_version(db, doc_id)
+    if row is None:
+        return []
+    remember_version(doc_id, row.version, row.status)
+    etag = make_etag("stages", doc_id, row.version)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    set_etag(response, etag)
     return crud.get_stages(db, doc_id)
 
+@app.get("/api/documents/{doc_id}/status", response_model=schemas.DocumentStatus)
+def get_document_status(doc_id: int, db: Session = Depends(get_db)):
+    doc = crud.get_document(db, doc_id)
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return schemas.DocumentStatus(document_id=doc.id, status=doc.status, error=doc.error)
+
+def format_sse(event: str, data: dict, event_id: int = None) -> str:
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data, default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+def document_event_messages(event: dict) -> str:
+    if event.get("event") == "notes":
+        return format_sse("notes", event, event.get("version"))
+    message = format_sse("status", {key: event.get(key) for key in ("document_id", "status", "error", "version")}, event.get("version"))
+    if event.get("stage_count") is not None:
+        # Stages are committed one by one while planning, each with its own status event
+        message += format_sse("stages", {"document_id": event["document_id"], "stage_count": event["stage_count"]})
+    return message
+
+def read_document_status(doc_id: int):
+    db = database.SessionLocal()
+    try:
+        doc = crud.get_document(db, doc_id)
+        return None if doc is None else {"status": doc.status, "version": doc.version, "error": doc.error}
+    finally:
+        db.close()
+
+@app.get("/api/documents/{doc_id}/events")
+async def stream_document_events(doc_id: int, request: Request):
+    # Server-Sent Events: the current status first, then every status change
+    # pushed by the worker; the stream ends once the document is ready or failed.
+    # Holds no DB connection while idle.
+    queue = events.hub.subscribe(doc_id)
+    try:
+        # Subscribed before reading, so a change in between is not lost
+        doc = await run_in_threadpool(read_document_status, doc_id)
+    except Exception:
+        events.hub.unsubscribe(doc_id, queue)
+        raise
+    if doc is None:
+        events.hub.unsubscribe(doc_id, queue)
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    async def stream():
+        try:
+            current = {"document_id": doc_id, "event": "status", **doc}
+            yield f"retry: {SSE_RETRY_MS}\n\n" + document_event_messages(current)
+            if current["status"] in ("ready", "failed"):
+                return
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": keep-alive\n\n"
+                    continue
+                is_status = event.get("event") == "status"
+                if is_status and event.get("version", 0) <= current["version"]:
+                    continue  # already covered by the snapshot
+                yield document_event_messages(event)
+                if is_status and event.get("status") in ("ready", "failed"):
+                    return
+        finally:
+            events.hub.unsubscribe(doc_id, queue)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/api/documents/{doc_id}/text", response_class=PlainTextResponse)
+def get_document_text(
+    doc_id: int,
+    response: Response,
+    offset: int = Query(0, ge=0),
+    length: Optional[int] = Query(None, ge=1),
+    db: Session = Depends(get_db)
+):
+    # offset/length are in characters; only the compressed chunks they overlap are read
+    row = crud.get_document_text(db, doc_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if row.text_ref is None:
+        raise HTTPException(status_code=404, detail="Text not extracted yet")
+    text, total = textstore.store.read_range(row.text_ref, offset, length)
+    response.headers["X-Text-Length"] = str(total)
+    return text
+
 @app.get("/api/documents/{doc_id}", response_model=schemas.Document)
-def get_document(doc_id: int, db: Session = Depends(get_db)):
+def get_document(doc_id: int, request: Request, response: Response, db: Session = Depends(get_db)):
+    cached = cached_not_modified(request, "document", doc_id)
+    if cached is not None:
+        return cached
+
     doc = crud.get_document(db, doc_id)
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
+    remember_version(doc.id, doc.version, doc.status)
+    etag = make_etag("document", doc.id, doc.version)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    set_etag(response, etag)
     return doc
 
 @app.post("/api/stages/{stage_id}/cornell", response_model=schemas.CornellNote)
@@ -148,40 +257,62 @@ def save_cornell_note(stage_id: int, note: schemas.CornellNoteCreate, db: Sessio
     stage = crud.get_stage(db, stage_id)
     if not stage:
         raise HTTPException(status_code=404, detail="Stage not found")
-    return crud.create_cornell_note(db, note, stage_id)
+    try:
+        return crud.create_cornell_note(db, note, stage_id)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Sticker and highlight fields must be valid JSON")
 
-@app.post("/api/stages/{stage_id}/unknown-words", response_model=schemas.UnknownWord)
-def save_unknown_word(stage_id: int, word: schemas.UnknownWordCreate, db: Session = Depends(get_db)):
+@app.patch("/api/stages/{stage_id}/cornell", response_model=schemas.CornellNote)
+def patch_cornell_note(stage_id: int, patch: schemas.CornellNotePatch, db: Session = Depends(get_db)):
     stage = crud.get_stage(db, stage_id)
     if not stage:
         raise HTTPException(status_code=404, detail="Stage not found")
-    
-    # Resolve user_id via document
-    doc = crud.get_document(db, stage.document_id)
-    return crud.create_unknown_word(db, word, doc.user_id, doc.id, stage_id)
+    try:
+        return notes.patch_note(db, stage, patch.version, patch.ops)
+    except notes.VersionConflict as e:
+        raise HTTPException(status_code=409, detail=f"Version conflict, note is at version {e.current_version}")
+    except notes.PatchError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@app.post("/api/stages/{stage_id}/unknown-words", response_model=schemas.UnknownWord)
+def save_unknown_word(stage_id: int, word: schemas.UnknownWordCreate, db: Session = Depends(get_db)):
+    if not crud.normalize_word(word.word):
+        raise HTTPException(status_code=422, detail="Word is empty")
+    saved = crud.upsert_unknown_words(db, stage_id, [word])
+    if saved is None:
+        raise HTTPException(status_code=404, detail="Stage not found")
+    return saved[0]
+
+@app.post("/api/stages/{stage_id}/unknown-words/batch", response_model=List[schemas.UnknownWord])
+def save_unknown_words(stage_id: int, batch: schemas.UnknownWordBatch, db: Session = Depends(get_db)):
+    saved = crud.upsert_unknown_words(db, stage_id, batch.words)
+    if saved is None:
+        raise HTTPException(status_code=404, detail="Stage not found")
+    return saved
 
 @app.get("/api/documents/{doc_id}/summary", response_model=schemas.DocumentSummary)
 def get_summary(doc_id: int, db: Session = Depends(get_db)):
-    stages = crud.get_stages(db, doc_id)
-    
-    total_stages = len(stages)
-    total_vocab = 0
-    cornell_notes = []
-    
-    for s in stages:
-        if s.suggested_vocab:
-            total_vocab += len(s.suggested_vocab)
-        if s.cornell_note:
-            cornell_notes.append(s.cornell_note)
-    
-    # Ensure cornell notes are sorted by stage index implicitly via stages order
-    
-    return schemas.DocumentSummary(
-        document_id=doc_id,
-        total_stages=total_stages,
-        total_vocab_suggested=total_vocab,
-        cornell_notes=cornell_notes
-    )
+    summary = cache.summaries.get(doc_id)
+    if summary is not None:
+        return summary
+
+    summary, status = crud.get_summary(db, doc_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    # Stages are final once the worker is done; note writes invalidate the entry
+    if status in ("ready", "failed"):
+        cache.summaries.set(doc_id, summary)
+    return summary
+
+@app.get("/api/metrics")
+def get_metrics(db: Session = Depends(get_db)):
+    return {
+        "publisher": messaging.publisher.metrics.snapshot(),
+        "events": events.hub.snapshot(),
+        "dedup": crud.get_dedup_stats(db),
+        "plan_jobs": crud.get_plan_job_stats(db),
+    }
 
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -0,0 +1,277 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import pika
+from pika.adapters.select_connection import IOLoop
+
+RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
+RABBITMQ_USER = os.getenv("RABBITMQ_USER", "user")
+RABBITMQ_PASS = os.getenv("RABBITMQ_PASS", "password")
+
+PUBLISHER_CHANNELS = int(os.getenv("RABBITMQ_PUBLISHER_CHANNELS", "4"))
+PUBLISH_TIMEOUT = float(os.getenv("RABBITMQ_PUBLISH_TIMEOUT", "10"))  # seconds to wait for a broker confirm
+RECONNECT_DELAY = float(os.getenv("RABBITMQ_RECONNECT_DELAY", "2"))
+MAX_BACKLOG = int(os.getenv("RABBITMQ_PUBLISH_BACKLOG", "10000"))  # publishes buffered while reconnecting
+
+EXTRACTION_QUEUE = "extraction_queue"
+# A priority queue, so a user's first document overtakes someone else's bulk
+# import. Queue arguments can't change in place, hence the new name; keep the
+# name, arguments and priority tiers in sync with worker/app/planner.py.
+READING_PLAN_QUEUE = "reading_plan_priority_queue"
+PLAN_MAX_PRIORITY = 9
+QUEUE_ARGUMENTS = {READING_PLAN_QUEUE: {"x-max-priority": PLAN_MAX_PRIORITY}}
+ENQUEUED_AT_HEADER = "x-enqueued-at"  # epoch seconds, for the worker's queue-wait metric
+
+
+def plan_priority(backlog: int) -> int:
+    # backlog: the user's documents still in the pipeline, this one included
+    if backlog <= 1:
+        return PLAN_MAX_PRIORITY  # interactive: a single upload
+    if backlog <= 5:
+        return 5
+    return 1  # bulk import
+
+
+class PublishError(Exception):
+    pass
+
+
+class PublishMetrics:
+    def __init__(self, window: int = 2048):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)  # seconds, most recent confirms
+        self.published = 0
+        self.confirmed = 0
+        self.nacked = 0
+        self.failed = 0
+        self.reconnects = 0
+
+    def incr(self, name: str, amount: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def observe_confirm(self, seconds: float):
+        with self._lock:
+            self.confirmed += 1
+            self._latencies.append(seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            counters = {
+                "published": self.published,
+                "confirmed": self.confirmed,
+                "nacked": self.nacked,
+                "failed": self.failed,
+                "reconnects": self.reconnects,
+            }
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 3)
+
+        counters["latency_ms"] = {
+            "p50": percentile(0.50),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+            "max": round(latencies[-1] * 1000, 3) if latencies else None,
+        }
+        return counters
+
+
+class Publisher:
+    # All pika objects live on a single IO thread; callers on any thread hand
+    # publishes over with add_callback_threadsafe and wait on a Future that is
+    # resolved by the broker's (possibly multiple=True, i.e. batched) confirm.
+
+    def __init__(self, parameters: pika.ConnectionParameters, channel_count: int):
+        self.parameters = parameters
+        self.channel_count = channel_count
+        self.metrics = PublishMetrics()
+        self._ioloop = IOLoop()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stopping = False
+        self._connection = None
+        # IO-thread state
+        self._channels = []
+        self._next_channel = 0
+        self._delivery_tags = {}  # channel number -> last delivery tag
+        self._unconfirmed = {}  # channel number -> {delivery tag: (future, started)}
+        self._declared = {}  # channel number -> queues declared on it
+        self._backlog = deque()
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="rabbitmq-publisher", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._ioloop.add_callback_threadsafe(self._shutdown)
+            self._thread.join(timeout=5)
+
+    def publish_async(self, queue: str, payload: dict, priority: int = None, headers: dict = None) -> Future:
+        future = Future()
+        properties = pika.BasicProperties(
+            delivery_mode=2,  # make message persistent
+            content_type="application/json",
+            priority=priority,
+            headers=headers,
+            timestamp=int(time.time()),
+        )
+        request = (queue, json.dumps(payload), properties, future, time.monotonic())
+        self.start()
+        self._ioloop.add_callback_threadsafe(functools.partial(self._publish, request))
+        return future
+
+    def publish(self, queue: str, payload: dict, **kwargs):
+        future = self.publish_async(queue, payload, **kwargs)
+        try:
+            future.result(timeout=PUBLISH_TIMEOUT)
+        except FutureTimeoutError:
+            self.metrics.incr("failed")
+            raise PublishError(f"No broker confirm within {PUBLISH_TIMEOUT}s")
+
+    # --- IO thread ---
+
+    def _run(self):
+        self._connect()
+        self._ioloop.start()
+
+    def _connect(self):
+        self._connection = pika.SelectConnection(
+            self.parameters,
+            on_open_callback=self._on_connection_open,
+            on_open_error_callback=self._on_connection_error,
+            on_close_callback=self._on_connection_closed,
+            custom_ioloop=self._ioloop,
+        )
+
+    def _schedule_reconnect(self):
+        self.metrics.incr("reconnects")
+        self._ioloop.call_later(RECONNECT_DELAY, self._connect)
+
+    def _on_connection_open(self, connection):
+        for _ in range(self.channel_count):
+            connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_connection_error(self, connection, error):
+        print(f"RabbitMQ publisher could not connect: {error}, retrying in {RECONNECT_DELAY}s")
+        self._schedule_reconnect()
+
+    def _on_connection_closed(self, connection, reason):
+        self._channels = []
+        if self._stopping:
+            self._ioloop.stop()
+            return
+        print(f"RabbitMQ publisher connection closed: {reason}, reconnecting")
+        self._schedule_reconnect()
+
+    def _on_channel_open(self, channel):
+        channel.add_on_close_callback(self._on_channel_closed)
+        channel.confirm_delivery(
+            ack_nack_callback=functools.partial(self._on_confirm, channel.channel_number),
+            callback=lambda _frame: self._on_confirm_selected(channel),
+        )
+
+    def _on_confirm_selected(self, channel):
+        number = channel.channel_number
+        self._delivery_tags[number] = 0
+        self._unconfirmed[number] = {}
+        self._declared[number] = set()
+        self._channels.append(channel)
+
+        # Flush publishes that arrived while we were (re)connecting
+        while self._backlog:
+            self._publish(self._backlog.popleft())
+
+    def _on_channel_closed(self, channel, reason):
+        number = channel.channel_number
+        if channel in self._channels:
+            self._channels.remove(channel)
+        for future, _ in self._unconfirmed.pop(number, {}).values():
+            self._fail(future, f"Channel closed before confirm: {reason}")
+
+        # Replace the channel as long as the connection itself is alive
+        if not self._stopping and self._connection is not None and self._connection.is_open:
+            self._connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_confirm(self, number, frame):
+        method = frame.method
+        pending = self._unconfirmed.get(number, {})
+        if method.multiple:
+            tags = [tag for tag in pending if tag <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag]
+
+        acked = isinstance(method, pika.spec.Basic.Ack)
+        now = time.monotonic()
+        for tag in tags:
+            entry = pending.pop(tag, None)
+            if entry is None:
+                continue
+            future, started = entry
+            if acked:
+                self.metrics.observe_confirm(now - started)
+                if not future.done():
+                    future.set_result(None)
+            else:
+                self.metrics.incr("nacked")
+                if not future.done():
+                    future.set_exception(PublishError("Broker nacked the message"))
+
+    def _publish(self, request):
+        queue, body, properties, future, started = request
+        if not self._channels:
+            if len(self._backlog) >= MAX_BACKLOG:
+                self._fail(future, "Publisher backlog is full")
+                return
+            self._backlog.append(request)
+            return
+
+        channel = self._channels[self._next_channel % len(self._channels)]
+        self._next_channel += 1
+        number = channel.channel_number
+        try:
+            if queue not in self._declared[number]:
+                channel.queue_declare(queue=queue, durable=True, arguments=QUEUE_ARGUMENTS.get(queue))
+                self._declared[number].add(queue)
+            channel.basic_publish(exchange='', routing_key=queue, body=body, properties=properties)
+        except Exception as e:
+            self._fail(future, str(e))
+            return
+
+        self.metrics.incr("published")
+        self._delivery_tags[number] += 1
+        self._unconfirmed[number][self._delivery_tags[number]] = (future, started)
+
+    def _fail(self, future, message):
+        self.metrics.incr("failed")
+        if not future.done():
+            future.set_exception(PublishError(message))
+
+    def _shutdown(self):
+        self._stopping = True
+        for future, _ in (entry for pending in self._unconfirmed.values() for entry in pending.values()):
+            self._fail(future, "Publisher stopped")
+        if self._connection is not None and not (self._connection.is_closed or self._connection.is_closing):
+            self._connection.close()
+        else:
+            self._ioloop.stop()
+
+
+publisher = Publisher(
+    pika.ConnectionParameters(
+        RABBITMQ_HOST,
+        credentials=pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS),
+    ),
+    channel_count=PUBLISHER_CHANNELS,
+)
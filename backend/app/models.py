@@ -1,7 +1,9 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, JSON
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, BigInteger, String, Text, ForeignKey, DateTime, JSON, UniqueConstraint, Index, Computed
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
+from sqlalchemy.orm import relationship, deferred
 from datetime import datetime
 from .database import Base
+from . import textstore, search
 
 class UserProfile(Base):
     __tablename__ = "users"
@@ -19,17 +21,49 @@ class UserProfile(Base):
     documents = relationship("Document", back_populates="user")
     unknown_words = relationship("UnknownWord", back_populates="user")
 
+class Blob(Base):
+    __tablename__ = "blobs"
+
+    # Content-addressed upload shared by every Document with the same bytes
+    sha256 = Column(String(64), primary_key=True)
+    size_bytes = Column(BigInteger)
+    content_type = Column(String)
+    storage_path = Column(String) # spooled upload, read by the extraction worker
+    text_ref = Column(String, nullable=True) # textstore reference, written once by the extraction worker
+    text_length = Column(Integer, nullable=True)
+    status = Column(String, default="pending") # pending -> extracting -> extracted | failed
+    error = Column(Text, nullable=True)
+    extraction_ms = Column(Integer, nullable=True)
+    claimed_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    documents = relationship("Document", back_populates="blob")
+
+class BlobSearchChunk(Base):
+    __tablename__ = "blob_search_chunks"
+
+    # Full-text index of a blob's text, one row per SEARCH_CHUNK_CHARS passage (written by the worker)
+    blob_sha256 = Column(String(64), ForeignKey("blobs.sha256", ondelete="CASCADE"), primary_key=True)
+    chunk_index = Column(Integer, primary_key=True)
+    char_offset = Column(Integer, nullable=False)
+    char_length = Column(Integer, nullable=False)
+    search_vector = deferred(Column(TSVECTOR, nullable=False))
+
 class Document(Base):
     __tablename__ = "documents"
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
+    blob_sha256 = Column(String(64), ForeignKey("blobs.sha256"), index=True)
     original_filename = Column(String)
     content_type = Column(String) # pdf, image, text
-    raw_text = Column(Text)
+    status = Column(String, default="uploaded") # uploaded -> extracting -> planning -> ready | failed
+    error = Column(Text, nullable=True)
+    version = Column(Integer, nullable=False, default=1) # bumped on every status, stage or note write (ETags)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("UserProfile", back_populates="documents")
+    blob = relationship("Blob", back_populates="documents")
     stages = relationship("ReadingStage", back_populates="document", cascade="all, delete-orphan")
 
 class ReadingStage(Base):
@@ -40,13 +74,19 @@ class ReadingStage(Base):
     stage_index = Column(Integer)
     title = Column(String)
     objective = Column(Text)
-    stage_text = Column(Text)
+    text_ref = Column(String, nullable=True) # textstore reference to the stage text
     suggested_vocab = Column(JSON) # list of { word, definition }
+    search_vector = deferred(Column(TSVECTOR, nullable=True)) # title, objective and text; set by the worker
     created_at = Column(DateTime, default=datetime.utcnow)
 
     document = relationship("Document", back_populates="stages")
     cornell_note = relationship("CornellNote", back_populates="stage", uselist=False, cascade="all, delete-orphan")
 
+    @property
+    def stage_text(self):
+        # Read on access (i.e. only when a stage is serialized), never as part of a row load
+        return textstore.store.read(self.text_ref) if self.text_ref else ""
+
 class CornellNote(Base):
     __tablename__ = "cornell_notes"
 
@@ -58,17 +98,24 @@ class CornellNote(Base):
     notes_right = Column(Text, default="")
     summary_bottom = Column(Text, default="")
     
-    # New JSON fields for sticky notes system
-    cues_stickers = Column(Text, default="[]")  # JSON array of sticker objects
-    notes_stickers = Column(Text, default="[]")  # JSON array of sticker objects  
-    highlights = Column(Text, default="[]")  # JSON array of highlight objects
-    
+    # JSON fields for sticky notes system
+    cues_stickers = Column(JSONB, default=list)  # array of sticker objects
+    notes_stickers = Column(JSONB, default=list)  # array of sticker objects
+    highlights = Column(JSONB, default=list)  # array of highlight objects
+
+    version = Column(Integer, nullable=False, default=1)  # optimistic concurrency for PATCH
+    # Maintained by Postgres on every insert/update of the note
+    search_vector = deferred(Column(TSVECTOR, Computed(search.NOTE_SEARCH_VECTOR_SQL, persisted=True)))
     created_at = Column(DateTime, default=datetime.utcnow)
 
     stage = relationship("ReadingStage", back_populates="cornell_note")
 
 class UnknownWord(Base):
     __tablename__ = "unknown_words"
+    __table_args__ = (
+        # One row per word per document; repeated clicks upsert into it
+        UniqueConstraint("user_id", "word", "document_id", name="uq_unknown_words_user_word_document"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -79,3 +126,60 @@ class UnknownWord(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("UserProfile", back_populates="unknown_words")
+
+class OutboxMessage(Base):
+    __tablename__ = "outbox"
+
+    # Jobs written in the same transaction as the rows they refer to; the relay
+    # publishes them to RabbitMQ and deletes them once the broker confirms.
+    id = Column(Integer, primary_key=True, index=True)
+    queue = Column(String, nullable=False)
+    payload = Column(JSON, nullable=False)
+    priority = Column(Integer, nullable=True)  # AMQP priority, reading-plan jobs only
+    attempts = Column(Integer, default=0)
+    last_error = Column(Text, nullable=True)
+    available_at = Column(DateTime, default=datetime.utcnow, index=True) # pushed back after a failed publish
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class PlanJob(Base):
+    __tablename__ = "plan_jobs"
+
+    # Ledger of reading-plan generation. One row per (document, text, profile):
+    # the worker claims it atomically before the AI call, so a redelivered
+    # message never pays for the same plan twice.
+    id = Column(Integer, primary_key=True)
+    idempotency_key = Column(String, nullable=False, unique=True)  # plan:<document>:<blob sha256>:<profile version>
+    document_id = Column(Integer, ForeignKey("documents.id", ondelete="CASCADE"), nullable=False, index=True)
+    user_id = Column(Integer, nullable=False)
+    status = Column(String, nullable=False, default="running")  # running -> succeeded | retrying | failed (dead-lettered) | rejected (4xx)
+    attempts = Column(Integer, nullable=False, default=1)
+    worker = Column(String)  # host:pid holding the claim
+    lease_until = Column(DateTime, nullable=True)  # a running claim past this is considered crashed
+    stage_count = Column(Integer, nullable=True)
+    error = Column(Text, nullable=True)
+    phases = Column(JSON, nullable=True)  # milliseconds per phase of the last attempt
+    duration_ms = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+# --- Indexes for the hot queries (created by migrations/versions/0003_index_pack.py) ---
+
+# Keyset-paginated document list: WHERE user_id = ? ORDER BY created_at DESC, id DESC
+Index("ix_documents_user_created", Document.user_id, Document.created_at.desc(), Document.id.desc())
+# Stages of a document in reading order; unique, the worker upserts stages by position
+Index("uq_reading_stages_document_stage", ReadingStage.document_id, ReadingStage.stage_index, unique=True)
+# One note per stage; also serves the stage -> note joins
+Index("uq_cornell_notes_stage_id", CornellNote.stage_id, unique=True)
+
+# --- Full-text search (created by migrations/versions/0005_full_text_search.py) ---
+
+Index("ix_blob_search_chunks_search_vector", BlobSearchChunk.search_vector, postgresql_using="gin")
+Index("ix_reading_stages_search_vector", ReadingStage.search_vector, postgresql_using="gin")
+Index("ix_cornell_notes_search_vector", CornellNote.search_vector, postgresql_using="gin")
+
+# --- Plan job ledger (created by migrations/versions/0007_plan_jobs.py) ---
+
+# Operator view of the backlog: WHERE status = ? ORDER BY updated_at
+Index("ix_plan_jobs_status_updated", PlanJob.status, PlanJob.updated_at)
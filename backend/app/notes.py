@@ -0,0 +1,129 @@
+import copy
+
+from sqlalchemy.orm import Session
+
+from . import models, schemas, crud, cache
+
+NOTE_FIELDS = ("cues_left", "notes_right", "summary_bottom", "cues_stickers", "notes_stickers", "highlights")
+
+
+class PatchError(Exception):
+    pass
+
+
+class VersionConflict(Exception):
+    def __init__(self, current_version: int):
+        super().__init__(f"Note is at version {current_version}")
+        self.current_version = current_version
+
+
+# --- JSON Patch ---
+
+def _parse_pointer(path: str) -> list:
+    if not path or not path.startswith("/"):
+        raise PatchError(f"Invalid path: {path!r}")
+    tokens = [token.replace("~1", "/").replace("~0", "~") for token in path[1:].split("/")]
+    if tokens[0] not in NOTE_FIELDS:
+        raise PatchError(f"Unknown note field: {tokens[0]!r}")
+    return tokens
+
+def _resolve_parent(doc: dict, tokens: list):
+    target = doc
+    for token in tokens[:-1]:
+        try:
+            target = target[int(token)] if isinstance(target, list) else target[token]
+        except (KeyError, IndexError, ValueError, TypeError):
+            raise PatchError(f"Path not found: /{'/'.join(tokens)}")
+    return target, tokens[-1]
+
+def _list_index(container: list, token: str, allow_end: bool) -> int:
+    if allow_end and token == "-":
+        return len(container)
+    try:
+        index = int(token)
+    except ValueError:
+        raise PatchError(f"Invalid array index: {token!r}")
+    if index < 0 or index > len(container) or (index == len(container) and not allow_end):
+        raise PatchError(f"Array index out of range: {index}")
+    return index
+
+def _add(doc: dict, tokens: list, value):
+    if len(tokens) == 1:
+        doc[tokens[0]] = value
+        return
+    parent, token = _resolve_parent(doc, tokens)
+    if isinstance(parent, list):
+        parent.insert(_list_index(parent, token, allow_end=True), value)
+    elif isinstance(parent, dict):
+        parent[token] = value
+    else:
+        raise PatchError(f"Cannot add into a scalar at /{'/'.join(tokens)}")
+
+def _remove(doc: dict, tokens: list):
+    if len(tokens) == 1:
+        raise PatchError("Note fields cannot be removed")
+    parent, token = _resolve_parent(doc, tokens)
+    if isinstance(parent, list):
+        return parent.pop(_list_index(parent, token, allow_end=False))
+    if isinstance(parent, dict) and token in parent:
+        return parent.pop(token)
+    raise PatchError(f"Path not found: /{'/'.join(tokens)}")
+
+def apply_patch(doc: dict, ops: list) -> dict:
+    # All-or-nothing: works on a copy so a failing op leaves the note untouched
+    doc = copy.deepcopy(doc)
+    for op in ops:
+        tokens = _parse_pointer(op.path)
+        if op.op == "add":
+            _add(doc, tokens, op.value)
+        elif op.op == "remove":
+            _remove(doc, tokens)
+        elif op.op == "replace":
+            if len(tokens) > 1:
+                _remove(doc, tokens)
+            _add(doc, tokens, op.value)
+        elif op.op == "move":
+            value = _remove(doc, _parse_pointer(op.from_path))
+            _add(doc, tokens, value)
+
+    for field in ("cues_left", "notes_right", "summary_bottom"):
+        if not isinstance(doc[field], str):
+            raise PatchError(f"{field} must be a string")
+    for field in crud.NOTE_JSON_FIELDS:
+        if not isinstance(doc[field], list):
+            raise PatchError(f"{field} must be an array")
+    return doc
+
+
+# --- Writes ---
+
+def note_state(note: models.CornellNote) -> dict:
+    return {field: getattr(note, field) for field in NOTE_FIELDS}
+
+def patch_note(db: Session, stage: models.ReadingStage, version: int, ops: list) -> models.CornellNote:
+    # Applied and committed before the response, with an UPDATE guarded by the
+    # version the edits are based on. Clients coalesce keystrokes themselves:
+    # a burst of edits goes out as one PATCH carrying all of its ops.
+    note = crud.get_cornell_note(db, stage.id)
+    if note is None:
+        note = crud.create_cornell_note(db, schemas.CornellNoteCreate(), stage.id)
+    if version != note.version:
+        raise VersionConflict(note.version)
+
+    values = apply_patch(note_state(note), ops)
+    values["version"] = version + 1
+    updated = (
+        db.query(models.CornellNote)
+        .filter(models.CornellNote.id == note.id, models.CornellNote.version == version)
+        .update(values, synchronize_session=False)
+    )
+    if not updated:
+        # Another write landed between the read and the UPDATE
+        db.rollback()
+        raise VersionConflict(crud.get_cornell_note(db, stage.id).version)
+
+    crud.bump_document_version(db, stage.document_id)
+    db.commit()
+    db.refresh(note)
+    cache.invalidate_document(stage.document_id)
+    return note
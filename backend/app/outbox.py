@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from . import models, database, messaging
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1.0"))  # seconds between polls when idle
+OUTBOX_RETRY_DELAY = float(os.getenv("OUTBOX_RETRY_DELAY", "5"))  # base backoff after a failed publish
+OUTBOX_MAX_RETRY_DELAY = float(os.getenv("OUTBOX_MAX_RETRY_DELAY", "300"))
+
+
+class OutboxRelay:
+    # Drains the outbox table to RabbitMQ. Rows are claimed with
+    # FOR UPDATE SKIP LOCKED, so every backend replica can run a relay and
+    # each batch is published by exactly one of them.
+
+    def __init__(self, session_factory, publisher: messaging.Publisher, batch_size: int, poll_interval: float):
+        self.session_factory = session_factory
+        self.publisher = publisher
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="outbox-relay", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def notify(self):
+        # Called after a commit that wrote outbox rows, so they don't wait for the next poll
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                relayed = self.relay_batch()
+            except Exception as e:
+                print(f"Outbox relay error: {e}")
+                relayed = 0
+
+            # A full batch means there is probably more waiting
+            if relayed < self.batch_size:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def relay_batch(self) -> int:
+        db = self.session_factory()
+        try:
+            rows = (
+                db.query(models.OutboxMessage)
+                .filter(models.OutboxMessage.available_at <= datetime.utcnow())
+                .order_by(models.OutboxMessage.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+                .all()
+            )
+            if not rows:
+                db.rollback()
+                return 0
+
+            # Publish the whole batch, then wait once; confirms come back batched
+            pending = [
+                (row, self.publisher.publish_async(
+                    row.queue, row.payload, priority=row.priority,
+                    headers={messaging.ENQUEUED_AT_HEADER: row.created_at.replace(tzinfo=timezone.utc).timestamp()},
+                ))
+                for row in rows
+            ]
+            deadline = time.monotonic() + messaging.PUBLISH_TIMEOUT
+            for row, future in pending:
+                try:
+                    future.result(timeout=max(0, deadline - time.monotonic()))
+                    db.delete(row)
+                except Exception as e:
+                    row.attempts += 1
+                    row.last_error = str(e) or "No broker confirm"
+                    delay = min(OUTBOX_RETRY_DELAY * 2 ** (row.attempts - 1), OUTBOX_MAX_RETRY_DELAY)
+                    row.available_at = datetime.utcnow() + timedelta(seconds=delay)
+            db.commit()
+            return len(rows)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+
+relay = OutboxRelay(
+    session_factory=database.SessionLocal,
+    publisher=messaging.publisher,
+    batch_size=OUTBOX_BATCH_SIZE,
+    poll_interval=OUTBOX_POLL_INTERVAL,
+)
@@ -1,6 +1,7 @@
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, Field, field_validator
+from typing import Any, List, Literal, Optional
 from datetime import datetime
+import json
 
 # User Profile
 class UserProfileBase(BaseModel):
@@ -28,17 +29,58 @@ class DocumentBase(BaseModel):
     content_type: str
 
 class DocumentCreate(DocumentBase):
-    raw_text: str
+    blob_sha256: str
+
+class BlobCreate(BaseModel):
+    sha256: str
+    size_bytes: int
+    content_type: str
+    storage_path: str
 
 class Document(DocumentBase):
     id: int
     user_id: int
     created_at: datetime
-    raw_text: str
+    status: str
+    error: Optional[str] = None
     
     class Config:
         from_attributes = True
 
+class DocumentListItem(DocumentBase):
+    id: int
+    status: str
+    created_at: datetime
+    stage_count: int
+
+class DocumentPage(BaseModel):
+    items: List[DocumentListItem]
+    next_cursor: Optional[str] = None
+
+class DocumentStatus(BaseModel):
+    document_id: int
+    status: str
+    error: Optional[str] = None
+
+class DedupStats(BaseModel):
+    documents: int
+    blobs: int
+    logical_bytes: int
+    stored_bytes: int
+    saved_bytes: int
+    logical_text_chars: int
+    stored_text_chars: int
+    saved_text_chars: int
+    extraction_ms_spent: int
+    extraction_ms_saved: int
+
+class PlanJobStats(BaseModel):
+    status: str
+    jobs: int
+    attempts: int
+    avg_duration_ms: Optional[int] = None
+    oldest_update: Optional[datetime] = None
+
 # Cornell Note
 class CornellNoteBase(BaseModel):
     cues_left: str = ""
@@ -48,17 +90,36 @@ class CornellNoteBase(BaseModel):
     notes_stickers: str = "[]"  # JSON string
     highlights: str = "[]"  # JSON string
 
+    @field_validator("cues_stickers", "notes_stickers", "highlights", mode="before")
+    @classmethod
+    def dump_json(cls, value):
+        # Stored as JSONB; the API keeps exchanging JSON strings
+        return value if isinstance(value, str) else json.dumps(value)
+
 class CornellNoteCreate(CornellNoteBase):
     pass
 
 class CornellNote(CornellNoteBase):
     id: int
     stage_id: int
+    version: int
     created_at: datetime
 
     class Config:
         from_attributes = True
 
+class NotePatchOperation(BaseModel):
+    # JSON Patch (RFC 6902) subset; paths point into the note, e.g.
+    # "/cues_stickers/-", "/highlights/3", "/notes_stickers/0/text", "/summary_bottom"
+    op: Literal["add", "remove", "replace", "move"]
+    path: str
+    from_path: Optional[str] = Field(None, alias="from")
+    value: Any = None
+
+class CornellNotePatch(BaseModel):
+    version: int  # version the client's edits are based on
+    ops: List[NotePatchOperation]  # everything edited since the last PATCH; clients debounce, not the server
+
 # Vocabulary
 class VocabItem(BaseModel):
     word: str
@@ -86,6 +147,9 @@ class UnknownWordCreate(BaseModel):
     word: str
     context_sentence: Optional[str] = None
 
+class UnknownWordBatch(BaseModel):
+    words: List[UnknownWordCreate] = Field(..., max_length=500)
+
 class UnknownWord(UnknownWordCreate):
     id: int
     user_id: int
@@ -99,3 +163,20 @@ class DocumentSummary(BaseModel):
     total_stages: int
     total_vocab_suggested: int
     cornell_notes: List[CornellNote]
+
+# Search
+class SearchHit(BaseModel):
+    kind: Literal["document", "stage", "note"]
+    document_id: int
+    document_title: Optional[str] = None
+    stage_id: Optional[int] = None
+    stage_title: Optional[str] = None
+    # Passage of the document text, usable as /text?offset=&length= (document hits only)
+    char_offset: Optional[int] = None
+    char_length: Optional[int] = None
+    rank: float
+    snippet: str  # HTML: the text is escaped, matches are wrapped in <mark>
+
+class SearchPage(BaseModel):
+    items: List[SearchHit]
+    next_offset: Optional[int] = None
@@ -0,0 +1,37 @@
+import hashlib
+import os
+import tempfile
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "/data/uploads")
+
+CHUNK_SIZE = 1024 * 1024
+
+def blob_path(sha256: str) -> str:
+    return os.path.join(UPLOAD_DIR, sha256[:2], sha256[2:4], sha256)
+
+def save_upload(fileobj):
+    # Stream to disk in chunks while hashing, then move the file to its
+    # content-addressed location. Returns (sha256, size_bytes, path).
+    tmp_dir = os.path.join(UPLOAD_DIR, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    digest = hashlib.sha256()
+    size = 0
+    with tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as out:
+        while True:
+            chunk = fileobj.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            out.write(chunk)
+            size += len(chunk)
+
+    sha256 = digest.hexdigest()
+    path = blob_path(sha256)
+    if os.path.exists(path):
+        # Same bytes already stored
+        os.unlink(out.name)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(out.name, path)
+    return sha256, size, path
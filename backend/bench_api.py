@@ -0,0 +1,83 @@
+import http.client
+import os
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+# Load test for the read endpoints. Start one API with DB_ASYNC=false and one
+# with DB_ASYNC=true against the same database, then compare, e.g.
+#   BENCH_USER_ID=1 BENCH_DOCUMENT_ID=1 python bench_api.py sync=http://localhost:8000 async=http://localhost:8001
+
+BENCH_CONCURRENCY = int(os.getenv("BENCH_CONCURRENCY", "100"))
+BENCH_DURATION = float(os.getenv("BENCH_DURATION", "30"))  # seconds per target
+BENCH_USER_ID = int(os.getenv("BENCH_USER_ID", "1"))
+BENCH_DOCUMENT_ID = int(os.getenv("BENCH_DOCUMENT_ID", "1"))
+
+PATHS = [
+    f"/api/users/{BENCH_USER_ID}/documents?limit=20",
+    f"/api/documents/{BENCH_DOCUMENT_ID}",
+    f"/api/documents/{BENCH_DOCUMENT_ID}/status",
+    f"/api/documents/{BENCH_DOCUMENT_ID}/stages",
+    f"/api/documents/{BENCH_DOCUMENT_ID}/summary",
+]
+
+def client_loop(host, port, deadline, latencies, errors, lock):
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    local_latencies, local_errors, i = [], 0, 0
+    while time.monotonic() < deadline:
+        path = PATHS[i % len(PATHS)]
+        i += 1
+        started = time.monotonic()
+        try:
+            conn.request("GET", path)
+            response = conn.getresponse()
+            response.read()
+            if response.status >= 500:
+                local_errors += 1
+            else:
+                local_latencies.append(time.monotonic() - started)
+        except (OSError, http.client.HTTPException):
+            local_errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=30)
+    conn.close()
+    with lock:
+        latencies.extend(local_latencies)
+        errors.append(local_errors)
+
+def bench_target(name, url):
+    parts = urlsplit(url)
+    latencies, errors, lock = [], [], threading.Lock()
+    deadline = time.monotonic() + BENCH_DURATION
+    threads = [
+        threading.Thread(target=client_loop, args=(parts.hostname, parts.port or 80, deadline, latencies, errors, lock))
+        for _ in range(BENCH_CONCURRENCY)
+    ]
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+
+    def percentile(p):
+        if not latencies:
+            return float("nan")
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+    print(
+        f"{name:<8} requests={len(latencies):<8} errors={sum(errors):<6} req/sec={len(latencies) / elapsed:<9.1f} "
+        f"p50={percentile(0.50):.1f}ms p99={percentile(0.99):.1f}ms"
+    )
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python bench_api.py name=base_url [name=base_url ...]")
+        sys.exit(1)
+
+    for arg in sys.argv[1:]:
+        name, _, url = arg.partition("=")
+        bench_target(name, url)
@@ -0,0 +1,96 @@
+"""Initial schema, as previously created by create_all at import time
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+
+Databases that already ran the old create_all keep their tables; only the
+missing ones are created, so the same chain works for new and existing
+deployments.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if "users" not in existing:
+        op.create_table(
+            "users",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("nome", sa.String(), nullable=False),
+            sa.Column("idade", sa.Integer()),
+            sa.Column("grau_de_instrucao", sa.String()),
+            sa.Column("education_year", sa.String()),
+            sa.Column("profissao", sa.String()),
+            sa.Column("nacionalidade", sa.String()),
+            sa.Column("lingua_nativa", sa.String()),
+            sa.Column("created_at", sa.DateTime()),
+        )
+        op.create_index("ix_users_id", "users", ["id"])
+
+    if "documents" not in existing:
+        op.create_table(
+            "documents",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id")),
+            sa.Column("original_filename", sa.String()),
+            sa.Column("content_type", sa.String()),
+            sa.Column("raw_text", sa.Text()),
+            sa.Column("created_at", sa.DateTime()),
+        )
+        op.create_index("ix_documents_id", "documents", ["id"])
+
+    if "reading_stages" not in existing:
+        op.create_table(
+            "reading_stages",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("document_id", sa.Integer(), sa.ForeignKey("documents.id")),
+            sa.Column("stage_index", sa.Integer()),
+            sa.Column("title", sa.String()),
+            sa.Column("objective", sa.Text()),
+            sa.Column("stage_text", sa.Text()),
+            sa.Column("suggested_vocab", sa.JSON()),
+            sa.Column("created_at", sa.DateTime()),
+        )
+        op.create_index("ix_reading_stages_id", "reading_stages", ["id"])
+
+    if "cornell_notes" not in existing:
+        op.create_table(
+            "cornell_notes",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("stage_id", sa.Integer(), sa.ForeignKey("reading_stages.id")),
+            sa.Column("cues_left", sa.Text()),
+            sa.Column("notes_right", sa.Text()),
+            sa.Column("summary_bottom", sa.Text()),
+            sa.Column("cues_stickers", sa.Text()),
+            sa.Column("notes_stickers", sa.Text()),
+            sa.Column("highlights", sa.Text()),
+            sa.Column("created_at", sa.DateTime()),
+        )
+        op.create_index("ix_cornell_notes_id", "cornell_notes", ["id"])
+
+    if "unknown_words" not in existing:
+        op.create_table(
+            "unknown_words",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id")),
+            sa.Column("document_id", sa.Integer(), sa.ForeignKey("documents.id"), nullable=True),
+            sa.Column("stage_id", sa.Integer(), sa.ForeignKey("reading_stages.id"), nullable=True),
+            sa.Column("word", sa.String()),
+            sa.Column("context_sentence", sa.Text()),
+            sa.Column("created_at", sa.DateTime()),
+        )
+        op.create_index("ix_unknown_words_id", "unknown_words", ["id"])
+
+
+def downgrade():
+    for table in ("unknown_words", "cornell_notes", "reading_stages", "documents", "users"):
+        op.drop_table(table)
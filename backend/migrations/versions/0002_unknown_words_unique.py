@@ -0,0 +1,37 @@
+"""One unknown_words row per word per document
+
+Revision ID: 0002
+Revises: 0002e
+Create Date: 2026-10-18
+
+Last of the ingestion pipeline revisions (0002a-0002e before it). It keeps
+the id the combined revision had, so databases already stamped 0002 or
+later carry on unchanged.
+"""
+from alembic import op
+
+
+revision = "0002"
+down_revision = "0002e"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Normalize, drop duplicates, then enforce uniqueness
+    op.execute("""
+        DELETE FROM unknown_words a
+        USING unknown_words b
+        WHERE a.user_id = b.user_id
+          AND a.document_id IS NOT DISTINCT FROM b.document_id
+          AND lower(trim(a.word)) = lower(trim(b.word))
+          AND a.id < b.id
+    """)
+    op.execute("UPDATE unknown_words SET word = lower(trim(word))")
+    op.create_unique_constraint(
+        "uq_unknown_words_user_word_document", "unknown_words", ["user_id", "word", "document_id"]
+    )
+
+
+def downgrade():
+    op.drop_constraint("uq_unknown_words_user_word_document", "unknown_words", type_="unique")
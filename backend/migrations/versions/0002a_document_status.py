@@ -0,0 +1,29 @@
+"""Asynchronous ingestion: document status, error and spooled upload path
+
+Revision ID: 0002a
+Revises: 0001
+Create Date: 2026-10-18
+
+Documents that already have text were extracted and planned by the old
+synchronous upload, so they start out 'ready'.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002a"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("documents", sa.Column("storage_path", sa.String(), nullable=True))
+    op.add_column("documents", sa.Column("status", sa.String(), server_default="uploaded"))
+    op.add_column("documents", sa.Column("error", sa.Text(), nullable=True))
+    op.execute("UPDATE documents SET status = 'ready' WHERE raw_text IS NOT NULL")
+
+
+def downgrade():
+    for column in ("error", "status", "storage_path"):
+        op.drop_column("documents", column)
@@ -0,0 +1,33 @@
+"""Transactional outbox for pipeline jobs
+
+Revision ID: 0002b
+Revises: 0002a
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002b"
+down_revision = "0002a"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "outbox",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("queue", sa.String(), nullable=False),
+        sa.Column("payload", sa.JSON(), nullable=False),
+        sa.Column("attempts", sa.Integer()),
+        sa.Column("last_error", sa.Text(), nullable=True),
+        sa.Column("available_at", sa.DateTime()),
+        sa.Column("created_at", sa.DateTime()),
+    )
+    op.create_index("ix_outbox_id", "outbox", ["id"])
+    op.create_index("ix_outbox_available_at", "outbox", ["available_at"])
+
+
+def downgrade():
+    op.drop_table("outbox")
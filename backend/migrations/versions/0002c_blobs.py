@@ -0,0 +1,72 @@
+"""Content-addressed blobs shared by documents with the same bytes
+
+Revision ID: 0002c
+Revises: 0002b
+Create Date: 2026-10-18
+
+Existing inline documents.raw_text is moved into blobs keyed by the SHA-256
+of the text. An upload still waiting for extraction only has a spool path,
+and its bytes can't be hashed from SQL, so it is failed and has to be
+uploaded again.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002c"
+down_revision = "0002b"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "blobs",
+        sa.Column("sha256", sa.String(64), primary_key=True),
+        sa.Column("size_bytes", sa.BigInteger()),
+        sa.Column("content_type", sa.String()),
+        sa.Column("storage_path", sa.String()),
+        sa.Column("raw_text", sa.Text(), nullable=True),
+        sa.Column("text_length", sa.Integer(), nullable=True),
+        sa.Column("status", sa.String()),
+        sa.Column("error", sa.Text(), nullable=True),
+        sa.Column("extraction_ms", sa.Integer(), nullable=True),
+        sa.Column("claimed_at", sa.DateTime(), nullable=True),
+        sa.Column("created_at", sa.DateTime()),
+    )
+    op.add_column("documents", sa.Column("blob_sha256", sa.String(64), sa.ForeignKey("blobs.sha256"), nullable=True))
+    op.create_index("ix_documents_blob_sha256", "documents", ["blob_sha256"])
+
+    op.execute("""
+        INSERT INTO blobs (sha256, size_bytes, content_type, raw_text, text_length, status, created_at)
+        SELECT DISTINCT ON (hash) hash, octet_length(raw_text), content_type, raw_text, length(raw_text), 'extracted', created_at
+        FROM (
+            SELECT encode(sha256(convert_to(raw_text, 'UTF8')), 'hex') AS hash, raw_text, content_type, created_at
+            FROM documents WHERE raw_text IS NOT NULL
+        ) AS texts
+        ORDER BY hash, created_at
+    """)
+    op.execute("""
+        UPDATE documents
+        SET blob_sha256 = encode(sha256(convert_to(raw_text, 'UTF8')), 'hex')
+        WHERE raw_text IS NOT NULL
+    """)
+    op.execute("""
+        UPDATE documents
+        SET status = 'failed', error = 'Upload interrupted by an upgrade, please upload it again'
+        WHERE blob_sha256 IS NULL AND status IN ('uploaded', 'extracting')
+    """)
+    op.drop_column("documents", "raw_text")
+    op.drop_column("documents", "storage_path")
+
+
+def downgrade():
+    op.add_column("documents", sa.Column("storage_path", sa.String(), nullable=True))
+    op.add_column("documents", sa.Column("raw_text", sa.Text()))
+    op.execute("""
+        UPDATE documents SET raw_text = blobs.raw_text, storage_path = blobs.storage_path
+        FROM blobs WHERE blobs.sha256 = documents.blob_sha256
+    """)
+    op.drop_index("ix_documents_blob_sha256", table_name="documents")
+    op.drop_column("documents", "blob_sha256")
+    op.drop_table("blobs")
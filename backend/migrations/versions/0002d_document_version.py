@@ -0,0 +1,22 @@
+"""Document version for ETags
+
+Revision ID: 0002d
+Revises: 0002c
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002d"
+down_revision = "0002c"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("documents", sa.Column("version", sa.Integer(), nullable=False, server_default="1"))
+
+
+def downgrade():
+    op.drop_column("documents", "version")
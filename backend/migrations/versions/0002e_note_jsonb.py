@@ -0,0 +1,31 @@
+"""Cornell note sticker columns as JSONB, note version for PATCH
+
+Revision ID: 0002e
+Revises: 0002d
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = "0002e"
+down_revision = "0002d"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for column in ("cues_stickers", "notes_stickers", "highlights"):
+        op.alter_column(
+            "cornell_notes", column,
+            type_=postgresql.JSONB(),
+            postgresql_using=f"COALESCE(NULLIF({column}, ''), '[]')::jsonb",
+        )
+    op.add_column("cornell_notes", sa.Column("version", sa.Integer(), nullable=False, server_default="1"))
+
+
+def downgrade():
+    op.drop_column("cornell_notes", "version")
+    for column in ("cues_stickers", "notes_stickers", "highlights"):
+        op.alter_column("cornell_notes", column, type_=sa.Text(), postgresql_using=f"{column}::text")
@@ -0,0 +1,47 @@
+"""Index pack for the hot API queries
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+
+Built CONCURRENTLY so they can be applied to a live database without
+blocking writes. unknown_words.user_id is covered by the leading column of
+uq_unknown_words_user_word_document.
+"""
+from alembic import op
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # A unique index can't be built over duplicates; keep the latest note per stage
+    op.execute("""
+        DELETE FROM cornell_notes a
+        USING cornell_notes b
+        WHERE a.stage_id = b.stage_id AND a.id < b.id
+    """)
+
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_documents_user_created "
+            "ON documents (user_id, created_at DESC, id DESC)"
+        )
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_reading_stages_document_stage "
+            "ON reading_stages (document_id, stage_index)"
+        )
+        op.execute(
+            "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_cornell_notes_stage_id "
+            "ON cornell_notes (stage_id)"
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS uq_cornell_notes_stage_id")
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_reading_stages_document_stage")
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_documents_user_created")
@@ -0,0 +1,73 @@
+"""Move blob and stage text into the compressed text store
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+
+blobs.raw_text and reading_stages.stage_text are written to the text store
+(app/textstore.py) and replaced by text_ref columns. The migrate service
+must mount the same TEXT_STORE_DIR as the backend and worker.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app import textstore
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 200
+
+
+def upgrade():
+    op.add_column("blobs", sa.Column("text_ref", sa.String(), nullable=True))
+    op.add_column("reading_stages", sa.Column("text_ref", sa.String(), nullable=True))
+    conn = op.get_bind()
+
+    # In batches, so a large library never has to fit in memory
+    while True:
+        rows = conn.execute(sa.text(
+            "SELECT sha256, raw_text FROM blobs WHERE raw_text IS NOT NULL AND text_ref IS NULL LIMIT :n"
+        ), {"n": BATCH_SIZE}).all()
+        if not rows:
+            break
+        for sha256, raw_text in rows:
+            ref = textstore.store.put(textstore.blob_text_key(sha256), raw_text)
+            conn.execute(sa.text("UPDATE blobs SET text_ref = :ref WHERE sha256 = :sha"), {"ref": ref, "sha": sha256})
+
+    while True:
+        rows = conn.execute(sa.text(
+            "SELECT id, document_id, stage_index, stage_text FROM reading_stages "
+            "WHERE stage_text IS NOT NULL AND text_ref IS NULL LIMIT :n"
+        ), {"n": BATCH_SIZE}).all()
+        if not rows:
+            break
+        for stage_id, document_id, stage_index, stage_text in rows:
+            ref = textstore.store.put(textstore.stage_text_key(document_id, stage_index), stage_text)
+            conn.execute(sa.text("UPDATE reading_stages SET text_ref = :ref WHERE id = :id"), {"ref": ref, "id": stage_id})
+
+    op.drop_column("reading_stages", "stage_text")
+    op.drop_column("blobs", "raw_text")
+
+
+def downgrade():
+    op.add_column("blobs", sa.Column("raw_text", sa.Text(), nullable=True))
+    op.add_column("reading_stages", sa.Column("stage_text", sa.Text(), nullable=True))
+    conn = op.get_bind()
+
+    for sha256, ref in conn.execute(sa.text("SELECT sha256, text_ref FROM blobs WHERE text_ref IS NOT NULL")).all():
+        conn.execute(
+            sa.text("UPDATE blobs SET raw_text = :text WHERE sha256 = :sha"),
+            {"text": textstore.store.read(ref), "sha": sha256},
+        )
+    for stage_id, ref in conn.execute(sa.text("SELECT id, text_ref FROM reading_stages WHERE text_ref IS NOT NULL")).all():
+        conn.execute(
+            sa.text("UPDATE reading_stages SET stage_text = :text WHERE id = :id"),
+            {"text": textstore.store.read(ref), "id": stage_id},
+        )
+
+    op.drop_column("reading_stages", "text_ref")
+    op.drop_column("blobs", "text_ref")
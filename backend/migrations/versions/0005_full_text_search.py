@@ -0,0 +1,111 @@
+"""Full-text search over extracted text, stages and Cornell notes
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+
+blob_search_chunks and reading_stages.search_vector are written by the
+worker (backfilled here from the text store); cornell_notes.search_vector is
+a generated column, so Postgres keeps it current on every note write.
+Adding it rewrites cornell_notes once. GIN indexes are built CONCURRENTLY.
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from app import textstore
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 200
+SEARCH_CHUNK_CHARS = 8192
+
+NOTE_SEARCH_VECTOR = (
+    "setweight(to_tsvector('simple'::regconfig, coalesce(cues_left, '') || ' ' || coalesce(summary_bottom, '')), 'A') "
+    "|| to_tsvector('simple'::regconfig, coalesce(notes_right, '')) "
+    "|| jsonb_to_tsvector('simple'::regconfig, jsonb_path_query_array(coalesce(cues_stickers, '[]'::jsonb) "
+    "|| coalesce(notes_stickers, '[]'::jsonb) || coalesce(highlights, '[]'::jsonb), 'lax $[*].text'), '[\"string\"]')"
+)
+
+
+def upgrade():
+    op.create_table(
+        "blob_search_chunks",
+        sa.Column("blob_sha256", sa.String(64), sa.ForeignKey("blobs.sha256", ondelete="CASCADE"), primary_key=True),
+        sa.Column("chunk_index", sa.Integer(), primary_key=True),
+        sa.Column("char_offset", sa.Integer(), nullable=False),
+        sa.Column("char_length", sa.Integer(), nullable=False),
+        sa.Column("search_vector", postgresql.TSVECTOR(), nullable=False),
+    )
+    op.add_column("reading_stages", sa.Column("search_vector", postgresql.TSVECTOR(), nullable=True))
+    op.add_column(
+        "cornell_notes",
+        sa.Column("search_vector", postgresql.TSVECTOR(), sa.Computed(NOTE_SEARCH_VECTOR, persisted=True)),
+    )
+
+    conn = op.get_bind()
+    insert_chunk = sa.text(
+        "INSERT INTO blob_search_chunks (blob_sha256, chunk_index, char_offset, char_length, search_vector) "
+        "VALUES (:sha, :i, :offset, :length, to_tsvector('simple', :body))"
+    )
+    last_sha = ""
+    while True:
+        rows = conn.execute(sa.text(
+            "SELECT sha256, text_ref FROM blobs WHERE text_ref IS NOT NULL AND sha256 > :last "
+            "ORDER BY sha256 LIMIT :n"
+        ), {"last": last_sha, "n": BATCH_SIZE}).all()
+        if not rows:
+            break
+        for sha256, ref in rows:
+            text = textstore.store.read(ref)
+            params = [
+                {"sha": sha256, "i": i, "offset": start, "length": len(text[start:start + SEARCH_CHUNK_CHARS]),
+                 "body": text[start:start + SEARCH_CHUNK_CHARS]}
+                for i, start in enumerate(range(0, len(text), SEARCH_CHUNK_CHARS))
+            ]
+            if params:
+                conn.execute(insert_chunk, params)
+        last_sha = rows[-1].sha256
+
+    last_id = 0
+    while True:
+        rows = conn.execute(sa.text(
+            "SELECT id, title, objective, text_ref FROM reading_stages WHERE id > :last ORDER BY id LIMIT :n"
+        ), {"last": last_id, "n": BATCH_SIZE}).all()
+        if not rows:
+            break
+        for stage_id, title, objective, ref in rows:
+            conn.execute(sa.text(
+                "UPDATE reading_stages SET search_vector = "
+                "setweight(to_tsvector('simple', :title), 'A') || setweight(to_tsvector('simple', :objective), 'B') "
+                "|| to_tsvector('simple', :body) WHERE id = :id"
+            ), {"title": title or "", "objective": objective or "", "body": textstore.store.read(ref) if ref else "", "id": stage_id})
+        last_id = rows[-1].id
+
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_blob_search_chunks_search_vector "
+            "ON blob_search_chunks USING gin (search_vector)"
+        )
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_reading_stages_search_vector "
+            "ON reading_stages USING gin (search_vector)"
+        )
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_cornell_notes_search_vector "
+            "ON cornell_notes USING gin (search_vector)"
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_cornell_notes_search_vector")
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_reading_stages_search_vector")
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_blob_search_chunks_search_vector")
+    op.drop_column("cornell_notes", "search_vector")
+    op.drop_column("reading_stages", "search_vector")
+    op.drop_table("blob_search_chunks")
@@ -0,0 +1,30 @@
+"""Priority for reading-plan jobs in the outbox
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+
+Reading-plan jobs now go to reading_plan_priority_queue with an AMQP
+priority chosen when the job is written. Jobs still sitting in the outbox
+for the old reading_plan_queue are pointed at the new queue; messages
+already on the broker are moved with `python replay_dlq.py --from
+reading_plan_queue` in the worker container.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("outbox", sa.Column("priority", sa.Integer(), nullable=True))
+    op.execute("UPDATE outbox SET queue = 'reading_plan_priority_queue' WHERE queue = 'reading_plan_queue'")
+
+
+def downgrade():
+    op.execute("UPDATE outbox SET queue = 'reading_plan_queue' WHERE queue = 'reading_plan_priority_queue'")
+    op.drop_column("outbox", "priority")
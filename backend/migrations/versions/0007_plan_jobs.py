@@ -0,0 +1,46 @@
+"""Plan job ledger
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18
+
+plan_jobs records every reading-plan generation, keyed by document, text
+and profile version. The worker claims a row (INSERT ... ON CONFLICT DO
+UPDATE ... WHERE) before calling the AI service.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "plan_jobs",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("idempotency_key", sa.String(), nullable=False, unique=True),
+        sa.Column("document_id", sa.Integer(), sa.ForeignKey("documents.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("worker", sa.String()),
+        sa.Column("lease_until", sa.DateTime(), nullable=True),
+        sa.Column("stage_count", sa.Integer(), nullable=True),
+        sa.Column("error", sa.Text(), nullable=True),
+        sa.Column("phases", sa.JSON(), nullable=True),
+        sa.Column("duration_ms", sa.Integer(), nullable=True),
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("started_at", sa.DateTime(), nullable=True),
+        sa.Column("finished_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime()),
+    )
+    op.create_index("ix_plan_jobs_document_id", "plan_jobs", ["document_id"])
+    op.create_index("ix_plan_jobs_status_updated", "plan_jobs", ["status", "updated_at"])
+
+
+def downgrade():
+    op.drop_table("plan_jobs")
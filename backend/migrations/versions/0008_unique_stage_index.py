@@ -0,0 +1,47 @@
+"""One reading stage per (document, stage_index)
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18
+
+The worker now upserts stages by position instead of deleting and
+reinserting them, so a retried plan keeps the stage rows (and the notes and
+unknown words attached to them). ON CONFLICT needs a unique index on the
+pair; it replaces the plain one from 0003. Duplicate positions nobody has
+attached anything to are dropped first.
+"""
+from alembic import op
+
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""
+        DELETE FROM reading_stages a
+        USING reading_stages b
+        WHERE a.document_id = b.document_id
+          AND a.stage_index = b.stage_index
+          AND a.id < b.id
+          AND NOT EXISTS (SELECT 1 FROM cornell_notes n WHERE n.stage_id = a.id)
+          AND NOT EXISTS (SELECT 1 FROM unknown_words w WHERE w.stage_id = a.id)
+    """)
+
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_reading_stages_document_stage "
+            "ON reading_stages (document_id, stage_index)"
+        )
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_reading_stages_document_stage")
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_reading_stages_document_stage "
+            "ON reading_stages (document_id, stage_index)"
+        )
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS uq_reading_stages_document_stage")
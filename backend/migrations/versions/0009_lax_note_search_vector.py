@@ -0,0 +1,51 @@
+"""Note search vector tolerates stickers without text
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18
+
+0005 read sticker and highlight words with a strict JSON path, so saving an
+object without a "text" key (e.g. a bare highlight range) failed the whole
+note write. A generated column's expression can't be altered in place: the
+column is dropped and added back, which rewrites cornell_notes once, and its
+GIN index is rebuilt CONCURRENTLY.
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+
+def note_search_vector(mode: str) -> str:
+    return (
+        "setweight(to_tsvector('simple'::regconfig, coalesce(cues_left, '') || ' ' || coalesce(summary_bottom, '')), 'A') "
+        "|| to_tsvector('simple'::regconfig, coalesce(notes_right, '')) "
+        "|| jsonb_to_tsvector('simple'::regconfig, jsonb_path_query_array(coalesce(cues_stickers, '[]'::jsonb) "
+        f"|| coalesce(notes_stickers, '[]'::jsonb) || coalesce(highlights, '[]'::jsonb), '{mode} $[*].text'), '[\"string\"]')"
+    )
+
+def replace_search_vector(mode: str):
+    # Dropping the column drops its index with it
+    op.drop_column("cornell_notes", "search_vector")
+    op.add_column(
+        "cornell_notes",
+        sa.Column("search_vector", postgresql.TSVECTOR(), sa.Computed(note_search_vector(mode), persisted=True)),
+    )
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_cornell_notes_search_vector "
+            "ON cornell_notes USING gin (search_vector)"
+        )
+
+
+def upgrade():
+    replace_search_vector("lax")
+
+
+def downgrade():
+    replace_search_vector("strict")
@@ -0,0 +1,34 @@
+import os
+
+import pytest
+
+# Unit tests run anywhere the service's requirements are installed. Tests that
+# need Postgres use the db fixture: point TEST_DATABASE_URL at a scratch
+# database migrated to head (every table is truncated before each test).
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+if TEST_DATABASE_URL:
+    # app.database builds its engines from DATABASE_URL at import
+    os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+
+TABLES = (
+    "outbox", "plan_jobs", "unknown_words", "cornell_notes", "reading_stages",
+    "documents", "blob_search_chunks", "blobs", "users",
+)
+
+
+@pytest.fixture
+def db():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    pytest.importorskip("sqlalchemy")
+    from sqlalchemy import text
+    from app import database
+
+    with database.engine.begin() as conn:
+        conn.execute(text(f"TRUNCATE {', '.join(TABLES)} RESTART IDENTITY CASCADE"))
+    session = database.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
@@ -0,0 +1,109 @@
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from app import database, models, notes, schemas
+
+
+def op(op: str, path: str, value=None, from_path: str = None):
+    return schemas.NotePatchOperation(op=op, path=path, value=value, **({"from": from_path} if from_path else {}))
+
+def empty_note() -> dict:
+    return {field: "" for field in ("cues_left", "notes_right", "summary_bottom")} | {
+        field: [] for field in ("cues_stickers", "notes_stickers", "highlights")
+    }
+
+
+# --- JSON Patch ---
+
+def test_add_replace_remove_and_move():
+    doc = empty_note()
+    doc = notes.apply_patch(doc, [
+        op("add", "/cues_stickers/-", {"id": "a", "text": "first"}),
+        op("add", "/cues_stickers/-", {"id": "b", "text": "second"}),
+        op("replace", "/cues_stickers/0/text", "edited"),
+        op("replace", "/summary_bottom", "summary"),
+        op("move", "/notes_stickers/-", from_path="/cues_stickers/1"),
+        op("add", "/highlights/0", {"start": 1}),
+        op("remove", "/highlights/0"),
+    ])
+
+    assert doc["cues_stickers"] == [{"id": "a", "text": "edited"}]
+    assert doc["notes_stickers"] == [{"id": "b", "text": "second"}]
+    assert doc["summary_bottom"] == "summary"
+    assert doc["highlights"] == []
+
+def test_a_failing_op_leaves_the_note_untouched():
+    doc = empty_note()
+    with pytest.raises(notes.PatchError):
+        notes.apply_patch(doc, [op("add", "/highlights/-", {"start": 1}), op("remove", "/highlights/5")])
+    assert doc == empty_note()
+
+@pytest.mark.parametrize("ops", [
+    [op("replace", "/summary_bottom", ["not", "a", "string"])],
+    [op("replace", "/highlights", "not an array")],
+    [op("remove", "/cues_left")],
+    [op("add", "/version", 7)],
+    [op("add", "cues_left", "no leading slash")],
+    [op("add", "/cues_stickers/9", {})],
+])
+def test_invalid_patches_are_rejected(ops):
+    with pytest.raises(notes.PatchError):
+        notes.apply_patch(empty_note(), ops)
+
+
+# --- Writes ---
+
+@pytest.fixture
+def stage(db):
+    user = models.UserProfile(nome="Ana", idade=30, lingua_nativa="Português")
+    blob = models.Blob(sha256="0" * 64, size_bytes=1, content_type="text", storage_path="/dev/null")
+    document = models.Document(user=user, blob=blob, original_filename="a.txt", status="ready")
+    stage = models.ReadingStage(document=document, stage_index=0, title="Stage 1", objective="Read")
+    db.add(stage)
+    db.commit()
+    return stage
+
+def test_patch_is_committed_before_it_returns(db, stage):
+    document_version = stage.document.version
+    note = notes.patch_note(db, stage, 1, [op("add", "/cues_stickers/-", {"id": "a"})])
+    assert note.version == 2
+
+    # A new session (another request, or another replica) sees the write at once
+    with database.SessionLocal() as other:
+        stored = other.query(models.CornellNote).filter(models.CornellNote.stage_id == stage.id).one()
+        assert stored.cues_stickers == [{"id": "a"}]
+        assert stored.version == 2
+        assert other.get(models.Document, stage.document_id).version > document_version
+
+def test_sticker_without_text_is_saved(db, stage):
+    # The search vector only reads "text"; a bare highlight range must not fail the write
+    note = notes.patch_note(db, stage, 1, [op("add", "/highlights/-", {"start": 4, "end": 9})])
+    assert note.highlights == [{"start": 4, "end": 9}]
+
+def test_stale_version_is_a_conflict(db, stage):
+    notes.patch_note(db, stage, 1, [op("replace", "/cues_left", "first")])
+
+    with pytest.raises(notes.VersionConflict) as conflict:
+        notes.patch_note(db, stage, 1, [op("replace", "/cues_left", "second")])
+    assert conflict.value.current_version == 2
+    assert db.query(models.CornellNote).one().cues_left == "first"
+
+def test_write_landing_between_read_and_update_is_a_conflict(db, stage, monkeypatch):
+    notes.patch_note(db, stage, 1, [op("replace", "/cues_left", "first")])
+    apply_patch = notes.apply_patch
+
+    def racing_apply_patch(doc, ops):
+        # Another replica commits version 3 while this request still holds version 2
+        with database.SessionLocal() as other:
+            other.query(models.CornellNote).update({"cues_left": "theirs", "version": 3})
+            other.commit()
+        return apply_patch(doc, ops)
+
+    monkeypatch.setattr(notes, "apply_patch", racing_apply_patch)
+    with pytest.raises(notes.VersionConflict) as conflict:
+        notes.patch_note(db, stage, 2, [op("replace", "/cues_left", "mine")])
+
+    assert conflict.value.current_version == 3
+    db.expire_all()
+    assert db.query(models.CornellNote).one().cues_left == "theirs"
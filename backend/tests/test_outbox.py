@@ -0,0 +1,80 @@
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from app import database, messaging, models
+from app.outbox import OutboxRelay, OUTBOX_RETRY_DELAY
+
+
+class FakePublisher:
+    # Confirms every publish at once, or fails the queues listed in fail
+    def __init__(self, fail=(), on_publish=None):
+        self.fail = set(fail)
+        self.on_publish = on_publish
+        self.published = []
+
+    def publish_async(self, queue, payload, priority=None, headers=None):
+        if self.on_publish is not None:
+            hook, self.on_publish = self.on_publish, None
+            hook()
+        self.published.append((queue, payload, priority))
+        future = Future()
+        if queue in self.fail:
+            future.set_exception(messaging.PublishError("Broker nacked the publish"))
+        else:
+            future.set_result(None)
+        return future
+
+
+def make_relay(publisher, batch_size: int = 100):
+    return OutboxRelay(database.SessionLocal, publisher, batch_size=batch_size, poll_interval=0)
+
+def add_messages(db, count: int, queue: str = messaging.EXTRACTION_QUEUE):
+    for n in range(count):
+        db.add(models.OutboxMessage(queue=queue, payload={"doc_id": n}))
+    db.commit()
+
+
+def test_concurrent_relays_publish_each_row_once(db):
+    add_messages(db, 4)
+    second = make_relay(FakePublisher(), batch_size=4)
+    # The second relay polls while the first still holds its batch's row locks
+    first = make_relay(FakePublisher(on_publish=second.relay_batch), batch_size=2)
+
+    assert first.relay_batch() == 2
+
+    published = first.publisher.published + second.publisher.published
+    assert len(second.publisher.published) == 2
+    assert sorted(payload["doc_id"] for _, payload, _ in published) == [0, 1, 2, 3]
+    assert db.query(models.OutboxMessage).count() == 0
+
+def test_failed_publish_keeps_the_row_and_backs_off(db):
+    add_messages(db, 1, queue="broken")
+    add_messages(db, 1)
+    relay = make_relay(FakePublisher(fail={"broken"}))
+
+    before = datetime.utcnow()
+    assert relay.relay_batch() == 2
+
+    db.expire_all()
+    (row,) = db.query(models.OutboxMessage).all()
+    assert row.queue == "broken"
+    assert row.attempts == 1
+    assert row.last_error == "Broker nacked the publish"
+    assert row.available_at >= before + timedelta(seconds=OUTBOX_RETRY_DELAY)
+    # Not due yet, so the next poll leaves it alone
+    assert relay.relay_batch() == 0
+
+def test_worker_enqueued_plan_job_is_relayed_with_its_priority(db):
+    # What the worker's enqueue_plan_job writes when a document reaches planning
+    db.add(models.OutboxMessage(
+        queue=messaging.READING_PLAN_QUEUE, payload={"user_id": 1, "document_id": 7}, priority=messaging.PLAN_MAX_PRIORITY,
+    ))
+    db.commit()
+    publisher = FakePublisher()
+
+    assert make_relay(publisher).relay_batch() == 1
+    assert publisher.published == [(messaging.READING_PLAN_QUEUE, {"user_id": 1, "document_id": 7}, messaging.PLAN_MAX_PRIORITY)]
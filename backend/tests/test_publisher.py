@@ -0,0 +1,95 @@
+import time
+from concurrent.futures import Future
+
+import pytest
+
+pika = pytest.importorskip("pika")
+
+from app import messaging
+
+
+class FakeChannel:
+    def __init__(self, number: int):
+        self.channel_number = number
+        self.declared = []
+        self.published = []
+
+    def queue_declare(self, queue, durable, arguments=None):
+        self.declared.append((queue, arguments))
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        self.published.append((routing_key, body, properties))
+
+
+def make_publisher(channels: int = 1):
+    publisher = messaging.Publisher(pika.ConnectionParameters("localhost"), channel_count=channels)
+    fakes = [FakeChannel(number) for number in range(1, channels + 1)]
+    for channel in fakes:
+        publisher._on_confirm_selected(channel)
+    return publisher, fakes
+
+def request(queue: str = messaging.EXTRACTION_QUEUE):
+    return (queue, "{}", pika.BasicProperties(delivery_mode=2), Future(), time.monotonic())
+
+def confirm(publisher, number: int, tag: int, multiple: bool = False, ack: bool = True):
+    method = (pika.spec.Basic.Ack if ack else pika.spec.Basic.Nack)(delivery_tag=tag, multiple=multiple)
+    publisher._on_confirm(number, pika.frame.Method(number, method))
+
+
+def test_batched_ack_resolves_every_publish_up_to_its_tag():
+    publisher, _ = make_publisher()
+    requests = [request() for _ in range(3)]
+    for r in requests:
+        publisher._publish(r)
+
+    confirm(publisher, 1, 2, multiple=True)
+
+    assert [r[3].done() for r in requests] == [True, True, False]
+    assert requests[0][3].result() is None
+    assert publisher.metrics.snapshot()["confirmed"] == 2
+
+def test_nack_fails_only_that_publish():
+    publisher, _ = make_publisher()
+    first, second = request(), request()
+    publisher._publish(first)
+    publisher._publish(second)
+
+    confirm(publisher, 1, 1, ack=False)
+    confirm(publisher, 1, 2)
+
+    with pytest.raises(messaging.PublishError):
+        first[3].result(timeout=0)
+    assert second[3].result(timeout=0) is None
+
+def test_closed_channel_fails_its_unconfirmed_publishes():
+    publisher, (channel,) = make_publisher()
+    pending = request()
+    publisher._publish(pending)
+
+    publisher._on_channel_closed(channel, "connection reset")
+
+    with pytest.raises(messaging.PublishError, match="Channel closed"):
+        pending[3].result(timeout=0)
+
+def test_publishes_wait_for_a_channel_then_go_out_in_order():
+    publisher = messaging.Publisher(pika.ConnectionParameters("localhost"), channel_count=1)
+    requests = [request() for _ in range(2)]
+    for r in requests:
+        publisher._publish(r)
+    assert not any(r[3].done() for r in requests)
+
+    channel = FakeChannel(1)
+    publisher._on_confirm_selected(channel)
+
+    assert len(channel.published) == 2
+    confirm(publisher, 1, 2, multiple=True)
+    assert all(r[3].result(timeout=0) is None for r in requests)
+
+def test_priority_queue_is_declared_with_its_arguments_once_per_channel():
+    publisher, (channel,) = make_publisher()
+    publisher._publish(request(messaging.READING_PLAN_QUEUE))
+    publisher._publish(request(messaging.READING_PLAN_QUEUE))
+
+    assert channel.declared == [
+        (messaging.READING_PLAN_QUEUE, {"x-max-priority": messaging.PLAN_MAX_PRIORITY}),
+    ]
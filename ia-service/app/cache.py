@@ -0,0 +1,191 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Two-tier cache for LLM results: an in-process LRU with TTL in front of a
+# SQLite file that survives restarts and is shared by the workers of one
+# container. Entries are keyed on the normalized request fields and carry
+# the prompt version they were generated with; a new version (the prompt or
+# model changed) makes old entries unreachable and purge_stale drops them.
+
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "/data/llm-cache/cache.sqlite3")  # empty disables the disk tier
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(30 * 24 * 3600)))  # seconds
+LLM_CACHE_MEMORY_ITEMS = int(os.getenv("LLM_CACHE_MEMORY_ITEMS", "10000"))
+CHARS_PER_TOKEN = 4
+
+
+def prompt_version(*parts) -> str:
+    # Derived from the prompt text and model, so editing a prompt invalidates its entries by itself
+    return hashlib.sha256("\x00".join(str(p) for p in parts).encode()).hexdigest()[:12]
+
+
+class CacheStats:
+    def __init__(self):
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.saved_tokens = 0
+
+    def snapshot(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else None,
+            "saved_tokens": self.saved_tokens,
+        }
+
+
+class CacheView:
+    # One kind of result (e.g. plan, explain); estimates the tokens a hit saves
+    def __init__(self, cache: "LLMCache", kind: str, prompt_chars: int):
+        self.cache = cache
+        self.kind = kind
+        self.prompt_chars = prompt_chars
+
+    async def get(self, fields: dict):
+        return await self.cache.get(self.kind, fields)
+
+    async def put(self, fields: dict, value):
+        tokens = (self.prompt_chars + len(json.dumps(fields, default=str)) + len(json.dumps(value))) // CHARS_PER_TOKEN
+        await self.cache.put(self.kind, fields, value, tokens)
+
+
+class LLMCache:
+    def __init__(self, path: str, ttl: int, memory_items: int):
+        self.path = path
+        self.ttl = ttl
+        self.memory_items = memory_items
+        self.versions = {}  # kind -> current prompt version
+        self.stats = {}  # kind -> CacheStats
+        self._memory = OrderedDict()  # (kind, key) -> (expires_at, value, tokens)
+        self._lock = threading.Lock()
+        self._db = None
+
+    def register(self, kind: str, *prompt_parts) -> "CacheView":
+        self.versions[kind] = prompt_version(*prompt_parts)
+        self.stats.setdefault(kind, CacheStats())
+        return CacheView(self, kind, sum(len(str(p)) for p in prompt_parts))
+
+    def key(self, kind: str, fields: dict) -> str:
+        raw = json.dumps({"version": self.versions[kind], **fields}, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    async def get(self, kind: str, fields: dict):
+        key = self.key(kind, fields)
+        stats = self.stats[kind]
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get((kind, key))
+            if entry is not None and entry[0] > now:
+                self._memory.move_to_end((kind, key))
+                stats.memory_hits += 1
+                stats.saved_tokens += entry[2]
+                return entry[1]
+
+        row = await asyncio.to_thread(self._disk_get, kind, key, now) if self.path else None
+        if row is None:
+            stats.misses += 1
+            return None
+        expires_at, value, tokens = row
+        self._remember(kind, key, expires_at, value, tokens)
+        stats.disk_hits += 1
+        stats.saved_tokens += tokens
+        return value
+
+    async def put(self, kind: str, fields: dict, value, tokens: int):
+        key = self.key(kind, fields)
+        expires_at = time.time() + self.ttl
+        self._remember(kind, key, expires_at, value, tokens)
+        self.stats[kind].stores += 1
+        if self.path:
+            await asyncio.to_thread(self._disk_put, kind, key, expires_at, value, tokens)
+
+    def invalidate(self, kind: str = None) -> int:
+        # Explicit flush of one kind, or everything
+        with self._lock:
+            for entry in [k for k in self._memory if kind is None or k[0] == kind]:
+                del self._memory[entry]
+        if not self.path:
+            return 0
+        with self._lock:
+            db = self._connect()
+            if kind is None:
+                deleted = db.execute("DELETE FROM llm_cache").rowcount
+            else:
+                deleted = db.execute("DELETE FROM llm_cache WHERE kind = ?", (kind,)).rowcount
+            db.commit()
+        return deleted
+
+    def purge_stale(self) -> int:
+        # Entries from other prompt versions, or past their TTL
+        if not self.path:
+            return 0
+        with self._lock:
+            db = self._connect()
+            deleted = db.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+            for kind, version in self.versions.items():
+                deleted += db.execute(
+                    "DELETE FROM llm_cache WHERE kind = ? AND version != ?", (kind, version)
+                ).rowcount
+            db.commit()
+        return deleted
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            memory_items = len(self._memory)
+        return {
+            "memory_items": memory_items,
+            "versions": dict(self.versions),
+            "kinds": {kind: stats.snapshot() for kind, stats in self.stats.items()},
+        }
+
+    # --- Tiers ---
+
+    def _remember(self, kind, key, expires_at, value, tokens):
+        with self._lock:
+            self._memory[(kind, key)] = (expires_at, value, tokens)
+            self._memory.move_to_end((kind, key))
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def _connect(self):
+        # Caller holds self._lock
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "kind TEXT NOT NULL, key TEXT NOT NULL, version TEXT NOT NULL, value TEXT NOT NULL, "
+                "tokens INTEGER NOT NULL, expires_at REAL NOT NULL, PRIMARY KEY (kind, key))"
+            )
+        return self._db
+
+    def _disk_get(self, kind, key, now):
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT expires_at, value, tokens FROM llm_cache WHERE kind = ? AND key = ? AND expires_at > ?",
+                (kind, key, now),
+            ).fetchone()
+        return None if row is None else (row[0], json.loads(row[1]), row[2])
+
+    def _disk_put(self, kind, key, expires_at, value, tokens):
+        with self._lock:
+            db = self._connect()
+            db.execute(
+                "INSERT OR REPLACE INTO llm_cache (kind, key, version, value, tokens, expires_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, key, self.versions[kind], json.dumps(value), tokens, expires_at),
+            )
+            db.commit()
+
+
+llm_cache = LLMCache(LLM_CACHE_PATH, LLM_CACHE_TTL, LLM_CACHE_MEMORY_ITEMS)
@@ -0,0 +1,64 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+# Process-wide cap on LLM completions in flight, shared by every endpoint (a
+# long plan's chunks and single word lookups draw from the same slots). Each
+# completion gets LLM_TIMEOUT seconds once it holds a slot; since every holder
+# lets go within that time, waiting for a slot is bounded as well.
+
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "32"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))  # seconds per completion
+
+
+class LLMGate:
+    def __init__(self, limit: int, timeout: float):
+        self.limit = limit
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(limit)
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+        self.timeouts = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            async with asyncio.timeout(self.timeout):
+                yield
+            self.completed += 1
+        except TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+    async def invoke(self, chain, inputs: dict):
+        async with self.slot():
+            return await chain.ainvoke(inputs)
+
+    async def stream(self, chain, inputs: dict):
+        # The slot is held for the whole stream, and the timeout covers it
+        async with self.slot():
+            async for item in chain.astream(inputs):
+                yield item
+
+    def snapshot(self) -> dict:
+        return {
+            "limit": self.limit,
+            "timeout_s": self.timeout,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "timeouts": self.timeouts,
+        }
+
+
+llm_gate = LLMGate(LLM_CONCURRENCY, LLM_TIMEOUT)
@@ -1,25 +1,43 @@
 from fastapi import FastAPI, HTTPException
-from . import schemas
+from fastapi.responses import StreamingResponse
+from . import schemas, planning
+from .cache import llm_cache, CHARS_PER_TOKEN
+from .gate import llm_gate
 import os
+import json
+import asyncio
+import openai
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import PromptTemplate
 
 from langchain_core.output_parsers import JsonOutputParser
-from typing import List
 
 app = FastAPI(title="Socrates AI Service")
 
 # Initialize LLM
 # Handle missing key gracefully for testing
+LLM_MODEL = "gpt-4o"
 llm = None
 try:
     if os.getenv("OPENAI_API_KEY") and not os.getenv("OPENAI_API_KEY").startswith("your-key"):
-        llm = ChatOpenAI(temperature=0.7, model_name="gpt-4o")
+        llm = ChatOpenAI(temperature=0.7, model_name=LLM_MODEL)
     else:
         print("WARNING: OPENAI_API_KEY not set or invalid. Running in MOCK MODE.")
 except Exception as e:
     print(f"Failed to initialize LLM: {e}")
 
+def timed_out() -> HTTPException:
+    # The completion ran past LLM_TIMEOUT; a gateway timeout, so callers retry it like a 5xx
+    return HTTPException(status_code=504, detail="LLM call timed out")
+
+def rate_limited(e: openai.RateLimitError) -> HTTPException:
+    # Pass the provider's 429 on, so callers back off instead of treating it as a failure
+    headers = {}
+    retry_after = e.response.headers.get("retry-after") if e.response is not None else None
+    if retry_after:
+        headers["Retry-After"] = retry_after
+    return HTTPException(status_code=429, detail="LLM rate limit reached", headers=headers)
+
 # --- Prompts ---
 
 PLAN_READING_PROMPT = """
@@ -32,7 +50,7 @@ Profession: {profession}
 Nationality: {nationality}
 Target Language: Portuguese (assuming the text is in Portuguese/English, adapt to the text language).
 
-Analyze the following text and divide it into 3 to 7 logical reading stages using the Cornell Method.
+{scope} using the Cornell Method.
 For each stage, provide:
 1. title: A short title.
 2. objective: A learning objective adapted to the student's level.
@@ -55,184 +73,338 @@ Provide a definition, an example sentence, and synonyms.
 Return JSON: {{ "definition": "...", "example": "...", "synonyms": ["...", "..."] }}
 """
 
+EXPLAIN_WORDS_PROMPT = """
+Explain each of the following words for a student with the following profile:
+Native Language: {nativa}
+Education: {education}
+
+The words, each with an id and the passage it was found in (JSON):
+{words}
+
+For every word, provide a definition, an example sentence, and synonyms.
+Return JSON: {{ "explanations": [{{ "id": 1, "definition": "...", "example": "...", "synonyms": ["...", "..."] }}] }}
+with exactly one entry per id.
+"""
+
+# Packing for /ia/explain-words: estimated prompt + answer tokens per completion
+EXPLAIN_BATCH_TOKENS = int(os.getenv("EXPLAIN_BATCH_TOKENS", "4000"))
+EXPLAIN_ANSWER_TOKENS = 120  # rough size of one explanation in the answer
+EXPLAIN_CONTEXT_CHARS = 400  # passage sent per word
+
+# Stage counts: a whole text, or one part of a text planned in chunks
+WHOLE_TEXT_SCOPE = "Analyze the following text and divide it into 3 to 7 logical reading stages"
+PART_SCOPE = (
+    "The following is part {part} of {parts} of a longer text; other parts are planned separately. "
+    "Analyze this part only and divide it into 1 to 4 logical reading stages"
+)
+
 parser_plan = JsonOutputParser(pydantic_object=schemas.PlanReadingResponse)
 parser_explain = JsonOutputParser(pydantic_object=schemas.ExplainWordResponse)
+parser_explain_batch = JsonOutputParser(pydantic_object=schemas.PackedExplanations)
+
+PLAN_TEMPLATE = PromptTemplate(
+    template=PLAN_READING_PROMPT + "\n{format_instructions}",
+    input_variables=["name", "age", "education", "profession", "nationality", "nativa", "scope", "text"],
+    partial_variables={"format_instructions": parser_plan.get_format_instructions()}
+)
+EXPLAIN_TEMPLATE = PromptTemplate(
+    template=EXPLAIN_WORD_PROMPT + "\n{format_instructions}",
+    input_variables=["word", "nativa", "education", "context"],
+    partial_variables={"format_instructions": parser_explain.get_format_instructions()}
+)
+EXPLAIN_BATCH_TEMPLATE = PromptTemplate(
+    template=EXPLAIN_WORDS_PROMPT + "\n{format_instructions}",
+    input_variables=["words", "nativa", "education"],
+    partial_variables={"format_instructions": parser_explain_batch.get_format_instructions()}
+)
+
+# Compiled once per model rather than per request
+plan_chain = explain_chain = explain_batch_chain = None
+
+def use_llm(model):
+    # None means mock mode; bench_llm.py swaps in a stub model here
+    global llm, plan_chain, explain_chain, explain_batch_chain
+    llm = model
+    plan_chain = PLAN_TEMPLATE | model | parser_plan if model else None
+    explain_chain = EXPLAIN_TEMPLATE | model | parser_explain if model else None
+    explain_batch_chain = EXPLAIN_BATCH_TEMPLATE | model | parser_explain_batch if model else None
+
+use_llm(llm)
+
+# Cached results are versioned by prompt, output format and model
+plan_cache = llm_cache.register("plan", PLAN_READING_PROMPT, parser_plan.get_format_instructions(), LLM_MODEL)
+# (single and packed explanations share entries, so both prompts version them)
+explain_cache = llm_cache.register(
+    "explain", EXPLAIN_WORD_PROMPT, EXPLAIN_WORDS_PROMPT, parser_explain.get_format_instructions(), LLM_MODEL
+)
+
+@app.on_event("startup")
+def purge_llm_cache():
+    # Entries written under an older prompt version can never be hit again
+    purged = llm_cache.purge_stale()
+    if purged:
+        print(f"Purged {purged} stale LLM cache entries")
+
+@app.get("/ia/metrics")
+def get_metrics():
+    return {"cache": llm_cache.snapshot(), "llm": llm_gate.snapshot()}
+
+@app.post("/ia/cache/invalidate")
+def invalidate_cache(request: schemas.CacheInvalidateRequest):
+    # For changes the prompt version can't see, e.g. a model update behind the same name
+    return {"deleted": llm_cache.invalidate(request.kind)}
+
+def mock_plan(raw_text: str) -> dict:
+    # Split text into chunks for mock stages
+    text_len = len(raw_text)
+    chunk_size = text_len // 3 if text_len > 100 else text_len
+    
+    stages = []
+    for i in range(3):
+        start = i * chunk_size
+        end = (i + 1) * chunk_size if i < 2 else text_len
+        stage_text = raw_text[start:end]
+        
+        stages.append({
+            "stage_index": i + 1,
+            "title": f"Stage {i+1} (Mock)",
+            "objective": "Understand the main concepts of this section (Mock Objective)",
+            "stage_text": stage_text,
+            "suggested_vocab": [
+                {"word": "Example", "definition": "A representative form or pattern."},
+                {"word": "Mock", "definition": "Not authentic or real, but without the intention to deceive."}
+            ]
+        })
+    return {"stages": stages}
+
+async def mock_stages(raw_text: str):
+    for stage in mock_plan(raw_text)["stages"]:
+        yield stage
+
+def check_plan_text(request: schemas.PlanReadingRequest):
+    if not request.raw_text.strip():
+         # Return empty or error? Let's return error or mock if text is too short
+         if len(request.raw_text) < 10:
+             raise HTTPException(status_code=400, detail="Text too short")
+
+def plan_inputs(request: schemas.PlanReadingRequest):
+    # One chain input per chunk of the text
+    chunks = planning.split_text(request.raw_text)
+    profile = {
+        "name": request.profile.nome,
+        "age": request.profile.idade,
+        "education": request.profile.grau_de_instrucao,
+        "profession": request.profile.profissao,
+        "nationality": request.profile.nacionalidade,
+        "nativa": request.profile.lingua_nativa,
+    }
+    inputs = [
+        {
+            **profile,
+            "scope": WHOLE_TEXT_SCOPE if len(chunks) == 1 else PART_SCOPE.format(part=i + 1, parts=len(chunks)),
+            "text": chunk,
+        }
+        for i, chunk in enumerate(chunks)
+    ]
+    return chunks, inputs
 
 @app.post("/ia/plan-reading", response_model=schemas.PlanReadingResponse)
 async def plan_reading(request: schemas.PlanReadingRequest):
     # Mock Mode Check
     if not llm:
         print("Using MOCK response for plan_reading")
-        # Split text into chunks for mock stages
-        text_len = len(request.raw_text)
-        chunk_size = text_len // 3 if text_len > 100 else text_len
-        
-        stages = []
-        for i in range(3):
-            start = i * chunk_size
-            end = (i + 1) * chunk_size if i < 2 else text_len
-            stage_text = request.raw_text[start:end]
-            
-            stages.append({
-                "stage_index": i + 1,
-                "title": f"Stage {i+1} (Mock)",
-                "objective": "Understand the main concepts of this section (Mock Objective)",
-                "stage_text": stage_text,
-                "suggested_vocab": [
-                    {"word": "Example", "definition": "A representative form or pattern."},
-                    {"word": "Mock", "definition": "Not authentic or real, but without the intention to deceive."}
-                ]
-            })
-        return {"stages": stages}
+        return mock_plan(request.raw_text)
 
     try:
-        if not request.raw_text.strip():
-             # Return empty or error? Let's return error or mock if text is too short
-             if len(request.raw_text) < 10:
-                 raise HTTPException(status_code=400, detail="Text too short")
-
-        prompt = PromptTemplate(
-            template=PLAN_READING_PROMPT + "\n{format_instructions}",
-            input_variables=["name", "age", "education", "profession", "nationality", "nativa", "text"],
-            partial_variables={"format_instructions": parser_plan.get_format_instructions()}
-        )
-        
-        chain = prompt | llm | parser_plan
-        
-        result = chain.invoke({
-            "name": request.profile.nome,
-            "age": request.profile.idade,
-            "education": request.profile.grau_de_instrucao,
-            "profession": request.profile.profissao,
-            "nationality": request.profile.nacionalidade,
-            "nativa": request.profile.lingua_nativa,
-            "text": request.raw_text[:15000] # Limit context window just in case
-        })
+        check_plan_text(request)
+
+        # Map: every chunk is planned concurrently, so a book takes about as long as its slowest chunk
+        chunks, inputs = plan_inputs(request)
+        plans = await planning.plan_chunks(llm_gate, plan_chain, inputs, cache=plan_cache)
+
+        # Reduce: one ordered plan, repeated excerpts and vocabulary dropped
+        result = planning.merge_plans(plans)
+        print(f"Planned {len(request.raw_text)} chars in {len(chunks)} chunk(s): {len(result['stages'])} stages")
         
         return result
 
+    except HTTPException:
+        raise
+    except TimeoutError:
+        print(f"Timed out in plan_reading after {llm_gate.timeout}s")
+        raise timed_out()
+    except openai.RateLimitError as e:
+        print(f"Rate limited in plan_reading: {e}")
+        raise rate_limited(e)
     except Exception as e:
         print(f"Error in plan_reading: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def ndjson(item: dict) -> str:
+    return json.dumps(item) + "\n"
+
+async def plan_lines(request: schemas.PlanReadingRequest):
+    # {"stage": ...} per finished stage, then {"done": true}. The status line has
+    # long been sent, so a failure midway is reported in-band as {"error": ...}.
+    count = 0
+    try:
+        if not llm:
+            stages = mock_stages(request.raw_text)
+        else:
+            chunks, inputs = plan_inputs(request)
+            stages = planning.stream_plan(llm_gate, plan_chain, chunks, inputs, cache=plan_cache)
+        async for stage in stages:
+            count += 1
+            yield ndjson({"stage": stage})
+        yield ndjson({"done": True, "stage_count": count})
+    except TimeoutError:
+        print(f"Timed out in plan_reading_stream after {count} stage(s)")
+        yield ndjson({"error": "LLM call timed out", "status": 504})
+    except openai.RateLimitError as e:
+        print(f"Rate limited in plan_reading_stream after {count} stage(s): {e}")
+        retry_after = rate_limited(e).headers.get("Retry-After")
+        yield ndjson({"error": "LLM rate limit reached", "status": 429, "retry_after": retry_after})
+    except Exception as e:
+        print(f"Error in plan_reading_stream after {count} stage(s): {e}")
+        yield ndjson({"error": str(e), "status": 500})
+
+@app.post("/ia/plan-reading/stream")
+async def plan_reading_stream(request: schemas.PlanReadingRequest):
+    # Same plan as /ia/plan-reading, as NDJSON, one stage per line as soon as it is complete
+    check_plan_text(request)
+    return StreamingResponse(plan_lines(request), media_type="application/x-ndjson")
+
+def mock_explanation(word: str) -> dict:
+    return {
+        "definition": f"Mock definition for {word}",
+        "example": f"This is a mock example for {word}.",
+        "synonyms": ["mock1", "mock2"]
+    }
+
+def explain_key(word: str, profile: schemas.Profile) -> dict:
+    # The explanation depends on the word and who is reading, not on the sentence it came from
+    return {
+        "word": planning.normalize(word),
+        "nativa": profile.lingua_nativa,
+        "education": profile.grau_de_instrucao,
+    }
+
 @app.post("/ia/explain-word", response_model=schemas.ExplainWordResponse)
 async def explain_word(request: schemas.ExplainWordRequest):
     if not llm:
-        return {
-            "definition": f"Mock definition for {request.word}",
-            "example": f"This is a mock example for {request.word}.",
-            "synonyms": ["mock1", "mock2"]
-        }
+        return mock_explanation(request.word)
 
     try:
-        prompt = PromptTemplate(
-            template=EXPLAIN_WORD_PROMPT + "\n{format_instructions}",
-            input_variables=["word", "nativa", "education", "context"],
-            partial_variables={"format_instructions": parser_explain.get_format_instructions()}
-        )
-        
-        chain = prompt | llm | parser_explain
-        
-        result = chain.invoke({
+        key = explain_key(request.word, request.profile)
+        cached = await explain_cache.get(key)
+        if cached is not None:
+            return cached
+
+        result = await llm_gate.invoke(explain_chain, {
             "word": request.word,
             "nativa": request.profile.lingua_nativa,
             "education": request.profile.grau_de_instrucao,
             "context": request.context
         })
-        
+        await explain_cache.put(key, result)
+
         return result
 
+    except TimeoutError:
+        raise timed_out()
+    except openai.RateLimitError as e:
+        raise rate_limited(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-# --- Prompts ---
-
-PLAN_READING_PROMPT = """
-You are an expert teacher helping a student understand a text.
-The student profile is:
-Name: {name}
-Age: {age}
-Education: {education}
-Profession: {profession}
-Nationality: {nationality}
-Target Language: Portuguese (assuming the text is in Portuguese/English, adapt to the text language).
 
-Analyze the following text and divide it into 3 to 7 logical reading stages using the Cornell Method.
-For each stage, provide:
-1. title: A short title.
-2. objective: A learning objective adapted to the student's level.
-3. stage_text: The exact excerpt of the text for this stage.
-4. suggested_vocab: 5 to 15 key words with definitions in the student's native language ({nativa}).
+def pack_words(items: list, budget: int = EXPLAIN_BATCH_TOKENS) -> list:
+    # Greedy, in request order: a pack closes when the next word would take it past the budget
+    room = max(budget - len(EXPLAIN_WORDS_PROMPT) // CHARS_PER_TOKEN, EXPLAIN_ANSWER_TOKENS)
+    packs, pack, used = [], [], 0
+    for item in items:
+        cost = (len(item.word) + len(item.context[:EXPLAIN_CONTEXT_CHARS])) // CHARS_PER_TOKEN + EXPLAIN_ANSWER_TOKENS
+        if pack and used + cost > room:
+            packs.append(pack)
+            pack, used = [], 0
+        pack.append(item)
+        used += cost
+    if pack:
+        packs.append(pack)
+    return packs
 
-Return the result as a JSON object with the key "stages" which is a list.
+async def explain_pack(pack: list, profile: schemas.Profile) -> list:
+    # One completion for the whole pack; a word the model skipped gets a call of its own
+    listing = [
+        {"id": n, "word": item.word, "context": item.context[:EXPLAIN_CONTEXT_CHARS]}
+        for n, item in enumerate(pack, 1)
+    ]
+    answer = await llm_gate.invoke(explain_batch_chain, {
+        "words": json.dumps(listing, ensure_ascii=False),
+        "nativa": profile.lingua_nativa,
+        "education": profile.grau_de_instrucao,
+    })
+    by_id = {str(e.get("id")): e for e in answer.get("explanations") or [] if isinstance(e, dict)}
 
-Text:
-{text}
-"""
-
-EXPLAIN_WORD_PROMPT = """
-Explain the word '{word}' for a student with the following profile:
-Native Language: {nativa}
-Education: {education}
-Context: {context}
-
-Provide a definition, an example sentence, and synonyms.
-Return JSON: {{ "definition": "...", "example": "...", "synonyms": ["...", "..."] }}
-"""
+    results = []
+    for n, item in enumerate(pack, 1):
+        entry = by_id.get(str(n))
+        if entry and entry.get("definition"):
+            result = {
+                "definition": entry["definition"],
+                "example": entry.get("example") or "",
+                "synonyms": entry.get("synonyms") or [],
+            }
+        else:
+            print(f"explain-words: no answer for '{item.word}' in a pack of {len(pack)}, asking alone")
+            result = await llm_gate.invoke(explain_chain, {
+                "word": item.word,
+                "nativa": profile.lingua_nativa,
+                "education": profile.grau_de_instrucao,
+                "context": item.context,
+            })
+        await explain_cache.put(explain_key(item.word, profile), result)
+        results.append(result)
+    return results
 
-parser_plan = JsonOutputParser(pydantic_object=schemas.PlanReadingResponse)
-parser_explain = JsonOutputParser(pydantic_object=schemas.ExplainWordResponse)
+@app.post("/ia/explain-words", response_model=schemas.ExplainWordsResponse)
+async def explain_words(request: schemas.ExplainWordsRequest):
+    # Many words for one reader: each distinct word is explained once, cached ones
+    # without a call, the rest packed into as few completions as the budget allows
+    if not llm:
+        return {"explanations": [mock_explanation(item.word) for item in request.words]}
 
-@app.post("/ia/plan-reading", response_model=schemas.PlanReadingResponse)
-async def plan_reading(request: schemas.PlanReadingRequest):
     try:
-        if not request.raw_text.strip():
-             # Return empty or error? Let's return error or mock if text is too short
-             if len(request.raw_text) < 10:
-                 raise HTTPException(status_code=400, detail="Text too short")
-
-        prompt = PromptTemplate(
-            template=PLAN_READING_PROMPT + "\n{format_instructions}",
-            input_variables=["name", "age", "education", "profession", "nationality", "nativa", "text"],
-            partial_variables={"format_instructions": parser_plan.get_format_instructions()}
-        )
-        
-        chain = prompt | llm | parser_plan
-        
-        result = chain.invoke({
-            "name": request.profile.nome,
-            "age": request.profile.idade,
-            "education": request.profile.grau_de_instrucao,
-            "profession": request.profile.profissao,
-            "nationality": request.profile.nacionalidade,
-            "nativa": request.profile.lingua_nativa,
-            "text": request.raw_text[:15000] # Limit context window just in case
-        })
-        
-        return result
+        distinct = {}  # normalized word -> first request item asking for it
+        for item in request.words:
+            distinct.setdefault(planning.normalize(item.word), item)
 
-    except Exception as e:
-        print(f"Error in plan_reading: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        explained = {}
+        missing = []
+        for word, item in distinct.items():
+            cached = await explain_cache.get(explain_key(item.word, request.profile))
+            if cached is not None:
+                explained[word] = cached
+            else:
+                missing.append(item)
 
-@app.post("/ia/explain-word", response_model=schemas.ExplainWordResponse)
-async def explain_word(request: schemas.ExplainWordRequest):
-    try:
-        prompt = PromptTemplate(
-            template=EXPLAIN_WORD_PROMPT + "\n{format_instructions}",
-            input_variables=["word", "nativa", "education", "context"],
-            partial_variables={"format_instructions": parser_explain.get_format_instructions()}
-        )
-        
-        chain = prompt | llm | parser_explain
-        
-        result = chain.invoke({
-            "word": request.word,
-            "nativa": request.profile.lingua_nativa,
-            "education": request.profile.grau_de_instrucao,
-            "context": request.context
-        })
-        
-        return result
+        packs = pack_words(missing)
+        tasks = [asyncio.create_task(explain_pack(pack, request.profile)) for pack in packs]
+        try:
+            answers = await asyncio.gather(*tasks)
+        finally:
+            # A pack failed: stop paying for the rest
+            for task in tasks:
+                task.cancel()
+        for pack, results in zip(packs, answers):
+            for item, result in zip(pack, results):
+                explained[planning.normalize(item.word)] = result
+        print(f"Explained {len(request.words)} word(s): {len(distinct)} distinct, {len(missing)} in {len(packs)} completion(s)")
+
+        return {"explanations": [explained[planning.normalize(item.word)] for item in request.words]}
 
+    except TimeoutError:
+        raise timed_out()
+    except openai.RateLimitError as e:
+        raise rate_limited(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,154 @@
+import asyncio
+import os
+import re
+
+# Long texts are planned map-reduce style: split into chunks on section,
+# paragraph or sentence boundaries, each chunk planned by its own LLM call
+# (run concurrently, through the service's LLMGate), and the partial plans
+# merged back in text order.
+# stream_plan does the same incrementally: a stage is yielded as soon as the
+# model has finished it, and chunk n+1's stages wait only for chunk n.
+
+PLAN_CHUNK_CHARS = int(os.getenv("PLAN_CHUNK_CHARS", "12000"))
+PLAN_FANOUT = int(os.getenv("PLAN_FANOUT", "16"))  # chunk calls in flight for one plan
+
+# Cut preferences, best first: blank line (section/paragraph), line break, sentence end, any space
+BOUNDARIES = [
+    re.compile(r"\n\s*\n"),
+    re.compile(r"\n"),
+    re.compile(r"(?<=[.!?])\s+"),
+    re.compile(r"\s+"),
+]
+
+
+def normalize(value) -> str:
+    return " ".join(str(value or "").split()).casefold()
+
+def cut_point(text: str, start: int, limit: int) -> int:
+    # Last boundary in the window, but not in its first half, so chunks stay even
+    window = text[start:limit]
+    for pattern in BOUNDARIES:
+        ends = [m.end() for m in pattern.finditer(window) if m.end() > len(window) // 2]
+        if ends:
+            return start + ends[-1]
+    return limit
+
+def split_text(text: str, max_chars: int = PLAN_CHUNK_CHARS) -> list:
+    # Chunks are contiguous slices, so stage_text excerpts stay exact
+    chunks = []
+    start = 0
+    while len(text) - start > max_chars:
+        end = cut_point(text, start, start + max_chars)
+        chunks.append(text[start:end])
+        start = end
+    chunks.append(text[start:])
+    return [chunk for chunk in chunks if chunk.strip()]
+
+class PlanMerger:
+    # Drops stages whose excerpt was already used; a word is only suggested the first time it appears
+    def __init__(self):
+        self.seen_texts = set()
+        self.seen_words = set()
+
+    def add(self, stage: dict):
+        key = normalize(stage.get("stage_text"))
+        if not key or key in self.seen_texts:
+            return None
+        self.seen_texts.add(key)
+        vocab = []
+        for item in stage.get("suggested_vocab") or []:
+            word = normalize(item.get("word") if isinstance(item, dict) else None)
+            if word and word not in self.seen_words:
+                self.seen_words.add(word)
+                vocab.append(item)
+        return {**stage, "suggested_vocab": vocab}
+
+async def plan_chunks(gate, chain, inputs: list, fanout: int = PLAN_FANOUT, cache=None) -> list:
+    # One plan per chunk input: cached ones looked up, the rest generated concurrently,
+    # at most fanout at a time and within the service-wide gate
+    plans = [await cache.get(i) for i in inputs] if cache is not None else [None] * len(inputs)
+    slots = asyncio.Semaphore(fanout)
+
+    async def generate(n: int):
+        async with slots:
+            plans[n] = await gate.invoke(chain, inputs[n])
+        if cache is not None:
+            await cache.put(inputs[n], plans[n])
+
+    tasks = [asyncio.create_task(generate(n)) for n, plan in enumerate(plans) if plan is None]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # A chunk failed: stop paying for the rest
+        for task in tasks:
+            task.cancel()
+    return plans
+
+def merge_plans(plans: list) -> dict:
+    # Same order as stream_plan: chunks in text order, stages in the order the model
+    # wrote them (the prompt asks for them in reading order). The stream can't sort
+    # a chunk's stages without waiting for all of them, so neither path does.
+    merger = PlanMerger()
+    stages = []
+    for plan in plans:
+        for stage in plan.get("stages") or []:
+            merged = merger.add(stage)
+            if merged is not None:
+                stages.append(merged)
+    return {"stages": stages}
+
+
+# --- Streaming ---
+
+_CHUNK_DONE = object()
+
+async def stream_chunk(gate, chain, inputs: dict):
+    # JsonOutputParser streams the growing document; every stage but the last one is complete
+    emitted = 0
+    stages = []
+    async for partial in gate.stream(chain, inputs):
+        stages = (partial.get("stages") if isinstance(partial, dict) else None) or []
+        while emitted < len(stages) - 1:
+            yield stages[emitted]
+            emitted += 1
+    for stage in stages[emitted:]:
+        yield stage
+
+async def _pump(gate, chain, inputs: dict, queue: asyncio.Queue, slots: asyncio.Semaphore, cache=None):
+    try:
+        cached = await cache.get(inputs) if cache is not None else None
+        if cached is not None:
+            for stage in cached.get("stages") or []:
+                queue.put_nowait(stage)
+        else:
+            stages = []
+            async with slots:
+                async for stage in stream_chunk(gate, chain, inputs):
+                    stages.append(stage)
+                    queue.put_nowait(stage)
+            if cache is not None:
+                # Only a chunk that finished; a failed stream never reaches here
+                await cache.put(inputs, {"stages": stages})
+        queue.put_nowait(_CHUNK_DONE)
+    except Exception as e:
+        queue.put_nowait(e)
+
+async def stream_plan(gate, chain, chunks: list, inputs: list, fanout: int = PLAN_FANOUT, cache=None):
+    # Yields merged stages in text order while up to fanout chunks generate at once;
+    # chunks found in cache (a CacheView) are replayed without a call
+    slots = asyncio.Semaphore(fanout)
+    queues = [asyncio.Queue() for _ in chunks]
+    tasks = [asyncio.create_task(_pump(gate, chain, i, q, slots, cache)) for i, q in zip(inputs, queues)]
+    merger = PlanMerger()
+    try:
+        for queue in queues:
+            while (item := await queue.get()) is not _CHUNK_DONE:
+                if isinstance(item, Exception):
+                    raise item
+                merged = merger.add(item)
+                if merged is not None:
+                    yield merged
+    finally:
+        # Client gone or a chunk failed: stop paying for the rest
+        for task in tasks:
+            task.cancel()
@@ -35,3 +35,23 @@ class ExplainWordResponse(BaseModel):
     definition: str
     example: str
     synonyms: List[str]
+
+class WordInContext(BaseModel):
+    word: str
+    context: str = ""
+
+class ExplainWordsRequest(BaseModel):
+    profile: Profile
+    words: List[WordInContext]
+
+class ExplainWordsResponse(BaseModel):
+    explanations: List[ExplainWordResponse]  # one per requested word, in request order
+
+class PackedExplanation(ExplainWordResponse):
+    id: int
+
+class PackedExplanations(BaseModel):
+    explanations: List[PackedExplanation]
+
+class CacheInvalidateRequest(BaseModel):
+    kind: Optional[str] = None  # plan, explain, or everything when omitted
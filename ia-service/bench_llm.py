@@ -0,0 +1,70 @@
+import asyncio
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault("LLM_CACHE_PATH", "")  # memory tier only; every word below is a miss anyway
+os.environ["OPENAI_API_KEY"] = ""  # never reach the real provider
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from app import main, schemas
+from app.gate import LLMGate, LLM_TIMEOUT
+
+# Load test of the AI service's request path against a stub LLM that answers
+# after a fixed delay, e.g.
+#   python bench_llm.py                      # 64 explain-word requests, 0.5s per completion
+#   python bench_llm.py 256 0.2 1 8 32 128   # requests, delay, then the gate sizes to try
+# Throughput should grow with the gate size until it passes the request count.
+
+EXPLANATION = json.dumps({"definition": "stub", "example": "stub", "synonyms": ["stub"]})
+
+
+class StubLLM(BaseChatModel):
+    delay: float = 0.5
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.delay)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=EXPLANATION))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.delay)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=EXPLANATION))])
+
+
+PROFILE = schemas.Profile(
+    nome="Bench", idade=30, grau_de_instrucao="Superior", profissao="Tester",
+    nacionalidade="Brasileira", lingua_nativa="Português",
+)
+
+async def bench_gate(size: int, requests: int, run: int):
+    main.llm_gate = LLMGate(size, LLM_TIMEOUT)
+    # Unique words, so the cache never answers for the model
+    calls = [
+        main.explain_word(schemas.ExplainWordRequest(profile=PROFILE, word=f"word-{run}-{n}", context="bench"))
+        for n in range(requests)
+    ]
+    started = time.monotonic()
+    await asyncio.gather(*calls)
+    elapsed = time.monotonic() - started
+
+    print(f"gate={size:<5} requests={requests:<6} seconds={elapsed:<8.2f} requests/sec={requests / max(elapsed, 1e-6):.2f}")
+
+async def bench(requests: int, delay: float, sizes: list):
+    main.use_llm(StubLLM(delay=delay))
+    for run, size in enumerate(sizes):
+        await bench_gate(size, requests, run)
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    requests = int(args[0]) if len(args) > 0 else 64
+    delay = float(args[1]) if len(args) > 1 else 0.5
+    sizes = [int(a) for a in args[2:]] or [1, 4, 16, 64]
+    asyncio.run(bench(requests, delay, sizes))
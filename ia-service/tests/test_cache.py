@@ -0,0 +1,90 @@
+import asyncio
+import time
+
+from app.cache import LLMCache
+
+PLAN = {"chunk": "Era uma vez", "lingua_nativa": "Português"}
+STAGES = [{"title": "Stage 1"}]
+
+
+def make_cache(tmp_path, ttl: int = 60, memory_items: int = 100, prompt: str = "plan prompt v1"):
+    cache = LLMCache(str(tmp_path / "cache.sqlite3"), ttl, memory_items)
+    return cache, cache.register("plan", prompt, "gpt-4o-mini")
+
+def get(view, fields=PLAN):
+    return asyncio.run(view.get(fields))
+
+def put(view, value=STAGES, fields=PLAN):
+    asyncio.run(view.put(fields, value))
+
+
+def test_miss_then_memory_hit(tmp_path):
+    cache, plans = make_cache(tmp_path)
+    assert get(plans) is None
+    put(plans)
+    assert get(plans) == STAGES
+
+    stats = cache.snapshot()["kinds"]["plan"]
+    assert (stats["misses"], stats["memory_hits"], stats["stores"]) == (1, 1, 1)
+    assert stats["hit_rate"] == 0.5
+    assert stats["saved_tokens"] > 0
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    _, plans = make_cache(tmp_path)
+    put(plans)
+
+    restarted, plans = make_cache(tmp_path)
+    assert get(plans) == STAGES
+    assert restarted.stats["plan"].disk_hits == 1
+    # Promoted to memory on the way out
+    assert get(plans) == STAGES
+    assert restarted.stats["plan"].memory_hits == 1
+
+def test_keys_follow_every_field(tmp_path):
+    _, plans = make_cache(tmp_path)
+    put(plans)
+    assert get(plans, {**PLAN, "lingua_nativa": "Inglês"}) is None
+
+def test_entries_expire(tmp_path, monkeypatch):
+    cache, plans = make_cache(tmp_path, ttl=60)
+    put(plans)
+    later = time.time() + 61
+    monkeypatch.setattr(time, "time", lambda: later)
+
+    assert get(plans) is None
+    assert cache.purge_stale() == 1
+
+def test_prompt_change_retires_old_entries(tmp_path):
+    _, plans = make_cache(tmp_path)
+    put(plans)
+
+    edited, plans = make_cache(tmp_path, prompt="plan prompt v2")
+    assert get(plans) is None
+    assert edited.purge_stale() == 1
+
+def test_memory_tier_is_bounded(tmp_path):
+    cache, plans = make_cache(tmp_path, memory_items=2)
+    for n in range(3):
+        put(plans, fields={**PLAN, "chunk": str(n)})
+    assert cache.snapshot()["memory_items"] == 2
+    # The evicted entry is still on disk
+    assert get(plans, {**PLAN, "chunk": "0"}) == STAGES
+    assert cache.stats["plan"].disk_hits == 1
+
+def test_invalidate_one_kind(tmp_path):
+    cache, plans = make_cache(tmp_path)
+    explains = cache.register("explain", "explain prompt", "gpt-4o-mini")
+    put(plans)
+    put(explains, {"definition": "x"}, {"word": "casa"})
+
+    assert cache.invalidate("plan") == 1
+    assert get(plans) is None
+    assert get(explains, {"word": "casa"}) == {"definition": "x"}
+    assert cache.invalidate() == 1
+
+def test_memory_only_without_a_path():
+    cache = LLMCache("", 60, 100)
+    plans = cache.register("plan", "plan prompt")
+    put(plans)
+    assert get(plans) == STAGES
+    assert cache.purge_stale() == 0
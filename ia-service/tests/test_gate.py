@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from app.gate import LLMGate
+
+
+class SlowChain:
+    # Stands in for a compiled prompt | model | parser chain
+    def __init__(self, gate: LLMGate, delay: float):
+        self.gate = gate
+        self.delay = delay
+        self.peak = 0
+
+    async def ainvoke(self, inputs: dict):
+        self.peak = max(self.peak, self.gate.in_flight)
+        await asyncio.sleep(self.delay)
+        return {"echo": inputs}
+
+    async def astream(self, inputs: dict):
+        for n in range(3):
+            await asyncio.sleep(self.delay)
+            yield {"part": n}
+
+
+def test_never_more_calls_in_flight_than_slots():
+    gate = LLMGate(2, timeout=5)
+    chain = SlowChain(gate, 0.01)
+
+    async def burst():
+        return await asyncio.gather(*(gate.invoke(chain, {"n": n}) for n in range(6)))
+
+    assert asyncio.run(burst()) == [{"echo": {"n": n}} for n in range(6)]
+    assert chain.peak == 2
+    snapshot = gate.snapshot()
+    assert (snapshot["in_flight"], snapshot["waiting"], snapshot["completed"], snapshot["timeouts"]) == (0, 0, 6, 0)
+
+def test_timeout_frees_the_slot():
+    gate = LLMGate(1, timeout=0.02)
+
+    with pytest.raises(TimeoutError):
+        asyncio.run(gate.invoke(SlowChain(gate, 1), {}))
+    assert (gate.timeouts, gate.in_flight) == (1, 0)
+
+    assert asyncio.run(gate.invoke(SlowChain(gate, 0), {})) == {"echo": {}}
+    assert gate.completed == 1
+
+def test_stream_holds_one_slot_for_its_whole_length():
+    gate = LLMGate(1, timeout=5)
+    chain = SlowChain(gate, 0.01)
+
+    async def stream_and_watch():
+        seen = []
+        async for item in gate.stream(chain, {}):
+            seen.append((item["part"], gate.in_flight))
+        return seen
+
+    assert asyncio.run(stream_and_watch()) == [(0, 1), (1, 1), (2, 1)]
+    assert (gate.in_flight, gate.completed) == (0, 1)
+
+def test_timeout_covers_the_whole_stream():
+    gate = LLMGate(1, timeout=0.025)
+
+    async def consume():
+        return [item async for item in gate.stream(SlowChain(gate, 0.01), {})]
+
+    with pytest.raises(TimeoutError):
+        asyncio.run(consume())
+    assert gate.timeouts == 1
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from app import planning
+from app.cache import LLMCache
+from app.gate import LLMGate
+
+
+def stage(text: str, *words) -> dict:
+    return {"title": text, "stage_text": text, "suggested_vocab": [{"word": w} for w in words]}
+
+# Each chunk's plan as the model would write it; chunk "b" answers first
+PLANS = {
+    "a": {"stages": [stage("a2", "casa"), stage("a1")]},
+    "b": {"stages": [stage("b1", "Casa", "rio"), stage("a1")]},
+}
+DELAYS = {"a": 0.03, "b": 0.0}
+
+
+class PlanChain:
+    def __init__(self, fail: str = None):
+        self.fail = fail
+        self.calls = []
+        self.cancelled = []
+
+    async def ainvoke(self, inputs: dict):
+        chunk = inputs["text"]
+        self.calls.append(chunk)
+        try:
+            await asyncio.sleep(DELAYS.get(chunk, 0.5))
+        except asyncio.CancelledError:
+            self.cancelled.append(chunk)
+            raise
+        if chunk == self.fail:
+            raise RuntimeError("model error")
+        return PLANS[chunk]
+
+    async def astream(self, inputs: dict):
+        # JsonOutputParser style: the growing document, one more stage each time
+        plan = await self.ainvoke(inputs)
+        for n in range(1, len(plan["stages"]) + 1):
+            yield {"stages": plan["stages"][:n]}
+
+
+def inputs(*chunks) -> list:
+    return [{"text": chunk} for chunk in chunks]
+
+def batch(chain, chunks, cache=None) -> dict:
+    async def plan():
+        return planning.merge_plans(await planning.plan_chunks(LLMGate(8, 5), chain, inputs(*chunks), cache=cache))
+    return asyncio.run(plan())
+
+def streamed(chain, chunks) -> list:
+    async def plan():
+        return [s async for s in planning.stream_plan(LLMGate(8, 5), chain, list(chunks), inputs(*chunks))]
+    return asyncio.run(plan())
+
+
+def test_split_text_cuts_on_boundaries_and_keeps_every_character():
+    text = "First paragraph here.\n\nSecond one, a bit longer. It has two sentences.\n\nThird."
+    chunks = planning.split_text(text, max_chars=40)
+    assert "".join(chunks) == text
+    assert all(len(chunk) <= 40 for chunk in chunks)
+    assert chunks[0].endswith("\n\n")
+
+def test_merge_keeps_text_order_and_drops_repeats():
+    plan = batch(PlanChain(), ["a", "b"])
+    assert [s["stage_text"] for s in plan["stages"]] == ["a2", "a1", "b1"]
+    # A word is suggested the first time only, whatever its case
+    assert [[v["word"] for v in s["suggested_vocab"]] for s in plan["stages"]] == [["casa"], [], ["rio"]]
+
+def test_stream_and_batch_give_the_same_plan():
+    assert streamed(PlanChain(), ["a", "b"]) == batch(PlanChain(), ["a", "b"])["stages"]
+
+def test_cached_chunks_are_not_generated_again():
+    cache = LLMCache("", 60, 100).register("plan", "prompt")
+    chain = PlanChain()
+    first = batch(chain, ["a", "b"], cache)
+    assert batch(chain, ["a", "b"], cache) == first
+    assert sorted(chain.calls) == ["a", "b"]
+
+def test_failed_chunk_cancels_the_rest():
+    chain = PlanChain(fail="b")
+    with pytest.raises(RuntimeError):
+        batch(chain, ["slow", "b"])
+    assert chain.cancelled == ["slow"]
+
+def test_failed_chunk_ends_the_stream():
+    chain = PlanChain(fail="b")
+    with pytest.raises(RuntimeError):
+        streamed(chain, ["a", "b", "slow"])
+    assert chain.cancelled == ["slow"]
@@ -0,0 +1,12 @@
+import json
+
+from sqlalchemy import func
+
+# Postgres NOTIFY channel the backend listens on to push status to open event streams
+DOCUMENT_EVENTS_CHANNEL = "document_events"
+
+def status_notification(doc_id: int, status: str, version: int, error: str = None, **extra):
+    # SELECT pg_notify(...) for the caller to execute (sync or async session). Postgres
+    # delivers it when the surrounding transaction commits, never before the rows it describes.
+    payload = {"document_id": doc_id, "event": "status", "status": status, "version": version, "error": error, **extra}
+    return func.pg_notify(DOCUMENT_EVENTS_CHANNEL, json.dumps(payload)).select()
@@ -0,0 +1,151 @@
+import multiprocessing
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import pdfplumber
+import pytesseract
+from PIL import Image
+
+# Extraction engine config
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", str(os.cpu_count() or 2)))
+EXTRACTION_TIMEOUT = float(os.getenv("EXTRACTION_TIMEOUT", "300"))  # seconds per document
+EXTRACTION_PAGES_PER_TASK = int(os.getenv("EXTRACTION_PAGES_PER_TASK", "8"))  # text-layer pass only
+# A page whose text layer has fewer characters than this is treated as scanned and OCR'd
+EXTRACTION_MIN_TEXT_CHARS = int(os.getenv("EXTRACTION_MIN_TEXT_CHARS", "25"))
+OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+OCR_MAX_DIMENSION = int(os.getenv("OCR_MAX_DIMENSION", "3000"))  # px, longest side fed to Tesseract
+
+ExtractionResult = namedtuple("ExtractionResult", ["text", "pages", "text_pages", "ocr_pages", "seconds"])
+
+
+# --- Functions executed inside the pool processes ---
+
+def preprocess_image(image: Image.Image) -> Image.Image:
+    # Grayscale, cap the resolution and binarize with Otsu's threshold:
+    # Tesseract is faster and usually more accurate on clean black-on-white input
+    image = image.convert("L")
+    if max(image.size) > OCR_MAX_DIMENSION:
+        image.thumbnail((OCR_MAX_DIMENSION, OCR_MAX_DIMENSION), Image.LANCZOS)
+
+    histogram = image.histogram()
+    total = sum(histogram)
+    sum_all = sum(i * count for i, count in enumerate(histogram))
+    sum_background, weight_background = 0, 0
+    best_threshold, best_variance = 127, 0.0
+    for i, count in enumerate(histogram):
+        weight_background += count
+        if weight_background == 0:
+            continue
+        weight_foreground = total - weight_background
+        if weight_foreground == 0:
+            break
+        sum_background += i * count
+        mean_background = sum_background / weight_background
+        mean_foreground = (sum_all - sum_background) / weight_foreground
+        variance = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = i, variance
+
+    return image.point(lambda p: 255 if p > best_threshold else 0)
+
+def _ocr(image: Image.Image, timeout: float) -> str:
+    # Tesseract runs as a subprocess; the timeout kills it instead of leaving the pool slot stuck
+    return pytesseract.image_to_string(preprocess_image(image), timeout=timeout)
+
+def _count_pdf_pages(pdf_path: str) -> int:
+    with pdfplumber.open(pdf_path) as pdf:
+        return len(pdf.pages)
+
+def _extract_pdf_text_layer(pdf_path: str, start: int, end: int) -> list:
+    # None marks a page without a usable text layer
+    texts = []
+    with pdfplumber.open(pdf_path) as pdf:
+        for page in pdf.pages[start:end]:
+            text = page.extract_text() or ""
+            texts.append(text if len(text.strip()) >= EXTRACTION_MIN_TEXT_CHARS else None)
+    return texts
+
+def _ocr_pdf_page(pdf_path: str, page_number: int, timeout: float) -> str:
+    with pdfplumber.open(pdf_path) as pdf:
+        rendered = pdf.pages[page_number].to_image(resolution=OCR_DPI).original
+        return _ocr(rendered, timeout)
+
+def _extract_image(image_path: str, timeout: float) -> str:
+    with Image.open(image_path) as image:
+        return _ocr(image, timeout)
+
+
+class ExtractionEngine:
+    def __init__(self, workers: int, timeout: float, pages_per_task: int):
+        self.workers = workers
+        self.timeout = timeout
+        self.pages_per_task = pages_per_task
+        self._pool = None
+
+    def start(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def extract_file(self, path: str, content_type: str) -> ExtractionResult:
+        # Raises concurrent.futures.TimeoutError when the document exceeds EXTRACTION_TIMEOUT
+        started = time.monotonic()
+        if content_type == "application/pdf":
+            text, pages, ocr_pages = self._extract_pdf(path)
+        elif content_type and content_type.startswith("image/"):
+            self.start()
+            text = self._pool.submit(_extract_image, path, self.timeout).result(timeout=self.timeout)
+            pages, ocr_pages = 1, 1
+        else:
+            with open(path, "rb") as f:
+                text = f.read().decode("utf-8")
+            pages, ocr_pages = 1, 0
+        return ExtractionResult(text, pages, pages - ocr_pages, ocr_pages, time.monotonic() - started)
+
+    def _extract_pdf(self, path: str):
+        self.start()
+        deadline = time.monotonic() + self.timeout
+
+        def remaining():
+            return max(0, deadline - time.monotonic())
+
+        page_count = self._pool.submit(_count_pdf_pages, path).result(timeout=remaining())
+
+        # Pass 1: text layer, page ranges in parallel
+        futures = [
+            self._pool.submit(_extract_pdf_text_layer, path, start, min(start + self.pages_per_task, page_count))
+            for start in range(0, page_count, self.pages_per_task)
+        ]
+        try:
+            texts = [text for f in futures for text in f.result(timeout=remaining())]
+
+            # Pass 2: OCR only the pages without a text layer, one task per page
+            ocr_futures = {
+                page_number: self._pool.submit(_ocr_pdf_page, path, page_number, self.timeout)
+                for page_number, text in enumerate(texts) if text is None
+            }
+            futures.extend(ocr_futures.values())
+            for page_number, future in ocr_futures.items():
+                texts[page_number] = future.result(timeout=remaining())
+        finally:
+            for f in futures:
+                f.cancel()
+
+        text = "".join(page_text + "\n" for page_text in texts if page_text)
+        return text, page_count, len(ocr_futures)
+
+
+engine = ExtractionEngine(
+    workers=EXTRACTION_WORKERS,
+    timeout=EXTRACTION_TIMEOUT,
+    pages_per_task=EXTRACTION_PAGES_PER_TASK,
+)
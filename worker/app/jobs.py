@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, or_
+from sqlalchemy.dialects.postgresql import insert
+
+from app import models
+
+# Plan job ledger (plan_jobs). A job is keyed by what the plan depends on:
+# the document, its text (the blob hash) and the profile fields sent to the
+# AI service. Claiming is a single upsert, so of two deliveries of the same
+# job only one gets to run; a finished job short-circuits every later one.
+
+PLAN_JOB_LEASE = int(os.getenv("PLAN_JOB_LEASE", "600"))  # seconds a running claim lives without a heartbeat
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+PROFILE_FIELDS = ("nome", "idade", "grau_de_instrucao", "profissao", "nacionalidade", "lingua_nativa")
+
+
+class JobBusy(Exception):
+    # Another worker holds a live claim; the delivery should come back later
+    pass
+
+
+def profile_version(user: models.UserProfile) -> str:
+    fields = {name: getattr(user, name) for name in PROFILE_FIELDS}
+    return hashlib.sha256(json.dumps(fields, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+def plan_job_key(doc_id: int, blob_sha256: str, user: models.UserProfile) -> str:
+    return f"plan:{doc_id}:{blob_sha256}:{profile_version(user)}"
+
+
+class Phases:
+    # Wall-clock milliseconds per phase, each measured from the end of the previous one
+    def __init__(self):
+        self.started = time.monotonic()
+        self._last = self.started
+        self.ms = {}
+
+    def mark(self, name: str):
+        now = time.monotonic()
+        self.ms[name] = int((now - self._last) * 1000)
+        self._last = now
+
+    def total_ms(self) -> int:
+        return int((time.monotonic() - self.started) * 1000)
+
+
+async def claim(session, key: str, doc_id: int, user_id: int):
+    # Returns the job id to run, or None when there is nothing to do (planned or refused). Commits the claim.
+    now = datetime.utcnow()
+    lease = now + timedelta(seconds=PLAN_JOB_LEASE)
+    claimed = {"status": "running", "worker": WORKER_ID, "lease_until": lease, "started_at": now, "updated_at": now}
+    job_id = (await session.execute(
+        insert(models.PlanJob)
+        .values(idempotency_key=key, document_id=doc_id, user_id=user_id, attempts=1, created_at=now, **claimed)
+        .on_conflict_do_update(
+            index_elements=[models.PlanJob.idempotency_key],
+            set_={**claimed, "attempts": models.PlanJob.attempts + 1, "error": None, "finished_at": None},
+            # Retry of a failed attempt, or taking over from a worker whose lease ran out
+            where=or_(
+                models.PlanJob.status.in_(("retrying", "failed")),
+                models.PlanJob.lease_until < now,
+            ),
+        )
+        .returning(models.PlanJob.id)
+    )).scalar()
+    if job_id is not None:
+        await session.commit()
+        return job_id
+
+    status = await session.scalar(select(models.PlanJob.status).where(models.PlanJob.idempotency_key == key))
+    await session.rollback()
+    if status in ("succeeded", "rejected"):
+        return None
+    raise JobBusy(f"Plan job {key} is running elsewhere")
+
+async def renew(session, job_id: int):
+    # Heartbeat; not committed here, it rides along with the caller's next commit
+    now = datetime.utcnow()
+    await session.execute(
+        update(models.PlanJob)
+        .where(models.PlanJob.id == job_id)
+        .values(lease_until=now + timedelta(seconds=PLAN_JOB_LEASE), updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+
+async def finish(session, job_id: int, status: str, phases: Phases, error: str = None, stage_count: int = None):
+    # Not committed here either: success lands in the same commit as the ready status
+    now = datetime.utcnow()
+    await session.execute(
+        update(models.PlanJob)
+        .where(models.PlanJob.id == job_id)
+        .values(
+            status=status,
+            error=error,
+            stage_count=stage_count,
+            phases=phases.ms,
+            duration_ms=phases.total_ms(),
+            lease_until=None,
+            finished_at=now,
+            updated_at=now,
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+async def fail_document_jobs(session, doc_id: int, error: str):
+    # Dead-lettered: the attempts left waiting for a retry are now terminal
+    now = datetime.utcnow()
+    await session.execute(
+        update(models.PlanJob)
+        .where(models.PlanJob.document_id == doc_id, models.PlanJob.status == "retrying")
+        .values(status="failed", error=error, finished_at=now, updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
@@ -1,94 +1,226 @@
+import asyncio
 import pika
 import os
 import json
+import threading
 import time
-import requests
+from datetime import datetime, timedelta
+from sqlalchemy import update, insert, or_, and_, func
 from sqlalchemy.orm import Session
-from app import database, models
+from app import database, models, extraction, textstore, search, events, planner
 
 # Environment config
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
 RABBITMQ_USER = os.getenv("RABBITMQ_USER", "user")
 RABBITMQ_PASS = os.getenv("RABBITMQ_PASS", "password")
-IA_SERVICE_URL = os.getenv("IA_SERVICE_URL", "http://ia-service:8001")
+# Pipeline stages consumed by this process, so OCR capacity can be scaled apart from planning
+WORKER_QUEUES = [q.strip() for q in os.getenv("WORKER_QUEUES", "extraction,reading_plan").split(",") if q.strip()]
+
+# Seconds before a blob stuck in 'extracting' (crashed worker) can be claimed again
+EXTRACTION_CLAIM_TIMEOUT = int(os.getenv("EXTRACTION_CLAIM_TIMEOUT", "900"))
+# Seconds a job waits before checking again on a blob another worker has claimed
+EXTRACTION_DEFER_DELAY = int(os.getenv("EXTRACTION_DEFER_DELAY", "60"))
+SEARCH_INSERT_BATCH = 200  # search chunk rows per INSERT
+
+EXTRACTION_QUEUE = "extraction_queue"
+# Holds a job for EXTRACTION_DEFER_DELAY, then dead-letters it back onto EXTRACTION_QUEUE
+EXTRACTION_DEFERRED_QUEUE = f"{EXTRACTION_QUEUE}.deferred.{EXTRACTION_DEFER_DELAY}s"
+EXTRACTION_DEFERRED_ARGUMENTS = {
+    "x-message-ttl": EXTRACTION_DEFER_DELAY * 1000,
+    "x-dead-letter-exchange": "",
+    "x-dead-letter-routing-key": EXTRACTION_QUEUE,
+}
 
 def get_db_session():
     return database.SessionLocal()
 
-def process_message(ch, method, properties, body):
+def notify_status(db: Session, doc_id: int, status: str, version: int, error: str = None, **extra):
+    db.execute(events.status_notification(doc_id, status, version, error, **extra))
+
+def get_pipeline_backlog(db: Session, user_id: int) -> int:
+    return db.query(func.count(models.Document.id)).filter(
+        models.Document.user_id == user_id,
+        models.Document.status.in_(("uploaded", "extracting", "planning")),
+    ).scalar()
+
+def enqueue_plan_job(db: Session, user_id: int, doc_id: int):
+    # Written to the outbox in the transaction that moves the document to
+    # 'planning'; the backend's relay publishes it once that commits
+    db.add(models.OutboxMessage(
+        queue=planner.READING_PLAN_QUEUE,
+        payload={"user_id": user_id, "document_id": doc_id},
+        priority=planner.plan_priority(get_pipeline_backlog(db, user_id)),
+    ))
+
+def advance_waiting_documents(db: Session, sha256: str, status: str, error: str = None):
+    # Every document waiting on the same blob moves on together; the status
+    # guard makes sure each one is advanced (and planned) exactly once
+    rows = db.execute(
+        update(models.Document)
+        .where(
+            models.Document.blob_sha256 == sha256,
+            models.Document.status.in_(("uploaded", "extracting")),
+        )
+        .values(status=status, error=error, version=models.Document.version + 1)
+        .returning(models.Document.id, models.Document.user_id, models.Document.version)
+    ).all()
+    for doc_id, user_id, version in rows:
+        notify_status(db, doc_id, status, version, error)
+        if status == "planning":
+            enqueue_plan_job(db, user_id, doc_id)
+    return [doc_id for doc_id, _, _ in rows]
+
+def claim_blob(db: Session, sha256: str) -> bool:
+    stale = datetime.utcnow() - timedelta(seconds=EXTRACTION_CLAIM_TIMEOUT)
+    result = db.execute(
+        update(models.Blob)
+        .where(
+            models.Blob.sha256 == sha256,
+            or_(
+                models.Blob.status.in_(("pending", "failed")),
+                and_(models.Blob.status == "extracting", models.Blob.claimed_at < stale),
+            ),
+        )
+        .values(status="extracting", claimed_at=datetime.utcnow())
+    )
+    return result.rowcount == 1
+
+def release_claim(db: Session, sha256: str, retry: bool):
+    # A failure after the claim committed: hand the blob back for the retry, or
+    # fail it with its documents. Guarded on the status, so a blob that reached
+    # 'extracted' before the failure is left alone.
+    values = {"status": "pending", "claimed_at": None} if retry else {"status": "failed", "error": "Error extracting text"}
+    released = db.execute(
+        update(models.Blob)
+        .where(models.Blob.sha256 == sha256, models.Blob.status == "extracting")
+        .values(**values)
+    ).rowcount
+    if released and not retry:
+        advance_waiting_documents(db, sha256, "failed", values["error"])
+
+def defer_extraction(ch, properties, body):
+    # Back on the extraction queue after EXTRACTION_DEFER_DELAY; the channel has
+    # confirms on, so the copy is on the broker before the delivery is acked
+    ch.basic_publish(exchange="", routing_key=EXTRACTION_DEFERRED_QUEUE, body=body, properties=properties)
+
+def index_blob_text(db: Session, sha256: str, text: str):
+    # Full-text index rows land in the same commit as the extracted status
+    db.query(models.BlobSearchChunk).filter(models.BlobSearchChunk.blob_sha256 == sha256).delete(synchronize_session=False)
+    rows = search.blob_chunk_rows(sha256, text)
+    for start in range(0, len(rows), SEARCH_INSERT_BATCH):
+        db.execute(insert(models.BlobSearchChunk).values(rows[start:start + SEARCH_INSERT_BATCH]))
+
+def process_extraction(ch, method, properties, body):
     db: Session = get_db_session()
+    claimed = False
     try:
         data = json.loads(body)
         user_id = data.get("user_id")
         doc_id = data.get("document_id")
-        
-        print(f" [x] Processing Doc ID: {doc_id} for User ID: {user_id}")
-        
-        # 1. Fetch User and Document
-        user = db.query(models.UserProfile).filter(models.UserProfile.id == user_id).first()
+
+        print(f" [x] Extracting Doc ID: {doc_id} for User ID: {user_id}")
+
         document = db.query(models.Document).filter(models.Document.id == doc_id).first()
-        
-        if not user or not document:
-            print("User or Document not found.")
+        if not document:
+            print("Document not found.")
             ch.basic_ack(delivery_tag=method.delivery_tag)
             return
 
-        # 2. Call AI Service
-        payload = {
-            "profile": {
-                "nome": user.nome,
-                "idade": user.idade,
-                "grau_de_instrucao": user.grau_de_instrucao,
-                "profissao": user.profissao,
-                "nacionalidade": user.nacionalidade,
-                "lingua_nativa": user.lingua_nativa
-            },
-            "raw_text": document.raw_text
-        }
-        
+        blob = document.blob
+        if blob.status == "extracted":
+            # Extracted by another document's job since this one was queued
+            advance_waiting_documents(db, blob.sha256, "planning")
+            db.commit()
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+            return
+
+        sha256 = blob.sha256
+        claimed = claim_blob(db, sha256)
+        started_doc = db.execute(
+            update(models.Document)
+            .where(models.Document.id == doc_id, models.Document.status == "uploaded")
+            .values(status="extracting", version=models.Document.version + 1)
+            .returning(models.Document.version)
+        ).first()
+        if started_doc is not None:
+            notify_status(db, doc_id, "extracting", started_doc.version)
+        db.commit()
+
+        if not claimed:
+            # Another worker holds a live claim on the same bytes. Not acked outright:
+            # if that worker crashed, this job (or its own redelivery) takes over
+            # once the claim expires; if it finishes, the job finds the blob extracted.
+            print(f" [x] Blob {sha256[:12]} is already being extracted, Document {doc_id} checks again in {EXTRACTION_DEFER_DELAY}s")
+            defer_extraction(ch, properties, body)
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+            return
+
+        error = None
+        started = time.monotonic()
         try:
-            response = requests.post(f"{IA_SERVICE_URL}/ia/plan-reading", json=payload)
-            response.raise_for_status()
-            ai_data = response.json()
+            result = extraction.engine.extract_file(blob.storage_path, blob.content_type)
+            raw_text = result.text
+            print(
+                f" [x] {result.pages} page(s) ({result.text_pages} text layer, {result.ocr_pages} OCR) "
+                f"in {result.seconds:.2f}s, {result.pages / max(result.seconds, 1e-6):.1f} pages/sec"
+            )
+            if not raw_text.strip():
+                error = "No text content detected"
+        except UnicodeDecodeError:
+            error = "Could not extract text"
         except Exception as e:
-            print(f"Error calling AI service: {e}")
-            # If AI service fails, we might want to retry or dead-letter.
-            # For MVP, we ack but maybe log error. 
-            # Or nack with requeue=False.
-            # Let's simple ack to unblock.
+            print(f"Error extracting text: {e}")
+            error = "Error extracting text"
+
+        db.refresh(blob)
+        blob.extraction_ms = int((time.monotonic() - started) * 1000)
+        if error:
+            blob.status = "failed"
+            blob.error = error
+            advance_waiting_documents(db, blob.sha256, "failed", error)
+            db.commit()
             ch.basic_ack(delivery_tag=method.delivery_tag)
             return
 
-        # 3. Save Stages
-        # Remove existing stages for this doc (idempotency)
-        db.query(models.ReadingStage).filter(models.ReadingStage.document_id == doc_id).delete()
-        
-        stages = ai_data.get("stages", [])
-        for i, stage_data in enumerate(stages):
-            new_stage = models.ReadingStage(
-                document_id=doc_id,
-                stage_index=i + 1,
-                title=stage_data.get("title"),
-                objective=stage_data.get("objective"),
-                stage_text=stage_data.get("stage_text"),
-                suggested_vocab=stage_data.get("suggested_vocab")
-            )
-            db.add(new_stage)
-        
+        blob.text_ref = textstore.store.put(textstore.blob_text_key(blob.sha256), raw_text)
+        blob.text_length = len(raw_text)
+        index_blob_text(db, blob.sha256, raw_text)
+        blob.status = "extracted"
+        blob.error = None
+        # Hand over to the planning stage: status and plan jobs commit together
+        waiting = advance_waiting_documents(db, blob.sha256, "planning")
         db.commit()
-        print(f" [x] Saved {len(stages)} stages for Document {doc_id}")
-        
+        print(f" [x] Extracted {len(raw_text)} chars in {blob.extraction_ms} ms for {len(waiting)} document(s)")
+
         ch.basic_ack(delivery_tag=method.delivery_tag)
 
     except Exception as e:
-        print(f"Error processing message: {e}")
+        print(f"Error processing extraction: {e}")
         db.rollback()
-        # Ack or Nack?
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+        # Retried once, through the broker's redelivery; a job that fails twice is dropped
+        retry = not method.redelivered
+        if claimed:
+            try:
+                release_claim(db, sha256, retry)
+                db.commit()
+            except Exception as release_error:
+                # The claim stays until it expires; keep the job so it can take over then
+                print(f"Could not release extraction claim: {release_error}")
+                db.rollback()
+                retry = True
+        if retry:
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+        else:
+            ch.basic_ack(delivery_tag=method.delivery_tag)
     finally:
         db.close()
 
-def main():
+# Blocking consumers; reading plans run on the asyncio consumer in planner.py
+CONSUMERS = {
+    "extraction": (EXTRACTION_QUEUE, process_extraction),
+}
+
+def consume_blocking(names):
     while True:
         try:
             credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
@@ -96,12 +228,17 @@ def main():
             connection = pika.BlockingConnection(parameters)
             channel = connection.channel()
 
-            channel.queue_declare(queue='reading_plan_queue', durable=True)
+            channel.queue_declare(queue=EXTRACTION_QUEUE, durable=True)
+            channel.queue_declare(queue=EXTRACTION_DEFERRED_QUEUE, durable=True, arguments=EXTRACTION_DEFERRED_ARGUMENTS)
+            channel.confirm_delivery()
 
+            # OCR is CPU bound and already parallel inside the extraction pool
             channel.basic_qos(prefetch_count=1)
-            channel.basic_consume(queue='reading_plan_queue', on_message_callback=process_message)
+            for name in names:
+                queue, callback = CONSUMERS[name]
+                channel.basic_consume(queue=queue, on_message_callback=callback)
 
-            print(' [*] Waiting for messages. To exit press CTRL+C')
+            print(f' [*] Waiting for messages on {", ".join(names)}. To exit press CTRL+C')
             channel.start_consuming()
         except pika.exceptions.AMQPConnectionError:
             print("RabbitMQ not ready, retrying in 5 seconds...")
@@ -110,5 +247,16 @@ def main():
             print(f"Unexpected error: {e}")
             time.sleep(5)
 
+def main():
+    blocking = [name for name in WORKER_QUEUES if name in CONSUMERS]
+    if "reading_plan" not in WORKER_QUEUES:
+        consume_blocking(blocking)
+        return
+
+    # pika's BlockingConnection stays on its own thread; the event loop owns the planner
+    if blocking:
+        threading.Thread(target=consume_blocking, args=(blocking,), name="blocking-consumers", daemon=True).start()
+    asyncio.run(planner.run())
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,91 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Worker metrics as JSON on WORKER_METRICS_PORT (GET /metrics), the worker's
+# counterpart of the backend's /api/metrics. Sources are callables returning
+# a dict; they run on the server thread, so they should only read state.
+
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9100"))  # 0 disables the endpoint
+QUEUE_WAIT_WINDOW = 256  # recent waits kept per user
+QUEUE_WAIT_IDLE = 3600  # seconds before a quiet user drops out of the report
+
+
+class QueueWaitMetrics:
+    # Time from enqueue to the start of planning, per user
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waits = {}  # user id -> deque of seconds
+        self._seen = {}  # user id -> monotonic time of the last observation
+        self.observed = 0
+
+    def observe(self, user_id, seconds: float):
+        with self._lock:
+            self._waits.setdefault(user_id, deque(maxlen=QUEUE_WAIT_WINDOW)).append(max(0.0, seconds))
+            self._seen[user_id] = time.monotonic()
+            self.observed += 1
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            for user_id in [u for u, seen in self._seen.items() if now - seen > QUEUE_WAIT_IDLE]:
+                del self._waits[user_id], self._seen[user_id]
+            users = {user_id: sorted(waits) for user_id, waits in self._waits.items()}
+            observed = self.observed
+
+        def summary(waits):
+            def percentile(p):
+                return round(waits[min(len(waits) - 1, int(p * len(waits)))], 3)
+            return {"count": len(waits), "p50_s": percentile(0.50), "p95_s": percentile(0.95), "max_s": round(waits[-1], 3)}
+
+        everyone = sorted(w for waits in users.values() for w in waits)
+        return {
+            "observed": observed,
+            "overall": summary(everyone) if everyone else None,
+            "users": {str(user_id): summary(waits) for user_id, waits in users.items()},
+        }
+
+
+class MetricsServer:
+    def __init__(self, port: int):
+        self.port = port
+        self.sources = {}
+        self._server = None
+
+    def register(self, name: str, source):
+        self.sources[name] = source
+
+    def collect(self) -> dict:
+        return {name: source() for name, source in self.sources.items()}
+
+    def start(self):
+        if self._server is not None or not self.port:
+            return
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+                body = json.dumps(metrics.collect(), default=str).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("0.0.0.0", self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True).start()
+        print(f" [*] Metrics on :{self.port}/metrics")
+
+
+queue_wait = QueueWaitMetrics()
+server = MetricsServer(WORKER_METRICS_PORT)
@@ -1,5 +1,6 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, JSON
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, BigInteger, String, Text, ForeignKey, DateTime, JSON
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import relationship, deferred
 from datetime import datetime
 from app.database import Base
 
@@ -18,17 +19,45 @@ class UserProfile(Base):
     documents = relationship("Document", back_populates="user")
     unknown_words = relationship("UnknownWord", back_populates="user")
 
+class Blob(Base):
+    __tablename__ = "blobs"
+
+    sha256 = Column(String(64), primary_key=True)
+    size_bytes = Column(BigInteger)
+    content_type = Column(String)
+    storage_path = Column(String)
+    text_ref = Column(String, nullable=True) # textstore reference
+    text_length = Column(Integer, nullable=True)
+    status = Column(String, default="pending") # pending -> extracting -> extracted | failed
+    error = Column(Text, nullable=True)
+    extraction_ms = Column(Integer, nullable=True)
+    claimed_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class BlobSearchChunk(Base):
+    __tablename__ = "blob_search_chunks"
+
+    blob_sha256 = Column(String(64), ForeignKey("blobs.sha256", ondelete="CASCADE"), primary_key=True)
+    chunk_index = Column(Integer, primary_key=True)
+    char_offset = Column(Integer, nullable=False)
+    char_length = Column(Integer, nullable=False)
+    search_vector = deferred(Column(TSVECTOR, nullable=False))
+
 class Document(Base):
     __tablename__ = "documents"
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
+    blob_sha256 = Column(String(64), ForeignKey("blobs.sha256"), index=True)
     original_filename = Column(String)
     content_type = Column(String) # pdf, image, text
-    raw_text = Column(Text)
+    status = Column(String, default="uploaded") # uploaded -> extracting -> planning -> ready | failed
+    error = Column(Text, nullable=True)
+    version = Column(Integer, nullable=False, default=1) # bumped on every status, stage or note write (ETags)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("UserProfile", back_populates="documents")
+    blob = relationship("Blob")
     stages = relationship("ReadingStage", back_populates="document", cascade="all, delete-orphan")
 
 class ReadingStage(Base):
@@ -39,8 +68,9 @@ class ReadingStage(Base):
     stage_index = Column(Integer)
     title = Column(String)
     objective = Column(Text)
-    stage_text = Column(Text)
+    text_ref = Column(String, nullable=True) # textstore reference
     suggested_vocab = Column(JSON) # list of { word, definition }
+    search_vector = deferred(Column(TSVECTOR, nullable=True))
     created_at = Column(DateTime, default=datetime.utcnow)
 
     document = relationship("Document", back_populates="stages")
@@ -70,3 +100,39 @@ class UnknownWord(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("UserProfile", back_populates="unknown_words")
+
+class OutboxMessage(Base):
+    __tablename__ = "outbox"
+
+    # Shared with the backend, whose relay publishes the rows; the worker only writes them
+    id = Column(Integer, primary_key=True, index=True)
+    queue = Column(String, nullable=False)
+    payload = Column(JSON, nullable=False)
+    priority = Column(Integer, nullable=True)
+    attempts = Column(Integer, default=0)
+    last_error = Column(Text, nullable=True)
+    available_at = Column(DateTime, default=datetime.utcnow, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class PlanJob(Base):
+    __tablename__ = "plan_jobs"
+
+    # Ledger of reading-plan generation. One row per (document, text, profile):
+    # the worker claims it atomically before the AI call, so a redelivered
+    # message never pays for the same plan twice.
+    id = Column(Integer, primary_key=True)
+    idempotency_key = Column(String, nullable=False, unique=True)  # plan:<document>:<blob sha256>:<profile version>
+    document_id = Column(Integer, ForeignKey("documents.id", ondelete="CASCADE"), nullable=False, index=True)
+    user_id = Column(Integer, nullable=False)
+    status = Column(String, nullable=False, default="running")  # running -> succeeded | retrying | failed (dead-lettered) | rejected (4xx)
+    attempts = Column(Integer, nullable=False, default=1)
+    worker = Column(String)  # host:pid holding the claim
+    lease_until = Column(DateTime, nullable=True)  # a running claim past this is considered crashed
+    stage_count = Column(Integer, nullable=True)
+    error = Column(Text, nullable=True)
+    phases = Column(JSON, nullable=True)  # milliseconds per phase of the last attempt
+    duration_ms = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
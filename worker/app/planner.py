@@ -0,0 +1,441 @@
+import asyncio
+import json
+import os
+import time
+
+import aio_pika
+import httpx
+from sqlalchemy import delete, update, exists
+from sqlalchemy.dialects.postgresql import insert
+
+from app import database, models, textstore, search, events, ratelimit, metrics, jobs
+
+# Asyncio consumer for reading_plan_queue. A plan is almost entirely a wait
+# on the AI service, so one process keeps many of them in flight: prefetch
+# bounds the deliveries buffered from RabbitMQ, concurrency the plans running.
+# Plans that hit a transient AI-service error are republished to a delay
+# queue (TTL, then dead-lettered back onto the main queue) with a growing
+# delay; after PLAN_MAX_RETRIES they are parked on the dead-letter queue,
+# from where replay_dlq.py puts them back.
+#
+# Fairness: the queue is a priority queue (a user's first documents outrank
+# a bulk import, see plan_priority) and no user holds more than
+# PLAN_USER_CONCURRENCY plans in this container; deliveries over the cap wait
+# out a short deferral queue instead of taking a slot from other users.
+
+RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
+RABBITMQ_USER = os.getenv("RABBITMQ_USER", "user")
+RABBITMQ_PASS = os.getenv("RABBITMQ_PASS", "password")
+IA_SERVICE_URL = os.getenv("IA_SERVICE_URL", "http://ia-service:8001")
+
+PLAN_CONCURRENCY = int(os.getenv("PLAN_CONCURRENCY", "32"))  # ceiling for the adaptive limit
+PLAN_MIN_CONCURRENCY = int(os.getenv("PLAN_MIN_CONCURRENCY", "1"))
+PLAN_INITIAL_CONCURRENCY = int(os.getenv("PLAN_INITIAL_CONCURRENCY", str(max(1, PLAN_CONCURRENCY // 4))))
+PLAN_LATENCY_TARGET = float(os.getenv("PLAN_LATENCY_TARGET", "120"))  # seconds; slower calls count as congestion
+PLAN_PREFETCH = int(os.getenv("PLAN_PREFETCH", str(PLAN_CONCURRENCY)))
+IA_SERVICE_TIMEOUT = float(os.getenv("IA_SERVICE_TIMEOUT", "300"))  # seconds for one plan-reading call
+IA_SERVICE_MAX_CONNECTIONS = int(os.getenv("IA_SERVICE_MAX_CONNECTIONS", str(PLAN_CONCURRENCY)))
+
+# Provider budget for this container; split the account's limit across worker replicas
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "30000"))
+PLAN_CHUNK_CHARS = 12000  # ia-service plans long texts in chunks of about this size, one LLM call each
+PLAN_PROMPT_TOKENS = 1500  # per call: prompt template, format instructions and vocabulary output
+RATE_LIMIT_PAUSE = 20  # seconds to hold off after a 429 that carries no Retry-After
+
+PLAN_RETRY_BASE_DELAY = int(os.getenv("PLAN_RETRY_BASE_DELAY", "15"))  # seconds, doubled per attempt
+PLAN_MAX_RETRIES = int(os.getenv("PLAN_MAX_RETRIES", "6"))
+RETRY_DELAYS = [PLAN_RETRY_BASE_DELAY * 2 ** i for i in range(PLAN_MAX_RETRIES)]
+PLAN_USER_CONCURRENCY = int(os.getenv("PLAN_USER_CONCURRENCY", "4"))  # plans per user in this container
+PLAN_DEFER_DELAY = int(os.getenv("PLAN_DEFER_DELAY", "10"))  # seconds a delivery over the user cap waits
+
+# Name, arguments and priority tiers are shared with backend/app/messaging.py
+READING_PLAN_QUEUE = "reading_plan_priority_queue"
+PLAN_MAX_PRIORITY = 9
+READING_PLAN_QUEUE_ARGUMENTS = {"x-max-priority": PLAN_MAX_PRIORITY}
+DEAD_LETTER_QUEUE = f"{READING_PLAN_QUEUE}.dead"
+DEFERRED_QUEUE = f"{READING_PLAN_QUEUE}.deferred.{PLAN_DEFER_DELAY}s"
+ATTEMPT_HEADER = "x-plan-attempt"
+ERROR_HEADER = "x-plan-error"
+ENQUEUED_AT_HEADER = "x-enqueued-at"
+RECONNECT_DELAY = 5
+
+
+class RetryableError(Exception):
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def plan_priority(backlog: int) -> int:
+    # backlog: the user's documents still in the pipeline, this one included
+    if backlog <= 1:
+        return PLAN_MAX_PRIORITY  # interactive: a single upload
+    if backlog <= 5:
+        return 5
+    return 1  # bulk import
+
+def delay_queue_arguments(delay: int) -> dict:
+    # Holds a message for delay seconds, then dead-letters it back onto the main queue
+    return {
+        "x-message-ttl": delay * 1000,
+        "x-dead-letter-exchange": "",
+        "x-dead-letter-routing-key": READING_PLAN_QUEUE,
+    }
+
+def retry_queue(delay: int) -> str:
+    # Named after the TTL: queue arguments can't change once declared
+    return f"{READING_PLAN_QUEUE}.retry.{delay}s"
+
+def retry_delay(attempt: int, retry_after: float = None) -> int:
+    # Exponential by attempt, but never sooner than the provider asked for
+    delay = RETRY_DELAYS[attempt - 1]
+    if retry_after and retry_after > delay:
+        delay = next((d for d in RETRY_DELAYS if d >= retry_after), RETRY_DELAYS[-1])
+    return delay
+
+def estimate_plan_tokens(text: str) -> int:
+    # The stages echo the excerpts back, so output is about the size of the input
+    calls = max(1, -(-len(text) // PLAN_CHUNK_CHARS))
+    return 2 * ratelimit.estimate_tokens(text) + calls * PLAN_PROMPT_TOKENS
+
+def parse_retry_after(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+async def set_status(session, doc_id: int, status: str, error: str = None, **extra):
+    # Commits the caller's pending writes together with the status and its event
+    version = (await session.execute(
+        update(models.Document)
+        .where(models.Document.id == doc_id)
+        .values(status=status, error=error, version=models.Document.version + 1)
+        .returning(models.Document.version)
+        .execution_options(synchronize_session=False)
+    )).scalar_one()
+    await session.execute(events.status_notification(doc_id, status, version, error, **extra))
+    await session.commit()
+
+
+class Planner:
+    def __init__(self, concurrency: int, prefetch: int):
+        self.concurrency = concurrency
+        self.prefetch = prefetch
+        self.limiter = ratelimit.AdaptiveLimiter(
+            PLAN_INITIAL_CONCURRENCY, PLAN_MIN_CONCURRENCY, concurrency, PLAN_LATENCY_TARGET
+        )
+        self.bucket = ratelimit.TokenBucket(LLM_TOKENS_PER_MINUTE)
+        self._tasks = set()
+        self._http = None
+        self._channel = None
+        self._running = {}  # user id -> plans held in this container
+        self.deferred = 0
+        self.retried = 0
+        self.dead_lettered = 0
+
+    async def run(self):
+        self._http = httpx.AsyncClient(
+            base_url=IA_SERVICE_URL,
+            timeout=httpx.Timeout(IA_SERVICE_TIMEOUT, connect=10),
+            limits=httpx.Limits(
+                max_connections=IA_SERVICE_MAX_CONNECTIONS,
+                max_keepalive_connections=IA_SERVICE_MAX_CONNECTIONS,
+            ),
+        )
+        try:
+            while True:
+                try:
+                    connection = await aio_pika.connect_robust(
+                        host=RABBITMQ_HOST, login=RABBITMQ_USER, password=RABBITMQ_PASS
+                    )
+                    break
+                except (aio_pika.exceptions.AMQPConnectionError, OSError):
+                    print(f"RabbitMQ not ready, retrying in {RECONNECT_DELAY} seconds...")
+                    await asyncio.sleep(RECONNECT_DELAY)
+
+            # connect_robust restores the channel, QoS and consumer after a broker restart
+            async with connection:
+                # Publisher confirms (aio-pika's default): a retry is on disk before its delivery is acked
+                channel = await connection.channel()
+                await channel.set_qos(prefetch_count=self.prefetch)
+                queue = await channel.declare_queue(
+                    READING_PLAN_QUEUE, durable=True, arguments=READING_PLAN_QUEUE_ARGUMENTS
+                )
+                for delay in sorted(set(RETRY_DELAYS)):
+                    await channel.declare_queue(retry_queue(delay), durable=True, arguments=delay_queue_arguments(delay))
+                await channel.declare_queue(DEFERRED_QUEUE, durable=True, arguments=delay_queue_arguments(PLAN_DEFER_DELAY))
+                await channel.declare_queue(DEAD_LETTER_QUEUE, durable=True)
+                self._channel = channel
+                await queue.consume(self.on_message)
+                print(
+                    f" [*] Planning from {READING_PLAN_QUEUE} "
+                    f"(concurrency={self.limiter.minimum}..{self.concurrency}, prefetch={self.prefetch}, "
+                    f"per user={PLAN_USER_CONCURRENCY}, tokens/min={LLM_TOKENS_PER_MINUTE})"
+                )
+                await asyncio.Future()
+        finally:
+            await self._http.aclose()
+            await database.async_engine.dispose()
+
+    async def on_message(self, message: aio_pika.abc.AbstractIncomingMessage):
+        # Each delivery gets its own task; prefetch caps how many exist at once
+        task = asyncio.create_task(self.handle(message))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def handle(self, message: aio_pika.abc.AbstractIncomingMessage):
+        try:
+            data = json.loads(message.body)
+        except json.JSONDecodeError as e:
+            await self.settle(message, f"Malformed job: {e}", final=True)
+            return
+
+        user_id = data.get("user_id")
+        if self._running.get(user_id, 0) >= PLAN_USER_CONCURRENCY:
+            # This user already has their share running here; let other users' jobs through
+            await self.settle(message, defer=True)
+            return
+
+        error = retry_after = None
+        busy = False
+        self._running[user_id] = self._running.get(user_id, 0) + 1
+        try:
+            async with self.limiter:
+                queued = self.observe_queue_wait(message, user_id)
+                try:
+                    await self.plan(user_id, data.get("document_id"), queued)
+                except jobs.JobBusy as e:
+                    # A duplicate delivery while another worker runs the job; it comes
+                    # back after the deferral and finds the job finished or its lease expired
+                    print(f" [x] {e}, deferring")
+                    busy = True
+                except RetryableError as e:
+                    error, retry_after = str(e), e.retry_after
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+        finally:
+            self._running[user_id] -= 1
+            if not self._running[user_id]:
+                del self._running[user_id]
+        await self.settle(message, error, retry_after, defer=busy)
+
+    def observe_queue_wait(self, message: aio_pika.abc.AbstractIncomingMessage, user_id):
+        # From enqueue (outbox write) to a slot, deferrals included; retries are not waits
+        headers = message.headers or {}
+        if ENQUEUED_AT_HEADER in headers and ATTEMPT_HEADER not in headers:
+            queued = time.time() - float(headers[ENQUEUED_AT_HEADER])
+            metrics.queue_wait.observe(user_id, queued)
+            return queued
+        return None
+
+    async def settle(self, message: aio_pika.abc.AbstractIncomingMessage, error: str = None,
+                     retry_after: float = None, final: bool = False, defer: bool = False):
+        try:
+            if defer:
+                await self.republish(message, DEFERRED_QUEUE, message.headers or {})
+                self.deferred += 1
+            elif error:
+                await self.reschedule(message, error, retry_after, final)
+            await message.ack()
+        except Exception as e:
+            # Couldn't hand the job on: leave it with the broker rather than lose it
+            print(f"Error settling message: {e}")
+            await message.nack(requeue=True)
+
+    async def republish(self, message: aio_pika.abc.AbstractIncomingMessage, routing_key: str, headers: dict):
+        # Keeps the priority, so a deferred or retried job doesn't lose its place in line
+        await self._channel.default_exchange.publish(
+            aio_pika.Message(
+                message.body,
+                headers=headers,
+                priority=message.priority,
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+            ),
+            routing_key=routing_key,
+        )
+
+    async def reschedule(self, message: aio_pika.abc.AbstractIncomingMessage, error: str,
+                         retry_after: float = None, final: bool = False):
+        attempt = int((message.headers or {}).get(ATTEMPT_HEADER, 0)) + 1
+        headers = {**(message.headers or {}), ATTEMPT_HEADER: attempt, ERROR_HEADER: error[:500]}
+        if final or attempt > PLAN_MAX_RETRIES:
+            await self.republish(message, DEAD_LETTER_QUEUE, headers)
+            self.dead_lettered += 1
+            print(f" [!] Dead-lettered plan job after {attempt} attempt(s): {error}")
+            await self.mark_failed(message.body)
+            return
+        delay = retry_delay(attempt, retry_after)
+        await self.republish(message, retry_queue(delay), headers)
+        self.retried += 1
+        print(f" [!] Plan job retry {attempt}/{PLAN_MAX_RETRIES} in {delay}s: {error}")
+
+    def snapshot(self) -> dict:
+        return {
+            "limiter": self.limiter.snapshot(),
+            "tokens": self.bucket.snapshot(),
+            "users_running": len(self._running),
+            "deferred": self.deferred,
+            "retried": self.retried,
+            "dead_lettered": self.dead_lettered,
+        }
+
+    async def mark_failed(self, body: bytes):
+        # The job is parked, not lost; the document shows failed until it is replayed
+        try:
+            doc_id = json.loads(body)["document_id"]
+            async with database.AsyncSessionLocal() as session:
+                await jobs.fail_document_jobs(session, doc_id, "Dead-lettered after repeated failures")
+                await set_status(session, doc_id, "failed", "Reading plan generation failed")
+        except Exception as e:
+            print(f"Could not mark dead-lettered document failed: {e}")
+
+    async def plan(self, user_id: int, doc_id: int, queued: float = None):
+        print(f" [x] Processing Doc ID: {doc_id} for User ID: {user_id}")
+        phases = jobs.Phases()
+        if queued is not None:
+            phases.ms["queue"] = int(queued * 1000)
+        async with database.AsyncSessionLocal() as session:
+            user = await session.get(models.UserProfile, user_id)
+            document = await session.get(models.Document, doc_id)
+            if not user or not document:
+                print("User or Document not found.")
+                return
+            blob = await session.get(models.Blob, document.blob_sha256)
+
+            # Claimed before anything is paid for; a redelivery of a finished job stops here
+            job_id = await jobs.claim(session, jobs.plan_job_key(doc_id, blob.sha256, user), doc_id, user_id)
+            if job_id is None:
+                print(f" [x] Plan for Doc ID {doc_id} already done, skipping duplicate delivery")
+                return
+            raw_text = await asyncio.to_thread(textstore.store.read, blob.text_ref)
+            phases.mark("load")
+
+            payload = {
+                "profile": {
+                    "nome": user.nome,
+                    "idade": user.idade,
+                    "grau_de_instrucao": user.grau_de_instrucao,
+                    "profissao": user.profissao,
+                    "nacionalidade": user.nacionalidade,
+                    "lingua_nativa": user.lingua_nativa
+                },
+                "raw_text": raw_text
+            }
+            try:
+                await self.bucket.acquire(estimate_plan_tokens(raw_text))
+                phases.mark("throttle")
+                started = time.monotonic()
+                try:
+                    async with self._http.stream("POST", "/ia/plan-reading/stream", json=payload) as response:
+                        if response.status_code != 200:
+                            await response.aread()
+                            await self.check_error(response.status_code, parse_retry_after(response.headers.get("retry-after")))
+                            # The request itself is wrong (e.g. text too short); retrying won't help
+                            print(f"AI service rejected Doc ID {doc_id}: {response.status_code} {response.text[:200]}")
+                            await jobs.finish(session, job_id, "rejected", phases, error=f"AI service {response.status_code}")
+                            await set_status(session, doc_id, "failed", "Reading plan generation failed")
+                            return
+                        stage_count = await self.save_stream(session, doc_id, job_id, response, phases)
+                except httpx.TransportError as e:
+                    if isinstance(e, httpx.TimeoutException):
+                        await self.limiter.on_congestion()
+                    raise RetryableError(f"AI service unreachable: {e!r}")
+            except Exception as e:
+                # Recorded for operators; the delivery itself is retried by handle()
+                await session.rollback()
+                await jobs.finish(session, job_id, "retrying", phases, error=str(e)[:500])
+                await session.commit()
+                raise
+            await self.limiter.on_success(time.monotonic() - started)
+            print(f" [x] Saved {stage_count} stages for Document {doc_id} in {phases.total_ms()} ms {phases.ms}")
+
+    async def check_error(self, status: int, retry_after: float = None):
+        # Raises RetryableError for failures worth another attempt; returns for a plain rejection
+        if status == 429:
+            self.bucket.pause(retry_after or RATE_LIMIT_PAUSE)
+            await self.limiter.on_congestion()
+            raise RetryableError("AI service rate limited", retry_after)
+        if status >= 500:
+            raise RetryableError(f"AI service error {status}")
+
+    async def save_stream(self, session, doc_id: int, job_id: int, response: httpx.Response, phases: jobs.Phases) -> int:
+        # Each stage is committed as its line arrives, so the reader can start on
+        # stage 1 while the rest are generated. Stages are upserted by position:
+        # a retry rewrites rows in place, so notes and unknown words the reader
+        # already attached to a stage stay attached.
+        stage_count = 0
+        async for line in response.aiter_lines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if "error" in item:
+                # Failed after the 200: the AI service reports it in-band
+                await self.check_error(int(item.get("status") or 500), parse_retry_after(item.get("retry_after")))
+                raise RetryableError(f"AI service error: {item['error']}")
+            if item.get("done"):
+                # The ready status and the finished job land with the last change
+                phases.mark("generate")
+                stale_refs = await self.drop_extra_stages(session, doc_id, stage_count)
+                await jobs.finish(session, job_id, "succeeded", phases, stage_count=stage_count)
+                await set_status(session, doc_id, "ready", stage_count=stage_count)
+                for ref in stale_refs:
+                    if ref:
+                        await asyncio.to_thread(textstore.store.delete, ref)
+                return stage_count
+
+            stage_count += 1
+            if stage_count == 1:
+                phases.mark("first_stage")
+            await self.add_stage(session, doc_id, stage_count, item["stage"])
+            await jobs.renew(session, job_id)
+            await set_status(session, doc_id, "planning", stage_count=stage_count)
+
+        raise RetryableError("AI service closed the plan stream early")
+
+    async def add_stage(self, session, doc_id: int, stage_index: int, stage_data: dict) -> str:
+        # Stage text goes to the text store; the row only keeps the reference
+        stage_text = stage_data.get("stage_text") or ""
+        text_ref = await asyncio.to_thread(textstore.store.put, textstore.stage_text_key(doc_id, stage_index), stage_text)
+        stmt = insert(models.ReadingStage).values(
+            document_id=doc_id,
+            stage_index=stage_index,
+            title=stage_data.get("title"),
+            objective=stage_data.get("objective"),
+            text_ref=text_ref,
+            suggested_vocab=stage_data.get("suggested_vocab"),
+            search_vector=search.stage_search_vector(stage_data.get("title"), stage_data.get("objective"), stage_text),
+        )
+        await session.execute(stmt.on_conflict_do_update(
+            index_elements=[models.ReadingStage.document_id, models.ReadingStage.stage_index],
+            set_={
+                column: stmt.excluded[column]
+                for column in ("title", "objective", "text_ref", "suggested_vocab", "search_vector")
+            },
+        ))
+        return text_ref
+
+    async def drop_extra_stages(self, session, doc_id: int, stage_count: int) -> list:
+        # An earlier, longer run left stages past the new last one. Those the
+        # reader hasn't attached anything to go; the others stay readable.
+        stage = models.ReadingStage
+        return (await session.scalars(
+            delete(stage)
+            .where(
+                stage.document_id == doc_id,
+                stage.stage_index > stage_count,
+                ~exists().where(models.CornellNote.stage_id == stage.id),
+                ~exists().where(models.UnknownWord.stage_id == stage.id),
+            )
+            .returning(stage.text_ref)
+            .execution_options(synchronize_session=False)
+        )).all()
+
+
+planner = Planner(concurrency=PLAN_CONCURRENCY, prefetch=PLAN_PREFETCH)
+
+async def run():
+    metrics.server.register("planner", planner.snapshot)
+    metrics.server.register("queue_wait", metrics.queue_wait.snapshot)
+    metrics.server.start()
+    await planner.run()
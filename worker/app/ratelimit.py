@@ -0,0 +1,112 @@
+import asyncio
+import time
+
+# Client-side flow control for the AI service. The provider enforces a
+# tokens-per-minute budget; the bucket keeps the plans we start inside it,
+# and the adaptive limiter finds how many may be in flight at once by backing
+# off on 429s and slow responses and creeping back up while calls are healthy.
+
+CHARS_PER_TOKEN = 4  # rough average for English and Portuguese text
+
+
+class TokenBucket:
+    def __init__(self, tokens_per_minute: int, burst: int = None):
+        self.rate = tokens_per_minute / 60.0
+        self.capacity = float(burst or tokens_per_minute)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: int):
+        # A request bigger than the whole bucket would never fit; it waits for a full one instead
+        tokens = min(float(tokens), self.capacity)
+        # Held while waiting, so callers are served in arrival order and a big plan isn't starved
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        # The provider told us when to come back (Retry-After); nothing starts before then
+        now = time.monotonic()
+        self._refill(now)
+        self._tokens = 0.0
+        self._paused_until = max(self._paused_until, now + seconds)
+
+    def snapshot(self) -> dict:
+        # Read-only: called from the metrics thread
+        tokens = min(self.capacity, self._tokens + (time.monotonic() - self._updated) * self.rate)
+        return {"tokens": int(tokens), "capacity": int(self.capacity), "per_second": round(self.rate, 1)}
+
+
+class AdaptiveLimiter:
+    # AIMD: +1 slot per window of healthy calls, halved on congestion. Decreases
+    # are spaced by the latency target so one burst of 429s counts as one signal.
+    def __init__(self, initial: int, minimum: int, maximum: int, latency_target: float, backoff: float = 0.5):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.in_flight = 0
+        self.decreases = 0
+        self._last_decrease = float("-inf")  # monotonic() can be below the target right after boot
+        self._changed = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        async with self._changed:
+            self.in_flight -= 1
+            self._changed.notify_all()
+
+    async def on_success(self, latency: float):
+        if latency > self.latency_target:
+            await self.on_congestion()
+            return
+        async with self._changed:
+            # Only grow while the current limit is actually in use
+            if self.in_flight >= int(self.limit) and self.limit < self.maximum:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+                self._changed.notify_all()
+
+    async def on_congestion(self):
+        now = time.monotonic()
+        if now - self._last_decrease < self.latency_target:
+            return
+        async with self._changed:
+            self._last_decrease = now
+            previous = int(self.limit)
+            self.limit = max(float(self.minimum), self.limit * self.backoff)
+            self.decreases += 1
+        if int(self.limit) != previous:
+            print(f" [!] AI service congested, plan concurrency {previous} -> {int(self.limit)}")
+
+    def snapshot(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "minimum": self.minimum,
+            "maximum": self.maximum,
+            "decreases": self.decreases,
+        }
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text or "") // CHARS_PER_TOKEN + 1
@@ -0,0 +1,43 @@
+import os
+
+from sqlalchemy import func, literal_column
+
+# Full-text search settings shared by the writers (worker, migrations) and
+# crud.search_documents. Keep in sync with backend/app/search.py; the Cornell
+# note vector is a generated column, so only the backend copy defines it.
+
+# No stemming: documents and notes come in any language. Baked into the
+# cornell_notes.search_vector generated column, so changing it needs a migration.
+SEARCH_CONFIG = "simple"
+# Extracted text is indexed in chunks of this many characters: a hit points
+# at a passage (offset/length for /text) and snippets are cut from it alone
+SEARCH_CHUNK_CHARS = int(os.getenv("SEARCH_CHUNK_CHARS", "8192"))
+
+
+def regconfig():
+    # Inlined rather than bound: asyncpg types parameters, and varchar doesn't cast to regconfig implicitly
+    return literal_column(f"'{SEARCH_CONFIG}'::regconfig")
+
+def to_tsvector(text: str):
+    return func.to_tsvector(regconfig(), text or "")
+
+def stage_search_vector(title: str, objective: str, text: str):
+    # Title and objective outrank the body
+    return (
+        func.setweight(to_tsvector(title), literal_column("'A'"))
+        .op("||")(func.setweight(to_tsvector(objective), literal_column("'B'")))
+        .op("||")(to_tsvector(text))
+    )
+
+def blob_chunk_rows(sha256: str, text: str) -> list:
+    # Rows for blob_search_chunks, ready for insert(...).values(rows)
+    return [
+        {
+            "blob_sha256": sha256,
+            "chunk_index": index,
+            "char_offset": start,
+            "char_length": len(text[start:start + SEARCH_CHUNK_CHARS]),
+            "search_vector": to_tsvector(text[start:start + SEARCH_CHUNK_CHARS]),
+        }
+        for index, start in enumerate(range(0, len(text), SEARCH_CHUNK_CHARS))
+    ]
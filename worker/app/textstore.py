@@ -0,0 +1,116 @@
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+
+# Extracted and stage text live outside Postgres, compressed in fixed-size
+# chunks so a slice only decompresses the chunks it overlaps.
+# Keep in sync with backend/app/textstore.py.
+
+TEXT_STORE = os.getenv("TEXT_STORE", "local")
+TEXT_STORE_DIR = os.getenv("TEXT_STORE_DIR", "/data/text")
+TEXT_CHUNK_CHARS = int(os.getenv("TEXT_CHUNK_CHARS", "65536"))
+TEXT_COMPRESSION_LEVEL = int(os.getenv("TEXT_COMPRESSION_LEVEL", "6"))
+
+# File layout: header, chunk_count + 1 absolute chunk offsets (u64), zlib chunks
+MAGIC = b"TXZ1"
+HEADER = struct.Struct("<4sIIQ")  # magic, chars per chunk, chunk count, total chars
+OFFSET = struct.Struct("<Q")
+
+
+def blob_text_key(sha256: str) -> str:
+    return f"blobs/{sha256[:2]}/{sha256}.txz"
+
+def stage_text_key(document_id: int, stage_index: int) -> str:
+    return f"stages/{document_id}/{stage_index}.txz"
+
+
+def encode(text: str, chunk_chars: int, level: int) -> bytes:
+    chunks = [
+        zlib.compress(text[start:start + chunk_chars].encode("utf-8"), level)
+        for start in range(0, len(text), chunk_chars)
+    ]
+    position = HEADER.size + OFFSET.size * (len(chunks) + 1)
+    offsets = []
+    for chunk in chunks:
+        offsets.append(position)
+        position += len(chunk)
+    offsets.append(position)
+    return (
+        HEADER.pack(MAGIC, chunk_chars, len(chunks), len(text))
+        + b"".join(OFFSET.pack(offset) for offset in offsets)
+        + b"".join(chunks)
+    )
+
+def decode_range(buf, offset: int = 0, length: int = None):
+    # Returns (text slice, total length in characters)
+    magic, chunk_chars, chunk_count, total = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a text store file")
+    end = total if length is None else min(total, offset + length)
+    if offset >= end:
+        return "", total
+
+    first, last = offset // chunk_chars, (end - 1) // chunk_chars
+    parts = []
+    for index in range(first, last + 1):
+        (start,) = OFFSET.unpack_from(buf, HEADER.size + OFFSET.size * index)
+        (stop,) = OFFSET.unpack_from(buf, HEADER.size + OFFSET.size * (index + 1))
+        parts.append(zlib.decompress(buf[start:stop]).decode("utf-8"))
+    skip = offset - first * chunk_chars
+    return "".join(parts)[skip:skip + end - offset], total
+
+
+class TextStore:
+    def put(self, key: str, text: str) -> str:
+        # Returns the reference to keep in the database
+        raise NotImplementedError
+
+    def read_range(self, ref: str, offset: int = 0, length: int = None):
+        raise NotImplementedError
+
+    def read(self, ref: str) -> str:
+        return self.read_range(ref)[0]
+
+    def delete(self, ref: str):
+        raise NotImplementedError
+
+
+class LocalTextStore(TextStore):
+    # Files under a shared directory (a volume mounted by the backend and the worker),
+    # read through mmap so a slice only pages in the chunks it needs
+
+    def __init__(self, root: str, chunk_chars: int, level: int):
+        self.root = root
+        self.chunk_chars = chunk_chars
+        self.level = level
+
+    def _path(self, ref: str) -> str:
+        return os.path.join(self.root, ref)
+
+    def put(self, key: str, text: str) -> str:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename: readers holding the old file keep a consistent mapping
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as out:
+            out.write(encode(text, self.chunk_chars, self.level))
+        os.replace(out.name, path)
+        return key
+
+    def read_range(self, ref: str, offset: int = 0, length: int = None):
+        with open(self._path(ref), "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            return decode_range(buf, offset, length)
+
+    def delete(self, ref: str):
+        try:
+            os.unlink(self._path(ref))
+        except FileNotFoundError:
+            pass
+
+
+STORES = {
+    "local": lambda: LocalTextStore(TEXT_STORE_DIR, TEXT_CHUNK_CHARS, TEXT_COMPRESSION_LEVEL),
+}
+
+store = STORES[TEXT_STORE]()
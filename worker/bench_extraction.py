@@ -0,0 +1,50 @@
+import os
+import sys
+import time
+
+from app import extraction
+
+# Measures extraction throughput per corpus, e.g.
+#   python bench_extraction.py born-digital=./corpus/digital scanned=./corpus/scanned mixed=./corpus/mixed
+
+CONTENT_TYPES = {
+    ".pdf": "application/pdf",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".tif": "image/tiff",
+    ".tiff": "image/tiff",
+    ".txt": "text/plain",
+}
+
+def bench_corpus(name, directory):
+    pages = text_pages = ocr_pages = files = 0
+    started = time.monotonic()
+    for filename in sorted(os.listdir(directory)):
+        content_type = CONTENT_TYPES.get(os.path.splitext(filename)[1].lower())
+        if not content_type:
+            continue
+        result = extraction.engine.extract_file(os.path.join(directory, filename), content_type)
+        files += 1
+        pages += result.pages
+        text_pages += result.text_pages
+        ocr_pages += result.ocr_pages
+    elapsed = time.monotonic() - started
+
+    print(
+        f"{name:<14} files={files:<5} pages={pages:<6} text={text_pages:<6} ocr={ocr_pages:<6} "
+        f"seconds={elapsed:<8.2f} pages/sec={pages / max(elapsed, 1e-6):.2f}"
+    )
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python bench_extraction.py name=directory [name=directory ...]")
+        sys.exit(1)
+
+    extraction.engine.start()
+    try:
+        for arg in sys.argv[1:]:
+            name, _, directory = arg.partition("=")
+            bench_corpus(name, directory)
+    finally:
+        extraction.engine.shutdown()
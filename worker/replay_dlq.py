@@ -0,0 +1,85 @@
+import json
+import sys
+import time
+
+import pika
+from sqlalchemy import update
+
+from app import database, models, events
+from app.main import RABBITMQ_HOST, RABBITMQ_USER, RABBITMQ_PASS
+from app.planner import (
+    READING_PLAN_QUEUE, READING_PLAN_QUEUE_ARGUMENTS, DEAD_LETTER_QUEUE, ERROR_HEADER, ENQUEUED_AT_HEADER,
+)
+
+# Moves parked reading-plan jobs from the dead-letter queue back onto the
+# main queue with a fresh retry budget, e.g. once the provider quota is back:
+#   python replay_dlq.py          # everything
+#   python replay_dlq.py 50       # at most 50 jobs
+#   python replay_dlq.py --list   # show what is parked, replay nothing
+#   python replay_dlq.py --from reading_plan_queue   # drain another queue, e.g. the pre-priority one
+
+def reopen_document(doc_id: int):
+    # Back to 'planning' so the reader sees the job is running again
+    with database.SessionLocal() as db:
+        row = db.execute(
+            update(models.Document)
+            .where(models.Document.id == doc_id, models.Document.status == "failed")
+            .values(status="planning", error=None, version=models.Document.version + 1)
+            .returning(models.Document.version)
+        ).first()
+        if row is not None:
+            db.execute(events.status_notification(doc_id, "planning", row.version))
+        db.commit()
+
+def replay(limit: int = None, list_only: bool = False, source: str = DEAD_LETTER_QUEUE):
+    credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
+    connection = pika.BlockingConnection(pika.ConnectionParameters(RABBITMQ_HOST, credentials=credentials))
+    channel = connection.channel()
+    channel.confirm_delivery()
+    channel.queue_declare(queue=source, passive=source != DEAD_LETTER_QUEUE, durable=True)
+    channel.queue_declare(queue=READING_PLAN_QUEUE, durable=True, arguments=READING_PLAN_QUEUE_ARGUMENTS)
+
+    moved = 0
+    while limit is None or moved < limit:
+        method, properties, body = channel.basic_get(source)
+        if method is None:
+            break
+        error = (properties.headers or {}).get(ERROR_HEADER, "")
+        if list_only:
+            print(f"{body.decode(errors='replace')}  {error}")
+            moved += 1
+            continue
+
+        try:
+            doc_id = json.loads(body)["document_id"]
+        except (ValueError, KeyError, TypeError):
+            print(f"Leaving malformed job on {source}: {body!r}")
+            channel.basic_nack(method.delivery_tag, requeue=True)
+            break
+
+        reopen_document(doc_id)
+        # No attempt header: the job starts over with the full retry budget
+        channel.basic_publish(
+            exchange="",
+            routing_key=READING_PLAN_QUEUE,
+            body=body,
+            properties=pika.BasicProperties(
+                delivery_mode=2,
+                priority=properties.priority,
+                headers={ENQUEUED_AT_HEADER: time.time()},
+            ),
+        )
+        channel.basic_ack(method.delivery_tag)
+        moved += 1
+        print(f" [x] Replayed Doc ID {doc_id} ({error})")
+
+    # Listed messages go back untouched when the channel closes
+    connection.close()
+    print(f"{moved} job(s) {'parked' if list_only else 'replayed'}")
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    list_only = "--list" in args
+    source = args[args.index("--from") + 1] if "--from" in args else DEAD_LETTER_QUEUE
+    counts = [int(a) for a in args if a.isdigit()]
+    replay(counts[0] if counts else None, list_only, source)
@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+# Unit tests run anywhere the worker's requirements are installed. Tests that
+# need Postgres use the db or sessions fixture: point TEST_DATABASE_URL at a
+# scratch database migrated to head (every table is truncated before each test).
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+if TEST_DATABASE_URL:
+    # app.database builds its engines from DATABASE_URL at import
+    os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+
+TABLES = (
+    "outbox", "plan_jobs", "unknown_words", "cornell_notes", "reading_stages",
+    "documents", "blob_search_chunks", "blobs", "users",
+)
+
+
+def truncate():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    pytest.importorskip("sqlalchemy")
+    from sqlalchemy import text
+    from app import database
+
+    with database.engine.begin() as conn:
+        conn.execute(text(f"TRUNCATE {', '.join(TABLES)} RESTART IDENTITY CASCADE"))
+
+
+@pytest.fixture
+def db():
+    truncate()
+    from app import database
+
+    session = database.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+@pytest.fixture
+def sessions():
+    # An async session factory for use inside one asyncio.run(). Not pooled:
+    # every test runs its own event loop and asyncpg connections can't move between loops.
+    truncate()
+    pytest.importorskip("asyncpg")
+    from sqlalchemy.engine import make_url
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from sqlalchemy.pool import NullPool
+
+    engine = create_async_engine(make_url(TEST_DATABASE_URL).set(drivername="postgresql+asyncpg"), poolclass=NullPool)
+    yield async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
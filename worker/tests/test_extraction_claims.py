@@ -0,0 +1,93 @@
+import json
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("pika")
+pytest.importorskip("pdfplumber")
+pytest.importorskip("pytesseract")
+
+from app import extraction, main, models, textstore
+
+SHA = "f" * 64
+BODY = json.dumps({"user_id": 1, "document_id": 1}).encode()
+
+
+class FakeChannel:
+    def __init__(self):
+        self.published = []
+        self.settled = []
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        self.published.append((routing_key, body))
+
+    def basic_ack(self, delivery_tag):
+        self.settled.append("ack")
+
+    def basic_nack(self, delivery_tag, requeue):
+        self.settled.append(("nack", requeue))
+
+
+def deliver(redelivered: bool = False) -> FakeChannel:
+    channel = FakeChannel()
+    main.process_extraction(channel, SimpleNamespace(delivery_tag=1, redelivered=redelivered), None, BODY)
+    return channel
+
+def seed(db, blob_status: str, document_status: str, claimed_at: datetime = None):
+    user = models.UserProfile(nome="Ana", lingua_nativa="Português")
+    blob = models.Blob(sha256=SHA, size_bytes=9, content_type="text/plain", storage_path="/tmp/upload",
+                       status=blob_status, claimed_at=claimed_at)
+    db.add(models.Document(user=user, blob=blob, original_filename="a.txt", status=document_status))
+    db.commit()
+
+def state(db):
+    db.expire_all()
+    blob = db.get(models.Blob, SHA)
+    return blob, db.get(models.Document, 1)
+
+@pytest.fixture
+def extracts(monkeypatch):
+    monkeypatch.setattr(extraction.engine, "extract_file", lambda path, content_type: extraction.ExtractionResult(
+        "Era uma vez", pages=1, text_pages=1, ocr_pages=0, seconds=0.01,
+    ))
+    monkeypatch.setattr(textstore.store, "put", lambda key, text: f"ref:{key}")
+
+
+def test_redelivery_after_a_crash_waits_out_the_claim_then_takes_over(db, extracts):
+    # The worker that claimed the blob died mid-OCR; RabbitMQ redelivers its job
+    seed(db, "extracting", "extracting", claimed_at=datetime.utcnow() - timedelta(seconds=60))
+
+    channel = deliver(redelivered=True)
+    assert channel.published == [(main.EXTRACTION_DEFERRED_QUEUE, BODY)]
+    assert channel.settled == ["ack"]
+    blob, document = state(db)
+    assert (blob.status, document.status) == ("extracting", "extracting")
+
+    # The deferred copy comes back after the claim has expired
+    blob.claimed_at = datetime.utcnow() - timedelta(seconds=main.EXTRACTION_CLAIM_TIMEOUT + 1)
+    db.commit()
+    channel = deliver()
+
+    assert channel.published == []
+    assert channel.settled == ["ack"]
+    blob, document = state(db)
+    assert (blob.status, blob.text_ref, document.status) == ("extracted", f"ref:{textstore.blob_text_key(SHA)}", "planning")
+    assert db.query(models.OutboxMessage).one().payload == {"user_id": 1, "document_id": 1}
+
+def test_failure_after_the_claim_releases_it_and_retries_once(db, extracts, monkeypatch):
+    seed(db, "pending", "uploaded")
+
+    def unavailable(key, text):
+        raise OSError("Text store unavailable")
+    monkeypatch.setattr(textstore.store, "put", unavailable)
+
+    assert deliver().settled == [("nack", True)]
+    blob, document = state(db)
+    assert (blob.status, blob.claimed_at, document.status) == ("pending", None, "extracting")
+
+    assert deliver(redelivered=True).settled == ["ack"]
+    blob, document = state(db)
+    assert (blob.status, document.status) == ("failed", "failed")
+    assert document.error == "Error extracting text"
+    assert db.query(models.OutboxMessage).count() == 0
@@ -0,0 +1,105 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from sqlalchemy import select, update
+
+from app import jobs, models
+
+KEY = "plan:1:abc:profile"
+
+
+@pytest.fixture
+def sessions(sessions):
+    # plan_jobs rows belong to a document
+    async def seed():
+        async with sessions() as session:
+            user = models.UserProfile(nome="Ana", lingua_nativa="Português")
+            blob = models.Blob(sha256="abc", size_bytes=1, content_type="text")
+            session.add(models.Document(user=user, blob=blob, original_filename="a.txt", status="planning"))
+            await session.commit()
+    asyncio.run(seed())
+    return sessions
+
+def run(sessions, step):
+    async def in_session():
+        async with sessions() as session:
+            return await step(session)
+    return asyncio.run(in_session())
+
+def job(sessions) -> models.PlanJob:
+    return run(sessions, lambda session: session.scalar(select(models.PlanJob)))
+
+
+def test_second_claim_of_a_running_job_is_busy(sessions):
+    job_id = run(sessions, lambda session: jobs.claim(session, KEY, 1, 1))
+    assert job_id is not None
+
+    with pytest.raises(jobs.JobBusy):
+        run(sessions, lambda session: jobs.claim(session, KEY, 1, 1))
+    assert job(sessions).attempts == 1
+
+def test_finished_job_is_never_claimed_again(sessions):
+    async def claim_and_succeed(session):
+        job_id = await jobs.claim(session, KEY, 1, 1)
+        await jobs.finish(session, job_id, "succeeded", jobs.Phases(), stage_count=3)
+        await session.commit()
+
+    run(sessions, claim_and_succeed)
+
+    assert run(sessions, lambda session: jobs.claim(session, KEY, 1, 1)) is None
+    finished = job(sessions)
+    assert (finished.status, finished.attempts, finished.stage_count) == ("succeeded", 1, 3)
+    assert finished.lease_until is None
+
+def test_retrying_job_is_claimed_again(sessions):
+    async def claim_and_fail(session):
+        job_id = await jobs.claim(session, KEY, 1, 1)
+        await jobs.finish(session, job_id, "retrying", jobs.Phases(), error="AI service error 503")
+        await session.commit()
+        return job_id
+
+    job_id = run(sessions, claim_and_fail)
+
+    assert run(sessions, lambda session: jobs.claim(session, KEY, 1, 1)) == job_id
+    retried = job(sessions)
+    assert (retried.status, retried.attempts, retried.error) == ("running", 2, None)
+
+def test_expired_lease_is_taken_over(sessions):
+    async def claim_and_crash(session):
+        job_id = await jobs.claim(session, KEY, 1, 1)
+        await session.execute(
+            update(models.PlanJob).values(worker="gone:1", lease_until=datetime.utcnow() - timedelta(seconds=1))
+        )
+        await session.commit()
+        return job_id
+
+    job_id = run(sessions, claim_and_crash)
+
+    assert run(sessions, lambda session: jobs.claim(session, KEY, 1, 1)) == job_id
+    taken = job(sessions)
+    assert taken.worker == jobs.WORKER_ID
+    assert taken.lease_until > datetime.utcnow()
+
+def test_dead_lettering_fails_the_retrying_jobs(sessions):
+    async def retry_then_dead_letter(session):
+        job_id = await jobs.claim(session, KEY, 1, 1)
+        await jobs.finish(session, job_id, "retrying", jobs.Phases(), error="AI service error 503")
+        await jobs.fail_document_jobs(session, 1, "Dead-lettered after repeated failures")
+        await session.commit()
+
+    run(sessions, retry_then_dead_letter)
+    assert job(sessions).status == "failed"
+
+def test_job_key_follows_the_profile():
+    user = models.UserProfile(nome="Ana", idade=30, lingua_nativa="Português")
+    key = jobs.plan_job_key(1, "abc", user)
+    assert jobs.plan_job_key(1, "abc", user) == key
+
+    user.created_at = datetime.utcnow()  # not sent to the AI service
+    assert jobs.plan_job_key(1, "abc", user) == key
+    user.idade = 31
+    assert jobs.plan_job_key(1, "abc", user) != key
@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+from app.ratelimit import AdaptiveLimiter, TokenBucket, estimate_tokens
+
+
+def elapsed(coro) -> float:
+    async def timed():
+        started = time.monotonic()
+        await coro
+        return time.monotonic() - started
+    return asyncio.run(timed())
+
+
+# --- TokenBucket ---
+
+def test_acquire_is_immediate_while_tokens_last():
+    bucket = TokenBucket(60_000, burst=10)  # 1000 tokens/s
+    assert elapsed(bucket.acquire(10)) < 0.005
+
+def test_acquire_waits_for_the_refill():
+    bucket = TokenBucket(60_000, burst=50)
+
+    async def drain_then_acquire():
+        await bucket.acquire(50)
+        await bucket.acquire(50)
+
+    assert elapsed(drain_then_acquire()) >= 0.045
+
+def test_request_bigger_than_the_bucket_waits_for_a_full_one():
+    bucket = TokenBucket(60_000, burst=20)
+
+    async def drain_then_acquire():
+        await bucket.acquire(20)
+        await asyncio.wait_for(bucket.acquire(10_000), timeout=1)
+
+    assert 0.015 <= elapsed(drain_then_acquire()) < 1
+
+def test_pause_holds_every_caller_back():
+    bucket = TokenBucket(60_000, burst=1000)
+    bucket.pause(0.05)
+    assert elapsed(bucket.acquire(1)) >= 0.045
+    assert bucket.snapshot()["tokens"] < 1000
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 1
+    assert estimate_tokens("x" * 400) == 101
+
+
+# --- AdaptiveLimiter ---
+
+def make_limiter(initial: int = 8, minimum: int = 1, maximum: int = 16, latency_target: float = 60):
+    return AdaptiveLimiter(initial, minimum, maximum, latency_target)
+
+def test_congestion_halves_the_limit_once_per_window():
+    limiter = make_limiter()
+
+    async def burst_of_429s():
+        for _ in range(5):
+            await limiter.on_congestion()
+
+    asyncio.run(burst_of_429s())
+    assert limiter.limit == 4
+    assert limiter.decreases == 1
+
+def test_limit_never_drops_below_the_minimum():
+    limiter = make_limiter(initial=3, minimum=2, latency_target=0)
+    for _ in range(3):
+        asyncio.run(limiter.on_congestion())
+    assert limiter.limit == 2
+
+def test_slow_call_counts_as_congestion():
+    limiter = make_limiter(latency_target=1)
+    asyncio.run(limiter.on_success(latency=1.5))
+    assert limiter.limit == 4
+
+def test_grows_only_while_the_limit_is_in_use():
+    limiter = make_limiter(initial=2)
+    asyncio.run(limiter.on_success(latency=0.1))
+    assert limiter.limit == 2
+
+    limiter.in_flight = 2
+    asyncio.run(limiter.on_success(latency=0.1))
+    assert limiter.limit == 2.5
+
+    limiter.limit = 16
+    asyncio.run(limiter.on_success(latency=0.1))
+    assert limiter.limit == 16
+
+def test_caps_calls_in_flight():
+    limiter = make_limiter(initial=2)
+    peak = 0
+
+    async def call():
+        nonlocal peak
+        async with limiter:
+            peak = max(peak, limiter.in_flight)
+            await asyncio.sleep(0.01)
+
+    async def run_all():
+        await asyncio.gather(*(call() for _ in range(6)))
+
+    assert elapsed(run_all()) >= 0.025
+    assert peak == 2
+    assert limiter.in_flight == 0
@@ -0,0 +1,146 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("aio_pika")
+pytest.importorskip("httpx")
+
+from app import jobs, planner
+
+
+class FakeExchange:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.published = []
+
+    async def publish(self, message, routing_key):
+        if self.fail:
+            raise ConnectionError("Channel closed")
+        self.published.append((routing_key, message))
+
+
+class FakeMessage:
+    def __init__(self, body=None, headers=None, priority=5):
+        self.body = body if body is not None else json.dumps({"user_id": 1, "document_id": 7}).encode()
+        self.headers = headers
+        self.priority = priority
+        self.settled = None
+
+    async def ack(self):
+        self.settled = "ack"
+
+    async def nack(self, requeue: bool = True):
+        self.settled = ("nack", requeue)
+
+
+def make_planner(plan_error: Exception = None, fail_publish: bool = False):
+    p = planner.Planner(concurrency=4, prefetch=4)
+    p._channel = SimpleNamespace(default_exchange=FakeExchange(fail_publish))
+    p.planned = []
+    p.failed = []
+
+    async def plan(user_id, doc_id, queued=None):
+        p.planned.append(doc_id)
+        if plan_error is not None:
+            raise plan_error
+
+    async def mark_failed(body):
+        p.failed.append(json.loads(body)["document_id"])
+
+    p.plan = plan
+    p.mark_failed = mark_failed
+    return p
+
+def published(p) -> list:
+    return p._channel.default_exchange.published
+
+
+def test_success_acks_without_republishing():
+    p = make_planner()
+    message = FakeMessage()
+    asyncio.run(p.handle(message))
+
+    assert p.planned == [7]
+    assert message.settled == "ack"
+    assert published(p) == []
+
+def test_retryable_error_goes_to_the_first_delay_queue():
+    p = make_planner(planner.RetryableError("AI service error 503"))
+    message = FakeMessage(headers={planner.ENQUEUED_AT_HEADER: 0.0})
+    asyncio.run(p.handle(message))
+
+    ((queue, retry),) = published(p)
+    assert queue == planner.retry_queue(planner.RETRY_DELAYS[0])
+    assert retry.headers[planner.ATTEMPT_HEADER] == 1
+    assert retry.headers[planner.ERROR_HEADER] == "AI service error 503"
+    assert retry.headers[planner.ENQUEUED_AT_HEADER] == 0.0
+    assert retry.priority == 5
+    assert message.settled == "ack"
+    assert p.retried == 1
+
+def test_retry_waits_at_least_retry_after():
+    p = make_planner(planner.RetryableError("AI service rate limited", retry_after=planner.RETRY_DELAYS[0] + 1))
+    asyncio.run(p.handle(FakeMessage()))
+
+    ((queue, _),) = published(p)
+    assert queue == planner.retry_queue(planner.RETRY_DELAYS[1])
+
+def test_later_attempts_back_off_exponentially():
+    assert [planner.retry_delay(n) for n in range(1, 4)] == [
+        planner.PLAN_RETRY_BASE_DELAY, 2 * planner.PLAN_RETRY_BASE_DELAY, 4 * planner.PLAN_RETRY_BASE_DELAY,
+    ]
+    # A Retry-After past the last delay queue gets the longest one
+    assert planner.retry_delay(1, retry_after=10 ** 6) == planner.RETRY_DELAYS[-1]
+
+def test_last_attempt_is_dead_lettered_and_the_document_failed():
+    p = make_planner(RuntimeError("boom"))
+    message = FakeMessage(headers={planner.ATTEMPT_HEADER: planner.PLAN_MAX_RETRIES})
+    asyncio.run(p.handle(message))
+
+    ((queue, parked),) = published(p)
+    assert queue == planner.DEAD_LETTER_QUEUE
+    assert parked.headers[planner.ATTEMPT_HEADER] == planner.PLAN_MAX_RETRIES + 1
+    assert parked.headers[planner.ERROR_HEADER] == "RuntimeError: boom"
+    assert p.failed == [7]
+    assert p.dead_lettered == 1
+    assert message.settled == "ack"
+
+def test_malformed_job_is_dead_lettered_at_once():
+    p = make_planner()
+    asyncio.run(p.handle(FakeMessage(body=b"not json")))
+
+    ((queue, _),) = published(p)
+    assert queue == planner.DEAD_LETTER_QUEUE
+    assert p.planned == []
+
+def test_user_over_the_cap_is_deferred():
+    p = make_planner()
+    p._running[1] = planner.PLAN_USER_CONCURRENCY
+    message = FakeMessage()
+    asyncio.run(p.handle(message))
+
+    ((queue, deferred),) = published(p)
+    assert queue == planner.DEFERRED_QUEUE
+    assert deferred.priority == 5
+    assert p.planned == []
+    assert p.deferred == 1
+    assert message.settled == "ack"
+
+def test_job_running_elsewhere_is_deferred_not_retried():
+    p = make_planner(jobs.JobBusy("Plan job is running elsewhere"))
+    asyncio.run(p.handle(FakeMessage()))
+
+    ((queue, deferred),) = published(p)
+    assert queue == planner.DEFERRED_QUEUE
+    assert planner.ATTEMPT_HEADER not in deferred.headers
+    assert p.retried == 0
+    assert p._running == {}
+
+def test_unpublishable_retry_stays_with_the_broker():
+    p = make_planner(planner.RetryableError("AI service error 502"), fail_publish=True)
+    message = FakeMessage()
+    asyncio.run(p.handle(message))
+
+    assert message.settled == ("nack", True)